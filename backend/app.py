@@ -2,24 +2,56 @@ import os
 import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from PyPDF2 import PdfReader
 import fitz  # PyMuPDF
 import base64
+import io
+import mmap
+import tempfile
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
 
+from document_store import DocumentStore
+from pdf_workers import extract_page_range as _extract_page_range, render_pages as _render_pages
+
 # Add these imports
 import re
+import math
 import time
+import hashlib
+from collections import OrderedDict, deque
+from functools import lru_cache
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+# Faster JSON for the per-token SSE path; stdlib json fallback when missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumpb = orjson.dumps
+else:
+    _json_loads = json.loads
+    def _json_dumpb(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "DEBUG").upper())
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
@@ -29,113 +61,436 @@ CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 # Configuration
 app.config["UPLOAD_FOLDER"] = "./uploads"
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-os.makedirs("./documents", exist_ok=True)
+EMBEDDING_CACHE_DIR = "./documents"  # Persisted chunk embeddings, keyed by content hash
+os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+EMBEDDING_TEXT_CACHE_DIR = os.getenv("EMBEDDING_TEXT_CACHE_DIR", "./embedding_cache")  # Per-chunk vectors
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", "./text_cache")  # Extracted PDF text, keyed by file SHA-256
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "./ocr_cache")  # Vision OCR text per rendered page image
 
 # API endpoints
 # Prefer local Ollama by default (http://localhost:11434). Can be overridden via OLLAMA_BASE_URL.
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 LLM_API_URL = f"{OLLAMA_BASE_URL}/v1"
 OLLAMA_NATIVE_API = f"{OLLAMA_BASE_URL}/api"
-EMBEDDING_ENDPOINT = f"{LLM_API_URL}/embeddings"
+EMBEDDING_ENDPOINT = f"{OLLAMA_NATIVE_API}/embed"  # Native endpoint; accepts a string or a list of inputs
+EMBEDDING_TIMEOUT = 120  # Seconds per embedding request (a batch can be large)
 CHAT_ENDPOINT = f"{LLM_API_URL}/chat/completions"
 EMBEDDING_MODEL = "bge-m3"
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gemma2:27b")
 VISION_MODEL = os.getenv("VISION_MODEL", "")
 
-# Store uploaded documents in memory
-document_store = {}
+# Optional GPU scoring for very large documents, e.g. RETRIEVAL_DEVICE=cuda or mps (needs PyTorch)
+RETRIEVAL_DEVICE = os.getenv("RETRIEVAL_DEVICE", "").strip().lower()
+GPU_MIN_CHUNKS = int(os.getenv("GPU_MIN_CHUNKS", "50000"))
+torch = None
+if RETRIEVAL_DEVICE:
+    try:
+        import torch
+    except ImportError:
+        logger.warning(f"RETRIEVAL_DEVICE={RETRIEVAL_DEVICE} set but PyTorch is not installed; using CPU retrieval")
+
+# Shared HTTP session so every LLM call (embeddings, chat, OCR, extraction, model list)
+# reuses keep-alive connections. Only failures where the server never ran the request
+# (connect errors, 429/502/503/504) are retried; a read timeout is not, since replaying a
+# generation POST would repeat the full model call
+SESSION = requests.Session()
+_http_retry = Retry(
+    total=2,
+    read=0,
+    backoff_factor=0.2,
+    status_forcelist=(429, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    raise_on_status=False,
+)
+_http_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=_http_retry)
+SESSION.mount("http://", _http_adapter)
+SESSION.mount("https://", _http_adapter)
+
+# Store uploaded documents in memory; least recently used ones spill to disk past the limit
+DOCUMENT_STORE_MAX_DOCS = int(os.getenv("DOCUMENT_STORE_MAX_DOCS", "64"))
+document_store = DocumentStore(
+    max_resident=DOCUMENT_STORE_MAX_DOCS,
+    offload_root=os.path.join(EMBEDDING_CACHE_DIR, "offload"),
+    transient_keys=("gpu_matrix",),
+)
 jobs_store: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()  # Guards jobs_store, every job entry in it, and _jobs_by_key
+_jobs_by_key: Dict[str, str] = {}  # job_key -> latest job_id, for O(1) de-dup
+JOB_MAX_EVENTS = 200  # Most recent log events kept per job
+
+def _job_events(j: Dict[str, Any]) -> deque:
+    """A job's bounded event log, created on first use. Caller holds _jobs_lock."""
+    events = j.get('events')
+    if events is None:
+        events = j['events'] = deque(maxlen=JOB_MAX_EVENTS)
+    return events
+
+def _update_job(job_id: str, message: Optional[str] = None, **fields: Any) -> None:
+    """Set `fields` on a job and optionally log an event; a no-op once the job is deleted."""
+    with _jobs_lock:
+        j = jobs_store.get(job_id)
+        if j is None:
+            return
+        now = _utcnow_iso()
+        j.update(fields)
+        j['updated_at'] = now
+        if message:
+            _job_events(j).append({'ts': now, 'message': message})
+
+def _copy_job(j: Dict[str, Any], with_events: bool = True) -> Dict[str, Any]:
+    """Copy of a job entry that is safe to serialize while its worker keeps updating it. Caller holds _jobs_lock."""
+    item = {k: v for k, v in j.items() if k != 'events'}
+    if with_events:
+        item['events'] = list(j.get('events', ()))
+    return item
+
+def _job_snapshot(job_id: str) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        j = jobs_store.get(job_id)
+        return None if j is None else _copy_job(j)
+
+def _active_job_for_key(job_key: str) -> Optional[str]:
+    """Id of a queued or running job with `job_key`, if any. Caller holds _jobs_lock."""
+    job_id = _jobs_by_key.get(job_key)
+    if job_id is not None and jobs_store.get(job_id, {}).get('status') in ('queued', 'running'):
+        return job_id
+    return None
+# Extraction jobs each hold a long vision-model call; run a fixed number at a time and queue the rest
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="jobs")
+_job_futures: Dict[str, Future] = {}  # job_id -> pending future, so cancel can drop queued work; guarded by _jobs_lock
+
+def _submit_job(job_id: str, worker) -> None:
+    """Queue a job's worker on the pool. Must not be called while holding _jobs_lock."""
+    future = _job_executor.submit(worker)
+    with _jobs_lock:
+        _job_futures[job_id] = future
+    future.add_done_callback(lambda f: _forget_job_future(job_id, f))
+
+def _forget_job_future(job_id: str, future: Future) -> None:
+    with _jobs_lock:
+        if _job_futures.get(job_id) is future:
+            del _job_futures[job_id]
 
 def _jobs_dir() -> Path:
     p = Path("./tmp/runs/jobs")
     p.mkdir(parents=True, exist_ok=True)
     return p
 
+def _write_json(path: Path, obj: Any, indent: bool = False) -> None:
+    """Serialize `obj` straight to bytes and write it in binary mode (no intermediate str)."""
+    if orjson is not None:
+        payload = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    else:
+        payload = json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(payload)
+
+def _save_job_artifacts(job_id: str, result: Dict[str, Any]) -> None:
+    """Write a finished job's wrapper (indented, for people) and compact summary under tmp/runs/jobs/<job_id>."""
+    out_dir = _jobs_dir() / job_id
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _write_json(out_dir / "result.wrapper.json", result["wrapper"], indent=True)
+    _write_json(out_dir / "summary.json", {k: v for k, v in result.items() if k != "wrapper"})
+
+def _wrapper_quality(wrapper: Dict[str, Any]) -> Dict[str, Any]:
+    """schema_ok/overall_confidence of a finished wrapper, kept on the job entry so job listings skip the disk."""
+    meta = wrapper.get('meta', {}) if isinstance(wrapper, dict) else {}
+    return {
+        'schema_ok': meta.get('validation', {}).get('schema_ok'),
+        'overall_confidence': meta.get('overall_confidence'),
+    }
+
 # Request logging middleware
 @app.before_request
 def log_request():
-    logger.debug(f"Request received: {request.method} {request.path}")
+    # Formatting headers/form is per-request work; skip it entirely above DEBUG
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("Request received: %s %s", request.method, request.path)
     if not request.path.startswith('/static/'):
-        logger.debug(f"Headers: {request.headers}")
+        logger.debug("Headers: %s", request.headers)
         if request.method == 'POST':
-            logger.debug(f"Form data: {request.form}")
+            logger.debug("Form data: %s", request.form)
 
 # Helper functions
 def read_text_file(file_path):
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            # Decode straight from the mapped pages; f.read() would hold the bytes and the
+            # decoded str at once, doubling peak memory for large uploads
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, "utf-8")
+        # Universal newlines, as text-mode open() would give
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
     except Exception as e:
         logger.error(f"Error reading text file: {e}")
         return ""
 
+PDF_PARALLEL_MIN_PAGES = 32  # Smaller PDFs are extracted serially to avoid pool overhead
+PDF_EXTRACT_WORKERS = max(1, min(8, os.cpu_count() or 1))
+PDF_MIN_PAGES_PER_WORKER = 8  # Each worker reopens the file, so don't split ranges thinner than this
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Lazily start the shared process pool used for PDF text extraction and rendering.
+
+    The pool is created after request and job threads are running, so workers are not
+    forked from this process (a fork could copy a lock held by another thread); they
+    come from a forkserver, or are spawned where forkserver is unavailable.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                # Workers run functions from pdf_workers only; preloading __main__ (the
+                # default) would rerun this module's startup, e.g. the document store
+                ctx.set_forkserver_preload(["pdf_workers"])
+            else:
+                ctx = multiprocessing.get_context("spawn")
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=ctx)
+        return _pdf_pool
+
 def read_pdf_file(file_path):
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text
+        with fitz.open(file_path) as doc:
+            num_pages = doc.page_count
+            parallel = num_pages >= PDF_PARALLEL_MIN_PAGES and PDF_EXTRACT_WORKERS > 1
+            page_texts = [] if parallel else [page.get_text("text") for page in doc]
+        if parallel:
+            # MuPDF holds the GIL and is not thread-safe; spread contiguous page ranges over processes
+            workers = min(PDF_EXTRACT_WORKERS, math.ceil(num_pages / PDF_MIN_PAGES_PER_WORKER))
+            step = math.ceil(num_pages / workers)
+            starts = list(range(0, num_pages, step))
+            stops = [min(start + step, num_pages) for start in starts]
+            pool = _get_pdf_pool()
+            page_texts = [t for part in pool.map(_extract_page_range, [file_path] * len(starts), starts, stops) for t in part]
+        # Collect page texts and join once; repeated += copies the growing string
+        parts = [t for t in page_texts if t]
+        return "\n".join(parts) + "\n" if parts else ""
     except Exception as e:
         logger.error(f"Error reading PDF file: {e}")
         return ""
 
-def render_pdf_to_images_b64(file_path: str, scale: float = 2.0, max_pages: int = 0) -> List[str]:
-    """Render PDF pages to base64-encoded PNG images using PyMuPDF.
+def read_pdf_file_cached(file_path: str, file_sha: str) -> str:
+    """read_pdf_file, memoized on disk by the file's SHA-256 so re-uploads skip parsing."""
+    cache_path = os.path.join(TEXT_CACHE_DIR, f"{file_sha}.txt")
+    try:
+        with open(cache_path, "r", encoding="utf-8", errors="surrogatepass") as f:
+            logger.info(f"Using cached text extraction for {file_path}")
+            return f.read()
+    except FileNotFoundError:
+        pass
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning(f"Could not read text cache {cache_path}: {e}")
+    
+    text = read_pdf_file(file_path)
+    if text:
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8", errors="surrogatepass") as f:
+                f.write(text)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write text cache {cache_path}: {e}")
+    return text
+
+RENDER_PARALLEL_MIN_PAGES = 4  # Rasterizing costs tens of ms per page, so fan out even short PDFs
+# Page images sent to vision models: "jpeg" (several times smaller for scanned pages) or "png"
+RENDER_IMAGE_FORMAT = os.getenv("RENDER_IMAGE_FORMAT", "jpeg").strip().lower()
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", "85"))
+
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "./render_cache")  # Encoded page images per (file, page, scale, format)
+
+def _render_cache_path(file_sha: str, page: int, scale: float, image_format: str) -> str:
+    if image_format in ("jpeg", "jpg"):
+        variant = f"q{RENDER_JPEG_QUALITY}.jpg"
+    else:
+        variant = "png"
+    return os.path.join(RENDER_CACHE_DIR, file_sha[:2], f"{file_sha}-{page}-{scale:g}.{variant}")
+
+def render_pdf_to_images_b64(file_path: str, scale: float = 2.0, max_pages: int = 0,
+                             image_format: str = RENDER_IMAGE_FORMAT) -> List[str]:
+    """Render PDF pages to base64-encoded images using PyMuPDF.
     scale: 2.0 ~ 144 DPI (approx), higher gives sharper OCR but slower.
     max_pages: limit number of pages (0 = all).
+    image_format: "jpeg" (quality RENDER_JPEG_QUALITY) or "png".
+    Encoded pages are cached on disk by file SHA-256, page, scale and format, so
+    re-runs (e.g. another model on the same file) skip rasterization. Cache misses
+    from multi-page documents are rendered in slices on the PDF process pool.
     """
     images_b64: List[str] = []
     try:
-        doc = fitz.open(file_path)
-        page_count = len(doc)
-        pages = range(page_count) if max_pages <= 0 else range(min(max_pages, page_count))
-        mat = fitz.Matrix(scale, scale)
-        for i in pages:
-            page = doc.load_page(i)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            png_bytes = pix.tobytes("png")
-            images_b64.append(base64.b64encode(png_bytes).decode("utf-8"))
-        doc.close()
+        with fitz.open(file_path) as doc:
+            page_count = len(doc)
+        num_pages = page_count if max_pages <= 0 else min(max_pages, page_count)
+        file_sha = _sha256_file(file_path)
+        cache_paths = [_render_cache_path(file_sha, i, scale, image_format) for i in range(num_pages)]
+        images: List[Optional[bytes]] = [None] * num_pages
+        for i, path in enumerate(cache_paths):
+            try:
+                with open(path, "rb") as f:
+                    images[i] = f.read()
+            except OSError:
+                pass
+        missing = [i for i, image in enumerate(images) if image is None]
+        if len(missing) >= RENDER_PARALLEL_MIN_PAGES and PDF_EXTRACT_WORKERS > 1:
+            # MuPDF holds the GIL and is not thread-safe; split pages over processes in contiguous slices
+            workers = min(PDF_EXTRACT_WORKERS, len(missing))
+            step = math.ceil(len(missing) / workers)
+            slices = [missing[start:start + step] for start in range(0, len(missing), step)]
+            n = len(slices)
+            parts = _get_pdf_pool().map(_render_pages, [file_path] * n, slices, [scale] * n, [image_format] * n,
+                                        [RENDER_JPEG_QUALITY] * n)
+            rendered = [image for part in parts for image in part]
+        elif missing:
+            rendered = _render_pages(file_path, missing, scale, image_format, RENDER_JPEG_QUALITY)
+        else:
+            rendered = []
+        for i, image in zip(missing, rendered):
+            images[i] = image
+            tmp_path = f"{cache_paths[i]}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(cache_paths[i]), exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(image)
+                os.replace(tmp_path, cache_paths[i])
+            except OSError as e:
+                logger.warning(f"Could not write render cache {cache_paths[i]}: {e}")
+        images_b64 = [base64.b64encode(image).decode("utf-8") for image in images]
     except Exception as e:
         logger.exception(f"Error rendering PDF to images: {e}")
     return images_b64
 
-def ocr_pdf_with_vlm(file_path: str, vision_model: str = VISION_MODEL, pages_limit: int = 0) -> str:
-    """Use a vision LLM via Ollama's native /api/generate endpoint to transcribe a scanned PDF."""
-    images = render_pdf_to_images_b64(file_path, scale=2.0, max_pages=pages_limit)
-    if not images:
+def _ocr_cache_path(image_b64: str, vision_model: str) -> str:
+    """Per-page OCR cache file, keyed by SHA-256 of the vision model and the rendered page image."""
+    key = hashlib.sha256(f"{vision_model}\0{image_b64}".encode("ascii")).hexdigest()
+    return os.path.join(OCR_CACHE_DIR, key[:2], f"{key}.txt")
+
+def _read_ocr_cache(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning(f"Could not read OCR cache {path}: {e}")
+        return None
+
+def _write_ocr_cache(path: str, text: str) -> None:
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write OCR cache {path}: {e}")
+
+OCR_PROMPT = (
+    "You are an OCR assistant. Transcribe the page content faithfully into plain text. "
+    "Preserve reading order, bullet points, and approximate tables as tab-separated text. "
+    "Do not add commentary or headers; output only the transcribed text."
+)
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", "4")))  # Page OCR requests in flight per document
+
+def _ocr_page(idx: int, img: str, vision_model: str) -> str:
+    """Transcribe one rendered page; empty string on failure."""
+    # Identical page renders (re-uploads, shared cover pages) skip the model call
+    cache_path = _ocr_cache_path(img, vision_model)
+    cached = _read_ocr_cache(cache_path)
+    if cached is not None:
+        return cached
+    try:
+        resp = SESSION.post(
+            f"{OLLAMA_NATIVE_API}/generate",
+            json={
+                "model": vision_model,
+                "prompt": OCR_PROMPT,
+                "images": [img],
+                "stream": False
+            },
+            timeout=120
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        page_text = (data.get("response", "") or data.get("data", "")).strip()
+        if page_text:
+            _write_ocr_cache(cache_path, page_text)
+        else:
+            logger.warning(f"Empty OCR response for page {idx+1}")
+        return page_text
+    except Exception as e:
+        logger.exception(f"Vision OCR failed on page {idx+1}: {e}")
         return ""
-    prompt = (
-        "You are an OCR assistant. Transcribe the page content faithfully into plain text. "
-        "Preserve reading order, bullet points, and approximate tables as tab-separated text. "
-        "Do not add commentary or headers; output only the transcribed text."
-    )
-    all_text: List[str] = []
-    for idx, img in enumerate(images):
+
+# Pages transcribed per /api/generate call. >1 shares one prompt prefill across several
+# pages, but needs a vision model that handles multiple images and follows the page markers
+OCR_PAGES_PER_REQUEST = max(1, int(os.getenv("OCR_PAGES_PER_REQUEST", "1")))
+OCR_BATCH_INSTRUCTIONS = (
+    " You are given {count} page images in order. Transcribe each one separately and wrap "
+    "page k's text as <<PAGE k>> ... <</PAGE>>, for k = 1 to {count}."
+)
+_OCR_PAGE_RE = re.compile(r"<<PAGE\s*(\d+)>>(.*?)<</PAGE>>", re.S)
+
+def _ocr_page_group(first_idx: int, imgs: List[str], vision_model: str) -> List[str]:
+    """Transcribe consecutive pages in one multi-image request, falling back to per-page calls."""
+    cache_paths = [_ocr_cache_path(img, vision_model) for img in imgs]
+    texts = [_read_ocr_cache(path) for path in cache_paths]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if len(missing) > 1:
         try:
-            resp = requests.post(
+            resp = SESSION.post(
                 f"{OLLAMA_NATIVE_API}/generate",
                 json={
                     "model": vision_model,
-                    "prompt": prompt,
-                    "images": [img],
+                    "prompt": OCR_PROMPT + OCR_BATCH_INSTRUCTIONS.format(count=len(missing)),
+                    "images": [imgs[i] for i in missing],
                     "stream": False
                 },
-                timeout=120
+                timeout=120 * len(missing)
             )
             resp.raise_for_status()
             data = resp.json()
-            page_text = data.get("response", "") or data.get("data", "")
-            if page_text:
-                all_text.append(page_text.strip())
-            else:
-                logger.warning(f"Empty OCR response for page {idx+1}")
+            pages = {int(k): t.strip() for k, t in _OCR_PAGE_RE.findall(data.get("response", "") or "")}
+            if all(pages.get(k) for k in range(1, len(missing) + 1)):
+                for k, i in enumerate(missing, start=1):
+                    texts[i] = pages[k]
+                    _write_ocr_cache(cache_paths[i], pages[k])
+                return texts
+            logger.warning(f"Batched OCR response for pages {first_idx+1}-{first_idx+len(imgs)} "
+                           f"was not split into {len(missing)} pages; retrying page by page")
         except Exception as e:
-            logger.exception(f"Vision OCR failed on page {idx+1}: {e}")
-    return "\n\n".join(all_text).strip()
+            logger.warning(f"Batched OCR failed for pages {first_idx+1}-{first_idx+len(imgs)}: {e}")
+    return [text if text is not None else _ocr_page(first_idx + i, imgs[i], vision_model)
+            for i, text in enumerate(texts)]
+
+def ocr_pdf_with_vlm(file_path: str, vision_model: str = VISION_MODEL, pages_limit: int = 0) -> str:
+    """Use a vision LLM via Ollama's native /api/generate endpoint to transcribe a scanned PDF.
+
+    Pages (or groups of OCR_PAGES_PER_REQUEST pages) are sent concurrently, at
+    most OCR_WORKERS requests at a time; the text is joined back in page order.
+    """
+    images = render_pdf_to_images_b64(file_path, scale=2.0, max_pages=pages_limit)
+    if not images:
+        return ""
+    step = OCR_PAGES_PER_REQUEST
+    starts = list(range(0, len(images), step))
+    groups = [images[start:start + step] for start in starts]
+    models = [vision_model] * len(groups)
+    if len(groups) == 1 or OCR_WORKERS == 1:
+        group_texts = list(map(_ocr_page_group, starts, groups, models))
+    else:
+        with ThreadPoolExecutor(max_workers=min(OCR_WORKERS, len(groups)), thread_name_prefix="ocr") as pool:
+            group_texts = list(pool.map(_ocr_page_group, starts, groups, models))
+    return "\n\n".join(t for texts in group_texts for t in texts if t).strip()
 
 # ----------------------------
 # EntryDetail Extraction (Vision-only, wrapper output)
@@ -145,8 +500,13 @@ def _utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+@lru_cache(maxsize=32)
 def _read_text_candidates(rel_path: str) -> str:
-    """Read a text file trying common roots (repo root, backend/)."""
+    """Read a text file trying common roots (repo root, backend/).
+
+    Cached per path: the prompt files are static, so each job reuses the
+    same strings instead of re-reading them (restart to pick up edits).
+    """
     here = Path(__file__).resolve().parent
     candidates = [
         here.parent / rel_path,   # project root relative
@@ -161,65 +521,158 @@ def _read_text_candidates(rel_path: str) -> str:
     return ""
 
 
+FILE_COPY_CHUNK = 64 * 1024  # Read size for streaming uploads and hashing files
+
+HASH_BLOCK_SIZE = 1024 * 1024  # Read size when hashing whole files on Pythons without file_digest
+
+FILE_SHA_CACHE_SIZE = 1024  # Distinct (path, size, mtime) digests kept in the LRU below
+_file_sha_cache: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_file_sha_lock = threading.Lock()
+
+def _file_sha_key(path: str) -> Tuple[str, int, int]:
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+def _remember_file_sha(path: str, digest: str) -> None:
+    """Record the digest of a file that was hashed while being written."""
+    key = _file_sha_key(path)
+    with _file_sha_lock:
+        _file_sha_cache[key] = digest
+        _file_sha_cache.move_to_end(key)
+        if len(_file_sha_cache) > FILE_SHA_CACHE_SIZE:
+            _file_sha_cache.popitem(last=False)
+
 def _sha256_file(path: str) -> str:
-    import hashlib
+    """SHA-256 of a file, reused while its size and mtime are unchanged (job re-submits, re-renders)."""
+    key = _file_sha_key(path)
+    with _file_sha_lock:
+        digest = _file_sha_cache.get(key)
+        if digest is not None:
+            _file_sha_cache.move_to_end(key)
+            return digest
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: the read/update loop runs in C
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        else:
+            h = hashlib.sha256()
+            buf = bytearray(HASH_BLOCK_SIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                h.update(view[:n])
+            digest = h.hexdigest()
+    _remember_file_sha(path, digest)
+    return digest
+
+def _upload_fd(stream) -> Optional[int]:
+    """OS file descriptor behind an upload stream, or None if it is still in memory."""
+    # Werkzeug spools uploads under 500 KB in memory; fileno() would force them to disk
+    if isinstance(stream, tempfile.SpooledTemporaryFile) and not getattr(stream, "_rolled", True):
+        return None
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+def _save_upload_zero_copy(in_fd: int, offset: int, save_path: str) -> str:
+    """Hash a disk-backed upload through mmap and copy it in-kernel with sendfile."""
+    size = os.fstat(in_fd).st_size - offset
     h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            h.update(chunk)
+    with open(save_path, "wb") as out:
+        if size <= 0:
+            return h.hexdigest()
+        with mmap.mmap(in_fd, 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                h.update(view[offset:])
+            finally:
+                view.release()
+        out_fd = out.fileno()
+        sent = 0
+        while sent < size:
+            n = os.sendfile(out_fd, in_fd, offset + sent, size - sent)
+            if n == 0:
+                raise OSError("sendfile made no progress")
+            sent += n
     return h.hexdigest()
 
+def _save_upload(file_storage, save_path: str) -> str:
+    """Save an uploaded file and return its SHA-256.
 
-def _format_wrapper_schema() -> Dict[str, Any]:
-    # Lightweight JSON schema for the wrapper to guide structured output
-    return {
-        "type": "object",
-        "required": ["schema_id", "schema_version", "data", "meta"],
-        "properties": {
-            "schema_id": {"type": "string", "const": "EntryDetailExtraction"},
-            "schema_version": {"type": "string", "const": "1.0"},
-            "data": {"type": "object"},
-            "meta": {
-                "type": "object",
-                "required": ["agent_version", "model", "generated_at", "job_id", "overall_confidence", "validation"],
-                "properties": {
-                    "agent_version": {"type": "string"},
-                    "model": {"type": "string"},
-                    "generated_at": {"type": "string"},
-                    "job_id": {"type": "string"},
-                    "overall_confidence": {"type": "number", "minimum": 0, "maximum": 1},
-                    "field_confidence": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "required": ["path", "confidence"],
-                            "properties": {"path": {"type": "string"}, "confidence": {"type": "number"}}
-                        }
-                    },
-                    "field_evidence": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "required": ["path", "evidence"],
-                            "properties": {
-                                "path": {"type": "string"},
-                                "evidence": {"type": "array"}
-                            }
-                        }
-                    },
-                    "validation": {
+    Disk-backed uploads are copied with os.sendfile (no userspace buffers);
+    small in-memory ones are streamed in 64 KB chunks and hashed on the way.
+    """
+    stream = file_storage.stream
+    in_fd = _upload_fd(stream) if hasattr(os, "sendfile") else None
+    if in_fd is not None:
+        offset = stream.tell()
+        try:
+            return _save_upload_zero_copy(in_fd, offset, save_path)
+        except (OSError, ValueError) as e:
+            logger.debug(f"sendfile copy failed, falling back to buffered copy: {e}")
+            stream.seek(offset)
+    
+    h = hashlib.sha256()
+    with open(save_path, "wb", buffering=1 << 20) as out:
+        for chunk in iter(lambda: stream.read(FILE_COPY_CHUNK), b''):
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+# Lightweight JSON schema for the wrapper to guide structured output; built once, shared by every job
+_WRAPPER_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": ["schema_id", "schema_version", "data", "meta"],
+    "properties": {
+        "schema_id": {"type": "string", "const": "EntryDetailExtraction"},
+        "schema_version": {"type": "string", "const": "1.0"},
+        "data": {"type": "object"},
+        "meta": {
+            "type": "object",
+            "required": ["agent_version", "model", "generated_at", "job_id", "overall_confidence", "validation"],
+            "properties": {
+                "agent_version": {"type": "string"},
+                "model": {"type": "string"},
+                "generated_at": {"type": "string"},
+                "job_id": {"type": "string"},
+                "overall_confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                "field_confidence": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "required": ["path", "confidence"],
+                        "properties": {"path": {"type": "string"}, "confidence": {"type": "number"}}
+                    }
+                },
+                "field_evidence": {
+                    "type": "array",
+                    "items": {
                         "type": "object",
-                        "required": ["schema_ok"],
+                        "required": ["path", "evidence"],
                         "properties": {
-                            "schema_ok": {"type": "boolean"},
-                            "missing_required": {"type": "array"},
-                            "warnings": {"type": "array"}
+                            "path": {"type": "string"},
+                            "evidence": {"type": "array"}
                         }
                     }
+                },
+                "validation": {
+                    "type": "object",
+                    "required": ["schema_ok"],
+                    "properties": {
+                        "schema_ok": {"type": "boolean"},
+                        "missing_required": {"type": "array"},
+                        "warnings": {"type": "array"}
+                    }
                 }
             }
         }
     }
+}
+
+
+def _format_wrapper_schema() -> Dict[str, Any]:
+    """Schema passed as Ollama's `format`; the shared dict must not be mutated."""
+    return _WRAPPER_SCHEMA
 
 
 def _local_validate_entrydetail(data_obj: Dict[str, Any]) -> Dict[str, Any]:
@@ -242,14 +695,16 @@ def _local_validate_entrydetail(data_obj: Dict[str, Any]) -> Dict[str, Any]:
     lines = data_obj.get("lines", []) or []
     if not isinstance(lines, list) or len(lines) < 1:
         report["missing_required"].append("lines[1]")
-    for i, line in enumerate(lines):
-        qty = (line or {}).get("quantity", []) or []
-        if len(qty) != 2:
+    # Non-list values were already reported above; non-dict lines are checked as empty
+    for i, line in enumerate(lines if isinstance(lines, list) else ()):
+        ld = line if isinstance(line, dict) else {}
+        qty = ld.get("quantity")
+        if not isinstance(qty, list) or len(qty) != 2:
             report["warnings"].append(f"line[{i}].quantity should contain exactly 2 records")
-        total_qty = (line or {}).get("totalQty")
+        total_qty = ld.get("totalQty")
         if isinstance(total_qty, (int, float)) and total_qty < 1.0:
             report["warnings"].append(f"line[{i}].totalQty < 1.0 (min)")
-        value_amt = (line or {}).get("valueGoodsAmt")
+        value_amt = ld.get("valueGoodsAmt")
         if isinstance(value_amt, (int, float)) and value_amt < 0.01:
             report["warnings"].append(f"line[{i}].valueGoodsAmt < 0.01 (min)")
 
@@ -271,47 +726,46 @@ def _postprocess_meta(wrapper_obj: Dict[str, Any]) -> None:
                 paths_with_evidence.add(p)
         except Exception:
             continue
+    # One pass caps unsupported confidences and sums the capped values; any malformed
+    # entry makes the average unreliable, so it falls back to 0.5
+    total = 0.0
+    averagable = bool(fc)
     for item in fc:
         try:
-            p = item.get("path")
             c = float(item.get("confidence", 0))
-            if p not in paths_with_evidence and c > 0.5:
-                item["confidence"] = 0.5
-        except Exception:
+        except (AttributeError, TypeError, ValueError):
+            averagable = False
             continue
-    if fc:
-        try:
-            vals = [float(x.get("confidence", 0)) for x in fc]
-            overall = sum(vals) / max(len(vals), 1)
-            meta.setdefault("overall_confidence", overall)
-        except Exception:
-            meta.setdefault("overall_confidence", 0.5)
-    else:
-        meta.setdefault("overall_confidence", 0.5)
+        if item.get("path") not in paths_with_evidence and c > 0.5:
+            item["confidence"] = c = 0.5
+        total += c
+    meta.setdefault("overall_confidence", total / len(fc) if averagable else 0.5)
 
 
 def _collect_non_null_leaf_paths(data: Any, base: str = "") -> List[str]:
+    """Paths of all non-null primitive leaves under `data`, in depth-first order."""
     paths = []
-    if isinstance(data, dict):
-        for k, v in data.items():
-            sub = f"{base}.{k}" if base else k
-            paths.extend(_collect_non_null_leaf_paths(v, sub))
-    elif isinstance(data, list):
-        for i, v in enumerate(data):
-            sub = f"{base}[{i}]"
-            paths.extend(_collect_non_null_leaf_paths(v, sub))
-    else:
-        # primitive leaf
-        if data is not None:
-            paths.append(base)
+    # Explicit stack instead of recursion; children are pushed in reverse to keep document order
+    stack = [(base, data)]
+    while stack:
+        path, node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend((f"{path}.{k}" if path else k, v) for k, v in reversed(node.items()))
+        elif isinstance(node, list):
+            stack.extend((f"{path}[{i}]", node[i]) for i in range(len(node) - 1, -1, -1))
+        elif node is not None:
+            paths.append(path)
     return paths
 
 
-def _validate_evidence(wrapper_obj: Dict[str, Any]) -> List[str]:
-    """Return list of non-null data paths that lack any evidence entries."""
-    data_obj = wrapper_obj.get("data", {})
+def _validate_evidence(wrapper_obj: Dict[str, Any], non_null_paths: Optional[List[str]] = None) -> List[str]:
+    """Return list of non-null data paths that lack any evidence entries.
+
+    Pass `non_null_paths` when the caller has already collected them for the wrapper's data.
+    """
     meta = wrapper_obj.get("meta", {})
-    non_null_paths = set(_collect_non_null_leaf_paths(data_obj))
+    if non_null_paths is None:
+        non_null_paths = _collect_non_null_leaf_paths(wrapper_obj.get("data", {}))
     evidence = meta.get("field_evidence", []) or []
     paths_with_ev = set()
     for item in evidence:
@@ -322,37 +776,39 @@ def _validate_evidence(wrapper_obj: Dict[str, Any]) -> List[str]:
                 paths_with_ev.add(p)
         except Exception:
             continue
-    missing = sorted([p for p in non_null_paths if p not in paths_with_ev])
+    missing = sorted({p for p in non_null_paths if p not in paths_with_ev})
     return missing
 
 
+_PATH_TOKEN_RE = re.compile(r"\[([^\]]*)\]|([^.\[]+)")
+
+@lru_cache(maxsize=1024)
+def _parse_path(path: str) -> Optional[Tuple[Any, ...]]:
+    """Split 'a.b[0].c' into ('a', 'b', 0, 'c'); None if an index is not an integer or a bracket is unclosed."""
+    if path.count("[") != path.count("]"):
+        return None
+    tokens: List[Any] = []
+    for index, key in _PATH_TOKEN_RE.findall(path):
+        if key:
+            tokens.append(key)
+            continue
+        try:
+            tokens.append(int(index))
+        except ValueError:
+            return None
+    return tuple(tokens)
+
+
 def _get_by_path(data: Any, path: str) -> Any:
+    tokens = _parse_path(path)
+    if tokens is None:
+        return None
     cur = data
-    i = 0
-    while i < len(path):
-        if path[i] == '[':
-            j = path.find(']', i)
-            if j == -1:
-                return None
-            idx = path[i+1:j]
-            try:
-                cur = cur[int(idx)]
-            except Exception:
-                return None
-            i = j + 1
-        else:
-            # read key until '.' or '[' or end
-            j = i
-            while j < len(path) and path[j] not in '.[':
-                j += 1
-            key = path[i:j]
-            try:
-                cur = cur[key]
-            except Exception:
-                return None
-            i = j
-        if i < len(path) and path[i] == '.':
-            i += 1
+    for token in tokens:
+        try:
+            cur = cur[token]
+        except Exception:
+            return None
     return cur
 
 
@@ -398,6 +854,40 @@ def _is_default_sentinel(path: str, value: Any) -> bool:
         return False
 
 
+# Output/context caps for extraction calls. Observed wrappers run ~650-900 tokens after
+# ~700-2500 prompt tokens (page images included); the caps leave headroom for both
+EXTRACTION_NUM_PREDICT = int(os.getenv("EXTRACTION_NUM_PREDICT", "1536"))
+EXTRACTION_NUM_CTX = int(os.getenv("EXTRACTION_NUM_CTX", "4096"))
+
+
+def _generate_streamed(payload: Dict[str, Any], timeout: float) -> str:
+    """POST a streaming /api/generate request and return the concatenated response text.
+
+    NDJSON fragments are decoded as they arrive, so parsing overlaps with
+    generation instead of waiting for one large body at the end.
+    """
+    parts: List[str] = []
+    # Serialize with orjson: the base64 page images dominate the body
+    with SESSION.post(
+        f"{OLLAMA_NATIVE_API}/generate",
+        data=_json_dumpb(payload),
+        headers={"Content-Type": "application/json"},
+        timeout=timeout,
+        stream=True,
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            fragment = _json_loads(line)
+            if fragment.get("error"):
+                raise RuntimeError(f"Ollama generate failed: {fragment['error']}")
+            parts.append(fragment.get("response", ""))
+            if fragment.get("done"):
+                break
+    return "".join(parts)
+
+
 def _run_entrydetail_job(file_path: str, max_pages: int = 2, scale: float = 1.6, model: str = "gemma3:12b", agent_version: str = "v1") -> Dict[str, Any]:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
@@ -430,18 +920,15 @@ def _run_entrydetail_job(file_path: str, max_pages: int = 2, scale: float = 1.6,
         "prompt": prompt,
         "images": images,
         "format": fmt,
-        "stream": False,
-        "options": {"temperature": 0.2}
+        "stream": True,
+        "options": {"temperature": 0.2, "num_predict": EXTRACTION_NUM_PREDICT, "num_ctx": EXTRACTION_NUM_CTX}
     }
 
     # Call Ollama
     t0 = time.time()
-    resp = requests.post(f"{OLLAMA_NATIVE_API}/generate", json=payload, timeout=900)
+    wrapper_text = _generate_streamed(payload, timeout=900)
     elapsed = time.time() - t0
-    resp.raise_for_status()
-    data = resp.json()
-    wrapper_text = data.get("response", "")
-    wrapper = json.loads(wrapper_text)
+    wrapper = _json_loads(wrapper_text)
 
     # Local validation
     data_obj = wrapper.get("data", {})
@@ -452,7 +939,8 @@ def _run_entrydetail_job(file_path: str, max_pages: int = 2, scale: float = 1.6,
     _postprocess_meta(wrapper)
 
     # Evidence validation: warn when non-null fields lack evidence
-    missing_ev = _validate_evidence(wrapper)
+    non_null_paths = _collect_non_null_leaf_paths(data_obj)
+    missing_ev = _validate_evidence(wrapper, non_null_paths)
     if missing_ev:
         v = wrapper.setdefault("meta", {}).setdefault("validation", {"schema_ok": True})
         warns = v.setdefault("warnings", [])
@@ -462,7 +950,7 @@ def _run_entrydetail_job(file_path: str, max_pages: int = 2, scale: float = 1.6,
         try:
             oc = float(wrapper["meta"].get("overall_confidence", 0.5))
             # deduct up to 0.15 based on proportion of missing evidence among non-null leaves
-            non_null_count = max(1, len(_collect_non_null_leaf_paths(data_obj)))
+            non_null_count = max(1, len(non_null_paths))
             penalty = min(0.15, 0.15 * len(missing_ev) / non_null_count)
             wrapper["meta"]["overall_confidence"] = max(0.0, oc - penalty)
         except Exception:
@@ -470,8 +958,9 @@ def _run_entrydetail_job(file_path: str, max_pages: int = 2, scale: float = 1.6,
 
     # Hard fail on critical evidence missing when values are not defaults
     critical_missing = []
+    missing_ev_set = set(missing_ev)
     for p in CRITICAL_EVIDENCE_PATHS:
-        if p in missing_ev:
+        if p in missing_ev_set:
             val = _get_by_path(data_obj, p)
             if val not in (None, "") and not _is_default_sentinel(p, val):
                 critical_missing.append({"path": p, "value": val})
@@ -499,15 +988,18 @@ def get_embedding(text):
     }
     try:
         logger.info(f"Calling embedding endpoint for text length: {len(text)}")
-        response = requests.post(EMBEDDING_ENDPOINT, json=payload)
+        response = SESSION.post(EMBEDDING_ENDPOINT, json=payload, timeout=EMBEDDING_TIMEOUT)
         response.raise_for_status()
         
-        # Parse the response as JSON
-        result = response.json()
+        # Parse the response bytes as JSON (1024-float vectors are much cheaper with orjson)
+        result = _json_loads(response.content)
         logger.debug(f"Embedding API response keys: {list(result.keys())}")
         
         # Handle different response formats based on the API
-        if "data" in result and len(result["data"]) > 0 and "embedding" in result["data"][0]:
+        if result.get("embeddings"):
+            # Ollama /api/embed format
+            return result["embeddings"][0]
+        elif "data" in result and len(result["data"]) > 0 and "embedding" in result["data"][0]:
             # Standard OpenAI format
             return result["data"][0]["embedding"]
         elif "embedding" in result:
@@ -522,10 +1014,107 @@ def get_embedding(text):
         if hasattr(e, 'response') and e.response is not None:
             logger.error(f"Response content: {e.response.text}")
         return []
+    except ValueError as e:
+        # Malformed JSON body (orjson.JSONDecodeError is a ValueError)
+        logger.error(f"Invalid embedding response: {e}")
+        return []
+
+EMBEDDING_BATCH_SIZE = 32  # Inputs per embedding request
+EMBEDDING_FALLBACK_WORKERS = 8  # Concurrent single-text requests when list input is rejected
+
+def _post_embedding_batch(texts: List[str]) -> Optional[List[List[float]]]:
+    """POST a list of inputs to the embedding endpoint; None if the server can't batch."""
+    try:
+        response = SESSION.post(EMBEDDING_ENDPOINT, json={"model": EMBEDDING_MODEL, "input": texts},
+                                timeout=EMBEDDING_TIMEOUT)
+        response.raise_for_status()
+        result = _json_loads(response.content)
+        # Ollama /api/embed returns one vector per input, in input order
+        embeddings = result.get("embeddings")
+        if isinstance(embeddings, list) and len(embeddings) == len(texts):
+            return embeddings
+        data = result.get("data")
+        if isinstance(data, list) and len(data) == len(texts):
+            # OpenAI-style responses tag each item with its input position; don't rely on array order
+            if all(isinstance(item.get("index"), int) for item in data):
+                data = sorted(data, key=lambda item: item["index"])
+            return [item.get("embedding", []) for item in data]
+        logger.warning(f"Batch embedding response did not contain {len(texts)} embeddings")
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Error calling batch embedding endpoint: {e}")
+    return None
+
+EMBEDDING_CONCURRENCY = max(1, int(os.getenv("EMBEDDING_CONCURRENCY", "4")))  # Batch requests in flight
+
+def _embed_batch(batch: List[str], start: int, total: int) -> List[List[float]]:
+    """Embed one batch, retrying as bounded concurrent single calls if the server rejects it."""
+    logger.info(f"Generating embeddings for chunks {start+1}-{start+len(batch)}/{total}")
+    embeddings = _post_embedding_batch(batch)
+    if embeddings is None:
+        logger.warning("Falling back to per-chunk embedding requests")
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_FALLBACK_WORKERS, len(batch))) as pool:
+            embeddings = list(pool.map(get_embedding, batch))
+    return embeddings
+
+def get_embeddings_batch(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+    """Embed many texts with one request per `batch_size` inputs.
+
+    Returns one embedding per input, in order (an empty list marks a failure).
+    Up to EMBEDDING_CONCURRENCY batches are in flight at once so the server's
+    latency overlaps across requests.
+    """
+    starts = list(range(0, len(texts), batch_size))
+    batches = [texts[start:start + batch_size] for start in starts]
+    totals = [len(texts)] * len(batches)
+    if len(batches) <= 1 or EMBEDDING_CONCURRENCY == 1:
+        per_batch = list(map(_embed_batch, batches, starts, totals))
+    else:
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as pool:
+            per_batch = list(pool.map(_embed_batch, batches, starts, totals))
+    return [embedding for embeddings in per_batch for embedding in embeddings]
+
+def _text_embedding_cache_path(text: str) -> str:
+    """Per-text cache file, keyed by SHA-256 of model + text and sharded by hash prefix."""
+    key = hashlib.sha256(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8")).hexdigest()
+    return os.path.join(EMBEDDING_TEXT_CACHE_DIR, key[:2], f"{key}.npy")
+
+def get_embeddings_cached(texts: List[str]) -> List[Any]:
+    """get_embeddings_batch with an on-disk float32 cache per text.
+
+    Chunks shared between documents or re-uploads are loaded from disk and
+    only the misses are sent to the embedding endpoint.
+    """
+    results: List[Any] = [None] * len(texts)
+    misses: List[int] = []
+    for i, text in enumerate(texts):
+        path = _text_embedding_cache_path(text)
+        try:
+            results[i] = np.load(path)
+        except (OSError, ValueError):
+            misses.append(i)
+    if len(misses) < len(texts):
+        logger.info(f"Embedding cache hits: {len(texts) - len(misses)}/{len(texts)}")
+    
+    if misses:
+        fresh = get_embeddings_batch([texts[i] for i in misses])
+        for i, embedding in zip(misses, fresh):
+            results[i] = embedding
+            if not embedding:
+                continue
+            path = _text_embedding_cache_path(texts[i])
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.asarray(embedding, dtype=np.float32))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write embedding cache {path}: {e}")
+    return results
 
 def is_embedding_available():
     try:
-        test_response = requests.post(
+        test_response = SESSION.post(
             EMBEDDING_ENDPOINT,
             json={
                 "model": EMBEDDING_MODEL,
@@ -538,9 +1127,32 @@ def is_embedding_available():
         logger.error(f"Error checking embedding availability: {e}")
         return False
 
-# Check if embedding service is available
-HAS_EMBEDDING = is_embedding_available()
-logger.info(f"Embedding API available: {HAS_EMBEDDING}")
+EMBEDDING_CHECK_TTL = 60.0  # Seconds an availability probe result is trusted
+_embedding_status = {"available": False, "checked_at": None}
+_embedding_status_lock = threading.Lock()
+
+def embedding_available() -> bool:
+    """Cached embedding-service availability, re-probed at most every EMBEDDING_CHECK_TTL seconds.
+
+    Unlike a one-off check at import, an LLM server that starts after the
+    backend (or recovers from an outage) is picked up automatically.
+    """
+    now = time.monotonic()
+    with _embedding_status_lock:
+        checked_at = _embedding_status["checked_at"]
+        if checked_at is not None and now - checked_at < EMBEDDING_CHECK_TTL:
+            return _embedding_status["available"]
+    available = is_embedding_available()
+    with _embedding_status_lock:
+        if available != _embedding_status["available"] or _embedding_status["checked_at"] is None:
+            logger.info(f"Embedding API available: {available}")
+        _embedding_status.update(available=available, checked_at=time.monotonic())
+    return available
+
+# Probe in the background so startup and the first request don't wait on the LLM server.
+# Skipped in PDF pool workers, which re-import this module when it is the dev-server __main__
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=embedding_available, daemon=True).start()
 
 # Add constants for chunking
 CHUNK_SIZE = 1000  # Characters per chunk
@@ -554,38 +1166,31 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHU
     
     chunks = []
     start = 0
+    text_len = len(text)
+    # Minimum offsets (from chunk start) a break must reach to be accepted
+    half = chunk_size // 2
+    third = chunk_size // 3
     
-    while start < len(text):
+    while start < text_len:
         # Find the end of the current chunk
         end = start + chunk_size
         
-        # If we're not at the end of the text, try to find a good breaking point
-        if end < len(text):
-            # Try to find sentence end (period, question mark, exclamation point)
+        # If we're not at the end of the text, pick the best breaking point by priority:
+        # sentence end (. ? !) > paragraph break > line break > space
+        if end < text_len:
             sentence_end = max(
                 text.rfind('.', start, end),
                 text.rfind('?', start, end),
                 text.rfind('!', start, end)
             )
-            
-            # If found a sentence end, use it
-            if sentence_end > start + (chunk_size // 2):  # At least half the chunk size
+            if sentence_end > start + half:
                 end = sentence_end + 1
-            else:
-                # Try to find paragraph break
-                para_end = text.rfind('\n\n', start, end)
-                if para_end > start + (chunk_size // 3):
-                    end = para_end + 2
-                else:
-                    # Try to find line break
-                    line_end = text.rfind('\n', start, end)
-                    if line_end > start + (chunk_size // 3):
-                        end = line_end + 1
-                    else:
-                        # Try to find space
-                        space_end = text.rfind(' ', start, end)
-                        if space_end > start + (chunk_size // 2):
-                            end = space_end + 1
+            elif (para_end := text.rfind('\n\n', start, end)) > start + third:
+                end = para_end + 2
+            elif (line_end := text.rfind('\n', start, end)) > start + third:
+                end = line_end + 1
+            elif (space_end := text.rfind(' ', start, end)) > start + half:
+                end = space_end + 1
         
         # Add the chunk
         chunks.append(text[start:end])
@@ -594,11 +1199,228 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHU
         start = end - chunk_overlap
         
         # Make sure we're making progress
-        if start >= len(text):
+        if start >= text_len:
             break
     
     return chunks
 
+def _unit_vector(vec) -> np.ndarray:
+    """Return `vec` as a float32 array scaled to unit L2 norm."""
+    v = np.asarray(vec, dtype=np.float32)
+    return v / (np.linalg.norm(v) + 1e-12)
+
+# Optional in-memory compression of chunk embeddings: "int8", "float16", or unset for float32
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "").strip().lower()
+SCORE_BLOCK_ROWS = 4096  # Rows widened to float32 per block when scoring a compressed matrix
+
+def _quantize_embeddings(embedding_matrix: Optional[np.ndarray]):
+    """Return (matrix, scales) for storage; scales are per-row fp32 factors for int8, else None."""
+    if embedding_matrix is None:
+        return None, None
+    if EMBEDDING_QUANTIZATION == "float16":
+        return embedding_matrix.astype(np.float16), None
+    if EMBEDDING_QUANTIZATION != "int8":
+        return embedding_matrix, None
+    scales = np.abs(embedding_matrix).max(axis=1).astype(np.float32) + 1e-12
+    quantized = np.round(embedding_matrix / scales[:, None] * 127).astype(np.int8)
+    return quantized, scales / 127
+
+def _score_chunks(matrix: np.ndarray, scales: Optional[np.ndarray], q: np.ndarray) -> np.ndarray:
+    """Cosine scores of unit-norm rows against unit-norm `q`, widening compressed rows blockwise."""
+    if matrix.dtype == np.float32 and scales is None:
+        return matrix @ q
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        block = matrix[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+        scores[start:start + SCORE_BLOCK_ROWS] = block @ q
+    return scores if scales is None else scores * scales
+
+class CorpusIndex:
+    """All stored chunk embeddings in one contiguous (N, D) matrix for cross-document search.
+
+    Rows are appended per document into capacity grown in blocks of
+    `block_rows`, alongside a parallel array of document ids and each row's
+    chunk position, so ranking any subset of documents is one matmul plus
+    argpartition. Chunk texts stay in document_store.
+    """
+
+    def __init__(self, block_rows: int = 1024) -> None:
+        self.block_rows = block_rows
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._doc_ids = np.empty(0, dtype=np.int32)
+        self._chunk_ids = np.empty(0, dtype=np.int32)
+        self._count = 0
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, name: str, matrix: Optional[np.ndarray], scales: Optional[np.ndarray] = None) -> None:
+        """Index (or re-index) the rows of one document."""
+        with self._lock:
+            self.remove(name)
+            if matrix is None or len(matrix) == 0:
+                return
+            n, dim = matrix.shape
+            if self._matrix is not None and (self._matrix.shape[1] != dim or self._matrix.dtype != matrix.dtype):
+                raise ValueError(f"{name}: embeddings ({matrix.dtype}, {dim}) do not match the corpus "
+                                 f"({self._matrix.dtype}, {self._matrix.shape[1]})")
+            self._reserve(self._count + n, dim, matrix.dtype)
+            if scales is not None and self._scales is None:
+                self._scales = np.ones(len(self._matrix), dtype=np.float32)
+            rows = slice(self._count, self._count + n)
+            self._matrix[rows] = matrix
+            if self._scales is not None:
+                self._scales[rows] = 1.0 if scales is None else scales
+            doc_id = self._next_id
+            self._next_id += 1
+            self._ids[name] = doc_id
+            self._names[doc_id] = name
+            self._doc_ids[rows] = doc_id
+            self._chunk_ids[rows] = np.arange(n, dtype=np.int32)
+            self._count += n
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            doc_id = self._ids.pop(name, None)
+            if doc_id is None:
+                return
+            del self._names[doc_id]
+            keep = np.flatnonzero(self._doc_ids[:self._count] != doc_id)
+            for arr in (self._matrix, self._scales, self._doc_ids, self._chunk_ids):
+                if arr is not None:
+                    arr[:len(keep)] = arr[keep]
+            self._count = len(keep)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.__init__(self.block_rows)
+
+    def search(self, q: np.ndarray, top_k: int, names: Optional[List[str]] = None) -> List[Tuple[str, int, float]]:
+        """Top `top_k` (document name, chunk index, score), best first, optionally restricted to `names`."""
+        with self._lock:
+            if self._count == 0 or top_k <= 0:
+                return []
+            rows = np.arange(self._count)
+            if names is not None:
+                ids = [self._ids[n] for n in names if n in self._ids]
+                rows = rows[np.isin(self._doc_ids[:self._count], ids)]
+                if len(rows) == 0:
+                    return []
+            contiguous = len(rows) == self._count
+            matrix = self._matrix[:self._count] if contiguous else self._matrix[rows]
+            scales = None
+            if self._scales is not None:
+                scales = self._scales[:self._count] if contiguous else self._scales[rows]
+            scores = _score_chunks(matrix, scales, q)
+            top_k = min(top_k, len(scores))
+            idx = np.argpartition(-scores, top_k - 1)[:top_k]
+            idx = idx[np.argsort(-scores[idx])]
+            return [
+                (self._names[int(self._doc_ids[rows[i]])], int(self._chunk_ids[rows[i]]), float(scores[i]))
+                for i in idx
+            ]
+
+    def _reserve(self, rows: int, dim: int, dtype) -> None:
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if rows <= capacity:
+            return
+        new_capacity = math.ceil(rows / self.block_rows) * self.block_rows
+        matrix = np.empty((new_capacity, dim), dtype=dtype)
+        doc_ids = np.empty(new_capacity, dtype=np.int32)
+        chunk_ids = np.empty(new_capacity, dtype=np.int32)
+        if self._matrix is not None:
+            matrix[:self._count] = self._matrix[:self._count]
+            doc_ids[:self._count] = self._doc_ids[:self._count]
+            chunk_ids[:self._count] = self._chunk_ids[:self._count]
+        if self._scales is not None:
+            scales = np.ones(new_capacity, dtype=np.float32)
+            scales[:self._count] = self._scales[:self._count]
+            self._scales = scales
+        self._matrix, self._doc_ids, self._chunk_ids = matrix, doc_ids, chunk_ids
+
+# Every embedded chunk of the documents resident in memory, for multi-document retrieval.
+# It follows document_store's LRU, so offloading a document frees its rows as well;
+# search_corpus scores offloaded documents from disk.
+corpus_index = CorpusIndex()
+
+def _reindex_document(name: str, data: Dict[str, Any]) -> None:
+    try:
+        corpus_index.add(name, data.get("embedding_matrix"), data.get("embedding_scales"))
+    except ValueError as e:
+        logger.error(f"Could not add {name} to the corpus index: {e}")
+
+document_store.on_offload = corpus_index.remove
+document_store.on_reload = _reindex_document
+
+def _to_retrieval_device(embedding_matrix: Optional[np.ndarray]):
+    """Copy a large embedding matrix to the configured GPU, or return None to score on the CPU."""
+    if torch is None or embedding_matrix is None or len(embedding_matrix) < GPU_MIN_CHUNKS:
+        return None
+    try:
+        return torch.tensor(embedding_matrix, dtype=torch.float32, device=RETRIEVAL_DEVICE)
+    except Exception as e:
+        logger.warning(f"Could not move embeddings to {RETRIEVAL_DEVICE}: {e}")
+        return None
+
+HNSW_MIN_CHUNKS = 2000  # Below this, brute-force matmul search is faster than an ANN index
+HNSW_EF_SEARCH = 64  # Search breadth; queries asking for more neighbours fall back to matmul
+
+def _build_ann_index(embedding_matrix: Optional[np.ndarray]):
+    """Build an HNSW index over large embedding matrices, or return None to use brute force."""
+    if hnswlib is None or embedding_matrix is None or len(embedding_matrix) < HNSW_MIN_CHUNKS:
+        return None
+    n, dim = embedding_matrix.shape
+    start_time = time.time()
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.init_index(max_elements=n, ef_construction=200, M=16)
+    index.add_items(embedding_matrix, np.arange(n))
+    index.set_ef(HNSW_EF_SEARCH)
+    logger.info(f"Built HNSW index over {n} chunks in {time.time() - start_time:.2f} seconds")
+    return index
+
+def _ann_index_path(cache_path: str) -> str:
+    """Return the HNSW index file stored next to a document's .npz embedding cache."""
+    return os.path.splitext(cache_path)[0] + ".hnsw"
+
+def _save_ann_index(index, path: str) -> None:
+    """Persist an HNSW index atomically so concurrent loads never see a partial file."""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        index.save_index(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Could not write HNSW index {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _load_or_build_ann_index(path: str, embedding_matrix: Optional[np.ndarray]):
+    """Load the persisted HNSW index for a cached document, rebuilding it when missing or stale."""
+    if hnswlib is None or embedding_matrix is None or len(embedding_matrix) < HNSW_MIN_CHUNKS:
+        return None
+    n, dim = embedding_matrix.shape
+    if os.path.exists(path):
+        try:
+            index = hnswlib.Index(space="cosine", dim=dim)
+            index.load_index(path, max_elements=n)
+            if index.get_current_count() == n:
+                index.set_ef(HNSW_EF_SEARCH)
+                logger.info(f"Loaded HNSW index over {n} chunks from {path}")
+                return index
+            logger.warning(f"Ignoring inconsistent HNSW index {path}")
+        except Exception as e:
+            logger.warning(f"Could not read HNSW index {path}: {e}")
+    index = _build_ann_index(embedding_matrix)
+    if index is not None:
+        _save_ann_index(index, path)
+    return index
+
 # Add this function to process chunks and generate embeddings
 def process_document_chunks(text: str) -> Dict[str, Any]:
     """Process a document by chunking and generating embeddings for each chunk."""
@@ -608,78 +1430,282 @@ def process_document_chunks(text: str) -> Dict[str, Any]:
     chunks = chunk_text(text)
     logger.info(f"Document split into {len(chunks)} chunks")
     
-    # Generate embeddings for each chunk
-    chunk_data = []
-    for i, chunk in enumerate(chunks):
-        logger.info(f"Generating embedding for chunk {i+1}/{len(chunks)}")
-        
-        embedding = get_embedding(chunk)
-        
-        # Store chunk and its embedding
-        if embedding:
-            chunk_data.append({
-                "chunk_id": i,
-                "text": chunk,
-                "embedding": embedding
-            })
-        else:
+    # Generate embeddings for all chunks in batched requests, reusing cached vectors
+    embeddings = get_embeddings_cached(chunks)
+    
+    # Structure-of-arrays layout: chunk texts plus a parallel (n, d) matrix of
+    # unit-norm embeddings, so search is a single matmul over contiguous memory.
+    # Rows are written straight into a preallocated float32 buffer as they arrive.
+    matrix: Optional[np.ndarray] = None
+    valid = np.zeros(len(chunks), dtype=bool)
+    for i, embedding in enumerate(embeddings):
+        if embedding is None or len(embedding) == 0:
             logger.warning(f"Failed to generate embedding for chunk {i+1}")
+            continue
+        if matrix is None:
+            matrix = np.empty((len(chunks), len(embedding)), dtype=np.float32)
+        matrix[i] = embedding
+        valid[i] = True
+    
+    texts = [chunk for chunk, ok in zip(chunks, valid) if ok]
+    embedding_matrix = None
+    if texts:
+        embedding_matrix = matrix if valid.all() else matrix[valid]
+        embedding_matrix /= np.linalg.norm(embedding_matrix, axis=1, keepdims=True) + 1e-12
+        embedding_matrix.flags.writeable = False  # Scoring relies on rows staying unit-norm
+    ann_index = _build_ann_index(embedding_matrix)
     
     process_time = time.time() - start_time
     logger.info(f"Document processing completed in {process_time:.2f} seconds")
     
     return {
-        "chunks": chunk_data,
+        "texts": texts,
+        "embedding_matrix": embedding_matrix,
+        "ann_index": ann_index,
         "chunk_count": len(chunks),
-        "successful_embeddings": len(chunk_data),
+        "successful_embeddings": len(texts),
         "processing_time": process_time
     }
 
+def _embedding_cache_path(text: str) -> str:
+    """Path of the persisted chunk embeddings for `text` under the current model, chunking and storage format."""
+    key = f"{EMBEDDING_MODEL}\0{CHUNK_SIZE}\0{CHUNK_OVERLAP}\0{EMBEDDING_QUANTIZATION}\0{text}"
+    doc_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(EMBEDDING_CACHE_DIR, f"{doc_hash}.npz")
+
+def load_or_process_document_chunks(text: str) -> Dict[str, Any]:
+    """Like process_document_chunks, but reuses embeddings persisted for identical text."""
+    start_time = time.time()
+    cache_path = _embedding_cache_path(text)
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                texts = cached["texts"].tolist()
+                embedding_matrix = cached["embeddings"].astype(np.float32, copy=False)
+                if "scales" in cached.files:
+                    # int8 rows are stored with their per-row dequantization factors
+                    embedding_matrix *= cached["scales"][:, None]
+                embedding_matrix.flags.writeable = False
+                chunk_count = int(cached["chunk_count"])
+            if len(texts) == embedding_matrix.shape[0]:
+                logger.info(f"Loaded {len(texts)} cached chunk embeddings from {cache_path}")
+                return {
+                    "texts": texts,
+                    "embedding_matrix": embedding_matrix,
+                    "ann_index": _load_or_build_ann_index(_ann_index_path(cache_path), embedding_matrix),
+                    "chunk_count": chunk_count,
+                    "successful_embeddings": len(texts),
+                    "processing_time": time.time() - start_time
+                }
+            logger.warning(f"Ignoring inconsistent embedding cache {cache_path}")
+        except Exception as e:
+            logger.warning(f"Could not read embedding cache {cache_path}: {e}")
+    
+    chunk_data = process_document_chunks(text)
+    
+    # Only persist complete results so failed chunks are retried on the next upload
+    if chunk_data["texts"] and chunk_data["successful_embeddings"] == chunk_data["chunk_count"]:
+        tmp_path = f"{cache_path}.tmp"
+        # Persist in the in-memory storage format so compressed modes also shrink the cache
+        stored, scales = _quantize_embeddings(chunk_data["embedding_matrix"])
+        arrays = {} if scales is None else {"scales": scales}
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    embeddings=stored,
+                    texts=np.array(chunk_data["texts"], dtype=str),
+                    chunk_count=np.int64(chunk_data["chunk_count"]),
+                    **arrays,
+                )
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"Could not write embedding cache {cache_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        if chunk_data.get("ann_index") is not None:
+            _save_ann_index(chunk_data["ann_index"], _ann_index_path(cache_path))
+    return chunk_data
+
 # Add this function for semantic search
 
-def vector_similarity(vec1, vec2):
-    """Compute cosine similarity between two vectors."""
-    if not vec1 or not vec2:
-        return 0
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # Distinct queries kept in the LRU below
+_query_embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_embedding_lock = threading.Lock()
+
+def get_query_embedding(query: str) -> Optional[np.ndarray]:
+    """Return the unit-norm embedding of a search query, or None on failure.
+
+    Results are kept in an LRU keyed by SHA-256 of the embedding model and
+    query text, so repeated questions skip the embedding round trip.
+    """
+    key = hashlib.sha256(f"{EMBEDDING_MODEL}\0{query}".encode("utf-8")).hexdigest()
+    with _query_embedding_lock:
+        cached = _query_embedding_cache.get(key)
+        if cached is not None:
+            _query_embedding_cache.move_to_end(key)
+            return cached
     
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = sum(a * a for a in vec1) ** 0.5
-    magnitude2 = sum(b * b for b in vec2) ** 0.5
+    embedding = get_embedding(query)
+    if not embedding:
+        return None
+    vec = _unit_vector(embedding)
+    vec.flags.writeable = False  # Shared between requests
+    with _query_embedding_lock:
+        _query_embedding_cache[key] = vec
+        _query_embedding_cache.move_to_end(key)
+        while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embedding_cache.popitem(last=False)
+    return vec
+
+def search_corpus(query: str, doc_names: Optional[List[str]] = None, top_k: int = 3) -> List[Tuple[str, str]]:
+    """(document name, chunk text) of the best chunks across `doc_names` (all documents if None).
+
+    Resident documents are ranked together in corpus_index; offloaded ones are
+    scored one by one from disk without pulling them back into memory.
+    """
+    names = list(document_store) if doc_names is None else doc_names
+    offloaded = [name for name in names if document_store.is_offloaded(name)]
+    if len(corpus_index) == 0 and not offloaded:
+        return []
+    q = get_query_embedding(query)
+    if q is None:
+        logger.warning("Could not generate embedding for query")
+        return []
     
-    if magnitude1 * magnitude2 == 0:
-        return 0
+    scored = []
+    for name, chunk_idx, score in corpus_index.search(q, top_k, doc_names):
+        doc = document_store.get(name)
+        if doc and chunk_idx < len(doc.get("texts") or []):
+            scored.append((score, name, doc["texts"][chunk_idx]))
+    for name in offloaded:
+        try:
+            doc = document_store.peek(name)
+        except KeyError:
+            continue
+        matrix = doc.get("embedding_matrix")
+        texts = doc.get("texts") or []
+        if matrix is None or len(matrix) == 0:
+            continue
+        scores = _score_chunks(matrix, doc.get("embedding_scales"), q)
+        k = min(top_k, len(scores))
+        for i in np.argpartition(-scores, k - 1)[:k]:
+            if i < len(texts):
+                scored.append((float(scores[i]), name, texts[i]))
+    scored.sort(key=lambda hit: -hit[0])
+    return [(name, text) for _, name, text in scored[:top_k]]
+
+def find_relevant_chunks(query: str, doc_name: str, top_k: int = 3) -> List[str]:
+    """Find the texts of the most relevant chunks for a query using semantic search."""
+    doc = document_store.get(doc_name)
+    if not doc or not doc.get("texts"):
+        return []
     
-    return dot_product / (magnitude1 * magnitude2)
-
-def find_relevant_chunks(query: str, doc_name: str, top_k: int = 3):
-    """Find the most relevant chunks for a query using semantic search."""
-    if doc_name not in document_store or not document_store[doc_name].get("chunks"):
+    # Get chunk texts and their precomputed unit-norm embedding matrix; bail out
+    # before the query embedding round trip when there is nothing to rank
+    texts = doc["texts"]
+    matrix = doc.get("embedding_matrix")
+    if matrix is None or len(matrix) == 0 or top_k <= 0:
         return []
+    if len(texts) <= top_k:
+        # Every chunk is returned anyway: keep document order and skip the query embedding
+        return list(texts)
     
-    # Get query embedding
-    query_embedding = get_embedding(query)
-    if not query_embedding:
+    # Get (cached) unit-norm query embedding
+    q = get_query_embedding(query)
+    if q is None:
         logger.warning("Could not generate embedding for query")
         return []
     
-    # Get document chunks
-    chunks = document_store[doc_name]["chunks"]
+    # Very large documents may keep a device-resident copy: exact scan plus top-k on the GPU.
+    # The copy is dropped when the document is offloaded, so rebuild it after a reload
+    if "gpu_matrix" not in doc:
+        device_matrix = None
+        if torch is not None and len(matrix) >= GPU_MIN_CHUNKS:
+            full = matrix.astype(np.float32)
+            scales = doc.get("embedding_scales")
+            if scales is not None:
+                full *= scales[:, None]
+            device_matrix = _to_retrieval_device(full)
+        doc["gpu_matrix"] = device_matrix
+    gpu_matrix = doc["gpu_matrix"]
+    if gpu_matrix is not None:
+        # q is the shared read-only cached vector; hand torch a writable copy
+        scores = gpu_matrix @ torch.from_numpy(np.array(q)).to(gpu_matrix.device)
+        idx = torch.topk(scores, top_k).indices.cpu().numpy()
+        return [texts[i] for i in idx]
+    
+    # Large documents carry an HNSW index: graph descent instead of a linear scan
+    ann_index = doc.get("ann_index")
+    if ann_index is not None and top_k <= HNSW_EF_SEARCH:
+        labels, _ = ann_index.knn_query(q, k=top_k)
+        return [texts[i] for i in labels[0]]
     
-    # Calculate similarity scores
-    chunk_scores = []
-    for chunk in chunks:
-        chunk_embedding = chunk.get("embedding")
-        if chunk_embedding:
-            similarity = vector_similarity(query_embedding, chunk_embedding)
-            chunk_scores.append((chunk, similarity))
+    # Rows are unit-norm, so cosine similarity is one BLAS matrix-vector product
+    scores = _score_chunks(matrix, doc.get("embedding_scales"), q)
     
-    # Sort by similarity score
-    chunk_scores.sort(key=lambda x: x[1], reverse=True)
+    # Partial top_k selection, then order only the selected scores
+    idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    idx = idx[np.argsort(-scores[idx])]
     
-    # Return top_k chunks
-    return [chunk for chunk, score in chunk_scores[:top_k]]
+    return [texts[i] for i in idx]
 
 # API routes
+# Stored documents keep only the head of their text: the fallback prompt and listings read
+# nothing past it, and the chunks already carry the full text for retrieval
+DOCUMENT_CONTEXT_CHARS = 2000
+
+_NO_CHUNKS = {"texts": [], "embedding_matrix": None, "ann_index": None, "chunk_count": 0, "successful_embeddings": 0}
+
+UPLOAD_EMBED_WORKERS = max(1, int(os.getenv("UPLOAD_EMBED_WORKERS", "2")))  # Documents embedded at once after upload
+_upload_embed_executor = ThreadPoolExecutor(max_workers=UPLOAD_EMBED_WORKERS, thread_name_prefix="upload-embed")
+# Orders background embedding results against re-uploads and clears of the same name
+_upload_lock = threading.Lock()
+
+def _store_document(filename: str, text: str, save_path: str, chunk_data: Dict[str, Any],
+                    upload_id: str, embedding_status: str) -> None:
+    """Put an uploaded document and its chunk embeddings in the store and corpus index."""
+    embedding_matrix, embedding_scales = _quantize_embeddings(chunk_data["embedding_matrix"])
+    document_store[filename] = {
+        "text": text[:DOCUMENT_CONTEXT_CHARS],
+        "texts": chunk_data["texts"],
+        "embedding_matrix": embedding_matrix,
+        "embedding_scales": embedding_scales,
+        "gpu_matrix": _to_retrieval_device(chunk_data["embedding_matrix"]),
+        "ann_index": chunk_data["ann_index"],
+        "path": save_path,
+        "processed": True,
+        "chunk_count": chunk_data["chunk_count"],
+        "has_embeddings": chunk_data["successful_embeddings"] > 0,
+        "upload_id": upload_id,
+        "embedding_status": embedding_status,
+    }
+    try:
+        corpus_index.add(filename, embedding_matrix, embedding_scales)
+    except ValueError as e:
+        logger.error(f"Could not add {filename} to the corpus index: {e}")
+
+def _embed_and_store(filename: str, text: str, save_path: str, upload_id: str) -> None:
+    """Background half of an upload: chunk and embed, then swap in the embedded document.
+
+    The result is dropped if the name was re-uploaded or the store cleared meanwhile.
+    """
+    try:
+        chunk_data = load_or_process_document_chunks(text)
+        status = "ready" if chunk_data["successful_embeddings"] > 0 else "failed"
+        logger.info(f"Document {filename} processed into {chunk_data['chunk_count']} chunks with {chunk_data['successful_embeddings']} embeddings")
+    except Exception as e:
+        logger.exception(f"Embedding {filename} failed: {e}")
+        chunk_data, status = dict(_NO_CHUNKS), "failed"
+    with _upload_lock:
+        current = document_store.get(filename)
+        if not current or current.get("upload_id") != upload_id:
+            logger.info(f"Discarding embeddings for replaced or removed document {filename}")
+            return
+        _store_document(filename, text, save_path, chunk_data, upload_id, status)
+
 @app.route('/api/upload', methods=['POST'])
 def upload_document():
     try:
@@ -700,7 +1726,8 @@ def upload_document():
         
         logger.info(f"Saving file: {filename} to {save_path}")
         try:
-            file.save(save_path)
+            file_sha = _save_upload(file, save_path)
+            _remember_file_sha(save_path, file_sha)
             logger.info(f"File saved successfully")
         except Exception as e:
             logger.error(f"Error saving file: {e}")
@@ -712,7 +1739,7 @@ def upload_document():
             text = read_text_file(save_path)
         elif file_ext == ".pdf":
             logger.info("Processing PDF file")
-            text = read_pdf_file(save_path)
+            text = read_pdf_file_cached(save_path, file_sha)
             if not text or len(text.strip()) < 20:
                 logger.info("Minimal or no text extracted; attempting vision OCR via LLM...")
                 ocr_text = ocr_pdf_with_vlm(save_path)
@@ -731,22 +1758,22 @@ def upload_document():
 
         logger.info(f"Extracted {len(text)} characters from file")
         
-        # Process document with chunking if embeddings are available
-        chunk_data = {"chunks": [], "chunk_count": 0, "successful_embeddings": 0}
-        if HAS_EMBEDDING:
-            logger.info("Processing document with chunking...")
-            chunk_data = process_document_chunks(text)
-            logger.info(f"Document processed into {chunk_data['chunk_count']} chunks with {chunk_data['successful_embeddings']} embeddings")
-        
-        # Save the document data in memory
-        document_store[filename] = {
-            "text": text,
-            "chunks": chunk_data["chunks"],
-            "path": save_path,
-            "processed": True,
-            "chunk_count": chunk_data["chunk_count"],
-            "has_embeddings": chunk_data["successful_embeddings"] > 0
-        }
+        # Chunk and embed if embeddings are available. Text seen before is loaded from the
+        # embedding cache right away; new text is embedded in the background so the upload
+        # returns as soon as the text is stored (chat falls back to the document start meanwhile)
+        upload_id = uuid.uuid4().hex
+        chunk_data = dict(_NO_CHUNKS)
+        embedding_status = "unavailable"
+        if embedding_available():
+            if os.path.exists(_embedding_cache_path(text)):
+                chunk_data = load_or_process_document_chunks(text)
+                embedding_status = "ready"
+            else:
+                embedding_status = "embedding"
+        with _upload_lock:
+            _store_document(filename, text, save_path, chunk_data, upload_id, embedding_status)
+        if embedding_status == "embedding":
+            _upload_embed_executor.submit(_embed_and_store, filename, text, save_path, upload_id)
         
         # After successful upload, auto-queue an extraction job
         try:
@@ -759,47 +1786,41 @@ def upload_document():
             scale = 1.6
         model = request.args.get('model', 'gemma3:12b')
 
-        # idempotent queue by file hash + options
-        try:
-            file_sha = _sha256_file(save_path)
-        except Exception:
-            file_sha = filename
+        # idempotent queue by file hash (computed while saving) + options
         job_key = f"{file_sha}:{max_pages}:{scale}:{model}:v1"
-        for jid, j in jobs_store.items():
-            if j.get('job_key') == job_key and j.get('status') in ('queued','running'):
-                job_id = jid
-                break
-        else:
-            job_id = str(uuid.uuid4())
-            jobs_store[job_id] = {
-                'job_id': job_id,
-                'filename': filename,
-                'file_sha': file_sha,
-                'job_key': job_key,
-                'file_path': save_path,
-                'status': 'queued',
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'updated_at': datetime.now(timezone.utc).isoformat(),
-                'params': { 'max_pages': max_pages, 'scale': scale, 'model': model, 'agent_version': 'v1' },
-                'events': [ { 'ts': datetime.now(timezone.utc).isoformat(), 'message': 'job queued (upload)'} ]
-            }
-            def _worker():
-                try:
-                    jobs_store[job_id]['status'] = 'running'
-                    jobs_store[job_id]['events'].append({'ts': datetime.now(timezone.utc).isoformat(), 'message': 'job started'})
-                    result_run = _run_entrydetail_job(save_path, max_pages=max_pages, scale=scale, model=model, agent_version='v1')
-                    out_dir = _jobs_dir() / job_id
-                    out_dir.mkdir(parents=True, exist_ok=True)
-                    with open(out_dir / 'result.wrapper.json', 'w', encoding='utf-8') as f:
-                        json.dump(result_run['wrapper'], f, indent=2)
-                    with open(out_dir / 'summary.json', 'w', encoding='utf-8') as f:
-                        json.dump({k: v for k, v in result_run.items() if k != 'wrapper'}, f, indent=2)
-                    jobs_store[job_id].update({ 'status': 'done', 'elapsed_sec': result_run.get('elapsed_sec'), 'model': result_run.get('model'), 'updated_at': datetime.now(timezone.utc).isoformat() })
-                    jobs_store[job_id]['events'].append({'ts': datetime.now(timezone.utc).isoformat(), 'message': 'job done'})
-                except Exception as e:
-                    jobs_store[job_id].update({ 'status': 'failed', 'error': str(e), 'updated_at': datetime.now(timezone.utc).isoformat() })
-                    jobs_store[job_id].setdefault('events', []).append({'ts': datetime.now(timezone.utc).isoformat(), 'message': f'job failed: {e}'})
-            threading.Thread(target=_worker, daemon=True).start()
+        worker = None
+        with _jobs_lock:
+            job_id = _active_job_for_key(job_key)
+            if job_id is None:
+                job_id = str(uuid.uuid4())
+                _jobs_by_key[job_key] = job_id
+                jobs_store[job_id] = {
+                    'job_id': job_id,
+                    'filename': filename,
+                    'file_sha': file_sha,
+                    'job_key': job_key,
+                    'file_path': save_path,
+                    'status': 'queued',
+                    'created_at': datetime.now(timezone.utc).isoformat(),
+                    'updated_at': datetime.now(timezone.utc).isoformat(),
+                    'params': { 'max_pages': max_pages, 'scale': scale, 'model': model, 'agent_version': 'v1' },
+                    'events': deque([ { 'ts': datetime.now(timezone.utc).isoformat(), 'message': 'job queued (upload)'} ], maxlen=JOB_MAX_EVENTS)
+                }
+                def _worker():
+                    try:
+                        job = _job_snapshot(job_id)
+                        if job is None or job.get('cancel'):
+                            return  # Canceled or deleted while waiting in the queue
+                        _update_job(job_id, 'job started', status='running')
+                        result_run = _run_entrydetail_job(save_path, max_pages=max_pages, scale=scale, model=model, agent_version='v1')
+                        _save_job_artifacts(job_id, result_run)
+                        _update_job(job_id, 'job done', status='done', elapsed_sec=result_run.get('elapsed_sec'), model=result_run.get('model'),
+                                    **_wrapper_quality(result_run.get('wrapper')))
+                    except Exception as e:
+                        _update_job(job_id, f'job failed: {e}', status='failed', error=str(e))
+                worker = _worker
+        if worker is not None:
+            _submit_job(job_id, worker)
 
         # Return success response with job id
         result = {
@@ -810,11 +1831,17 @@ def upload_document():
             "chunk_count": chunk_data["chunk_count"],
             "successful_embeddings": chunk_data["successful_embeddings"],
             "processing_time": chunk_data.get("processing_time", 0),
+            "embedding_status": embedding_status,
             "job_id": job_id,
-            "job_status": jobs_store.get(job_id,{}).get('status','queued')
+            "job_status": (_job_snapshot(job_id) or {}).get('status', 'queued')
         }
         
-        if not chunk_data["chunks"]:
+        if embedding_status == "embedding":
+            # Accepted: poll /api/documents/<name>/status for the embedding result
+            result["message"] = "Document uploaded; embeddings are being generated in the background."
+            return jsonify(result), 202
+        
+        if not chunk_data["texts"]:
             result["warning"] = "Embeddings could not be generated. Semantic search will not be available."
             
         return jsonify(result)
@@ -823,16 +1850,117 @@ def upload_document():
         logger.exception(f"Unexpected error in upload: {e}")
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
+# Store versions restart at 0, so tag them per process to keep old ETags from matching
+_DOCUMENTS_ETAG_PREFIX = uuid.uuid4().hex[:12]
+
 @app.route('/api/documents', methods=['GET'])
 def list_documents():
-    docs = [{"name": name, "excerpt": data["text"][:100]} for name, data in document_store.items()]
-    return jsonify(docs)
+    # Pollers revalidate with If-None-Match; unchanged listings cost no JSON encoding
+    etag = f"{_DOCUMENTS_ETAG_PREFIX}-{document_store.version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    docs = [{"name": name, "excerpt": excerpt} for name, excerpt in document_store.previews()]
+    response = Response(_json_dumpb(docs), mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/documents/<path:name>/status', methods=['GET'])
+def document_status(name: str):
+    doc = document_store.get(name)
+    if not doc:
+        return jsonify({"error": "document not found"}), 404
+    return jsonify({
+        "filename": name,
+        "embedding_status": doc.get("embedding_status", "ready" if doc.get("has_embeddings") else "unavailable"),
+        "chunk_count": doc.get("chunk_count", 0),
+    })
+
+RETRIEVAL_WORKERS = 8  # Concurrent chat requests whose retrieval can overlap
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+RAG_TOP_K = 3  # Chunks retrieved per chat message
+RAG_CONTEXT_CHARS = 4000  # Budget for retrieved excerpts in the system prompt
+
+def _build_system_message(message: str, use_documents: bool, document_names: List[str]) -> str:
+    """Build the chat system prompt, retrieving document context when requested."""
+    system_message = "You are a helpful assistant."
+    if not use_documents or not document_names:
+        return system_message
+    
+    names = [name for name in dict.fromkeys(document_names) if name in document_store]
+    if not names:
+        return system_message
+    
+    # Semantic search over every selected document; a single document keeps its own
+    # ANN/GPU fast paths, several are ranked together over the corpus matrix
+    if len(names) == 1:
+        hits = [(names[0], chunk) for chunk in find_relevant_chunks(message, names[0], top_k=RAG_TOP_K)]
+    else:
+        hits = search_corpus(message, names, top_k=RAG_TOP_K)
+    
+    # Keep the best excerpts that fit the context budget
+    excerpts: List[Tuple[str, str]] = []
+    used = 0
+    for name, chunk in hits:
+        if excerpts and used + len(chunk) > RAG_CONTEXT_CHARS:
+            break
+        excerpts.append((name, chunk))
+        used += len(chunk)
+    
+    if excerpts:
+        if len(names) == 1:
+            context_text = "\n\n---\n\n".join(chunk for _, chunk in excerpts)
+            header = f"Document: {names[0]}"
+        else:
+            context_text = "\n\n---\n\n".join(f"[{name}]\n{chunk}" for name, chunk in excerpts)
+            header = f"Documents: {', '.join(names)}"
+        logger.info(f"Using {len(excerpts)} relevant chunks for context")
+        return (
+            f"You are a helpful assistant. Use the following document excerpts as context to answer questions.\n\n"
+            f"{header}\n\n{context_text}"
+        )
+    
+    # No embeddings (or no hits): fall back to the start of the first selected document
+    logger.warning("No relevant chunks found, using document start instead")
+    return _document_start_prompt(names[0], document_store.version)
+
+@lru_cache(maxsize=256)
+def _document_start_prompt(name: str, store_version: int) -> str:
+    """Fallback system prompt from a document's first DOCUMENT_CONTEXT_CHARS characters.
+
+    Keyed by the store version, so any upload or removal invalidates it; repeat
+    chats skip the slice and, for offloaded documents, the reload from disk.
+    """
+    doc = document_store.get(name)
+    doc_text = doc["text"] if doc else ""
+    return f"You are a helpful assistant. Use the following document as context to answer questions:\n\n{doc_text[:DOCUMENT_CONTEXT_CHARS]}"
+
+MAX_JSON_BODY = 16 * 1024 * 1024  # Largest JSON request body parsed by _parse_json_body
+
+def _parse_json_body() -> Optional[Any]:
+    """Parse the request body with orjson without caching a copy; None if empty, oversized or malformed."""
+    if request.content_length is not None and request.content_length > MAX_JSON_BODY:
+        return None
+    raw = request.get_data(cache=False)
+    if not raw or len(raw) > MAX_JSON_BODY:
+        return None
+    try:
+        return _json_loads(raw)
+    except ValueError:
+        return None
+
+SSE_END_EVENT = b"data: " + _json_dumpb({'end': True}) + b"\n\n"
+# Per-token event template: only the content string is serialized, then formatted
+# into the frame in a single allocation
+SSE_DELTA_EVENT = b'data: {"delta":%b}\n\n'
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
-        data = request.json
-        if not data or "message" not in data:
+        data = _parse_json_body()
+        if not isinstance(data, dict) or "message" not in data:
             return jsonify({"error": "No message provided"}), 400
         
         message = data["message"]
@@ -843,44 +1971,29 @@ def chat():
         model = data.get("model", DEFAULT_MODEL)
         temperature = data.get("temperature", DEFAULT_TEMPERATURE)
         max_tokens = data.get("max_tokens", DEFAULT_MAX_TOKENS)
+        # ?raw=true forwards the upstream OpenAI-style SSE unchanged (no per-token re-encoding)
+        raw = request.args.get("raw", "").lower() in ("1", "true", "yes")
         
-        # Prepare context based on mode
-        system_message = "You are a helpful assistant."
-        
-        # Process document if in document mode
-        if use_documents and document_names:
-            doc_name = document_names[0]
-            if doc_name in document_store:
-                # Use semantic search to find relevant chunks
-                if document_store[doc_name].get("chunks"):
-                    relevant_chunks = find_relevant_chunks(message, doc_name)
-                    
-                    if relevant_chunks:
-                        # Combine relevant chunks for context
-                        context_text = "\n\n---\n\n".join(chunk["text"] for chunk in relevant_chunks)
-                        system_message = (
-                            f"You are a helpful assistant. Use the following document excerpts as context to answer questions.\n\n"
-                            f"Document: {doc_name}\n\n{context_text}"
-                        )
-                        logger.info(f"Using {len(relevant_chunks)} relevant chunks for context")
-                    else:
-                        # Fallback to using first part of document if no relevant chunks found
-                        doc_text = document_store[doc_name]["text"]
-                        system_message = f"You are a helpful assistant. Use the following document as context to answer questions:\n\n{doc_text[:2000]}"
-                        logger.warning("No relevant chunks found, using document start instead")
-                else:
-                    # No chunks available, use regular document text
-                    doc_text = document_store[doc_name]["text"]
-                    system_message = f"You are a helpful assistant. Use the following document as context to answer questions:\n\n{doc_text[:2000]}"
+        # Retrieve document context on the shared worker pool; the stream starts immediately
+        # and the prompt is awaited inside the generator
+        system_future = _retrieval_executor.submit(_build_system_message, message, use_documents, document_names)
         
         # Set up streaming response to LLM API
         def generate():
+            try:
+                system_message = system_future.result()
+            except Exception as e:
+                logger.error(f"Document retrieval failed, answering without context: {e}")
+                system_message = "You are a helpful assistant."
+            
             # Call API with streaming enabled and selected parameters
             logger.info(f"Calling chat API with model: {model}, temp: {temperature}, max_tokens: {max_tokens}")
-            response = requests.post(
+            # Encoded straight to UTF-8 bytes by orjson; the cached document prompt is
+            # serialized once here instead of via requests' json.dumps + encode
+            with SESSION.post(
                 CHAT_ENDPOINT,
                 headers={"Content-Type": "application/json"},
-                json={
+                data=_json_dumpb({
                     "model": model,
                     "messages": [
                         {"role": "system", "content": system_message},
@@ -889,38 +2002,51 @@ def chat():
                     "temperature": temperature,
                     "max_tokens": max_tokens,
                     "stream": True  # Enable streaming
-                },
+                }),
                 stream=True  # Enable HTTP streaming
-            )
-            
-            # Stream the response chunks to frontend
-            for chunk in response.iter_lines():
-                if chunk:
+            ) as response:
+                if raw:
+                    # Passthrough: bytes as they arrive, including the upstream [DONE] marker
+                    for block in response.iter_content(chunk_size=None):
+                        if block:
+                            yield block
+                    return
+                # Stream the response chunks to frontend; lines stay bytes until JSON parsing
+                for chunk in response.iter_lines():
+                    # Skip keep-alive blank lines and the "[DONE]" message
+                    if not chunk or chunk == b"data: [DONE]":
+                        continue
+                    # Remove "data: " prefix if present (common in SSE)
+                    payload = chunk[6:] if chunk.startswith(b"data: ") else chunk
+                    if payload == b"[DONE]":
+                        continue
+                    
                     try:
-                        chunk_data = chunk.decode('utf-8')
-                        # Remove "data: " prefix if present (common in SSE)
-                        if chunk_data.startswith("data: "):
-                            chunk_data = chunk_data[6:]
-                        
-                        # Skip "[DONE]" message
-                        if chunk_data.strip() == "[DONE]":
-                            continue
-                            
-                        json_data = json.loads(chunk_data)
-                        # Extract the text from the chunk
-                        if 'choices' in json_data and len(json_data['choices']) > 0:
-                            if 'delta' in json_data['choices'][0]:
-                                content = json_data['choices'][0]['delta'].get('content', '')
-                                if content:
-                                    yield f"data: {json.dumps({'delta': content})}\n\n"
-                    except Exception as e:
-                        logger.error(f"Error processing chunk: {e}, chunk: {chunk}")
+                        json_data = _json_loads(payload)
+                    except ValueError as e:
+                        # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+                        logger.error(f"Error processing chunk: {e}, chunk: {chunk[:200]!r}")
                         continue
+                    
+                    # Extract the text from the chunk
+                    choices = json_data.get('choices') if isinstance(json_data, dict) else None
+                    if choices and isinstance(choices[0], dict):
+                        delta = choices[0].get('delta')
+                        if isinstance(delta, dict):
+                            content = delta.get('content')
+                            if content:
+                                # Yield bytes so WSGI writes them without re-encoding
+                                yield SSE_DELTA_EVENT % _json_dumpb(content)
             
             # Signal end of stream
-            yield f"data: {json.dumps({'end': True})}\n\n"
+            yield SSE_END_EVENT
             
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        # Ask reverse proxies (nginx) and caches not to hold tokens back
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
         
     except Exception as e:
         logger.exception(f"Error in chat endpoint: {e}")
@@ -932,7 +2058,9 @@ def test_embedding_api():
     try:
         # For POST requests, use the provided text
         if request.method == 'POST':
-            data = request.json
+            data = _parse_json_body()
+            if not isinstance(data, dict):
+                return jsonify({"error": "Request body must be a JSON object"}), 400
             test_text = data.get('text', 'This is a test text for embedding.')
             logger.info(f"Testing embedding API with provided text: {test_text[:50]}...")
         else:  # For GET requests, use a default text
@@ -962,29 +2090,61 @@ def test_embedding_api():
 def health_check():
     return jsonify({
         "status": "healthy", 
-        "embedding_api": HAS_EMBEDDING
+        "embedding_api": embedding_available()
     })
 
+def _remove_dir_entries(folder: str) -> None:
+    """Unlink everything in `folder` (recursing into subdirectories) and remove it."""
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        _remove_dir_entries(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError as e:
+                    logger.warning(f"Could not remove {entry.path}: {e}")
+        os.rmdir(folder)
+    except OSError as e:
+        logger.warning(f"Could not remove {folder}: {e}")
+
+def _clear_upload_folder(folder: str) -> None:
+    """Swap in an empty upload folder and delete the old contents in the background.
+
+    The rename is a single metadata operation, so the request returns without
+    waiting on per-file unlinks; uploads that arrive afterwards land in the fresh
+    folder and can never be caught by the background delete.
+    """
+    folder = folder.rstrip(os.sep) or folder
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+        return
+    _remove_dir_in_background(folder)
+    os.makedirs(folder, exist_ok=True)
+
+def _remove_dir_in_background(folder: str) -> None:
+    """Rename `folder` aside, then unlink its contents on a daemon thread."""
+    trash = f"{folder}.trash-{uuid.uuid4().hex}"
+    os.rename(folder, trash)
+    threading.Thread(target=_remove_dir_entries, args=(trash,), daemon=True).start()
+
 # Add this new API endpoint
 
 @app.route('/api/documents/clear', methods=['POST'])
 def clear_documents():
     try:
-        global document_store
-        
-        # Clear the in-memory document store
-        document_count = len(document_store)
-        document_store = {}
+        # Clear the document store, including documents offloaded to disk
+        with _upload_lock:
+            document_count = len(document_store)
+            document_store.clear()
+            corpus_index.clear()
         
         # Optionally remove files from the uploads folder
         delete_files = request.json.get('delete_files', False)
         if delete_files:
-            import shutil
             try:
-                # Remove all files in upload folder
-                shutil.rmtree(app.config["UPLOAD_FOLDER"])
-                # Recreate the empty directory
-                os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+                _clear_upload_folder(app.config["UPLOAD_FOLDER"])
                 logger.info(f"Removed all files from {app.config['UPLOAD_FOLDER']}")
             except Exception as e:
                 logger.error(f"Error removing files: {e}")
@@ -1005,17 +2165,31 @@ DEFAULT_MODEL = "gemma2:27b"  # Default chat model
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = -1
 
+MODELS_CACHE_TTL = 30.0  # Seconds a fetched model list is served without asking the LLM server
+MODELS_FETCH_TIMEOUT = 5  # The dropdown should fall back quickly when the server is down
+_models_cache = {"data": None, "fetched_at": None}
+_models_cache_lock = threading.Lock()
+
 @app.route('/api/models', methods=['GET'])
 def list_models():
+    now = time.monotonic()
+    with _models_cache_lock:
+        cached, fetched_at = _models_cache["data"], _models_cache["fetched_at"]
+    if cached is not None and now - fetched_at < MODELS_CACHE_TTL:
+        return jsonify(cached)
     try:
         # Call the models endpoint of your local API
-        response = requests.get(f"{LLM_API_URL}/models")
+        response = SESSION.get(f"{LLM_API_URL}/models", timeout=MODELS_FETCH_TIMEOUT)
         
         if response.status_code == 200:
-            models_data = response.json()
+            models_data = _json_loads(response.content)
+            with _models_cache_lock:
+                _models_cache.update(data=models_data, fetched_at=time.monotonic())
             return jsonify(models_data)
         else:
             logger.error(f"Failed to fetch models: {response.status_code}")
+            if cached is not None:
+                return jsonify(cached)  # Stale list beats the fallback while the server recovers
             return jsonify({
                 "error": f"Failed to fetch models: {response.status_code}",
                 # Fallback to a minimal set
@@ -1025,6 +2199,8 @@ def list_models():
             }), 502
     except Exception as e:
         logger.exception(f"Error fetching models: {e}")
+        if cached is not None:
+            return jsonify(cached)
         return jsonify({
             "error": str(e),
             # Fallback
@@ -1057,12 +2233,7 @@ def create_job():
         result = _run_entrydetail_job(file_path, max_pages=max_pages, scale=scale, model=model, agent_version=agent_version)
 
         # Persist artifacts under tmp/runs/jobs/<job_id>
-        out_dir = _jobs_dir() / result["job_id"]
-        out_dir.mkdir(parents=True, exist_ok=True)
-        with open(out_dir / "result.wrapper.json", "w", encoding="utf-8") as f:
-            json.dump(result["wrapper"], f, indent=2)
-        with open(out_dir / "summary.json", "w", encoding="utf-8") as f:
-            json.dump({k: v for k, v in result.items() if k != "wrapper"}, f, indent=2)
+        _save_job_artifacts(result["job_id"], result)
 
         return jsonify({
             "job_id": result["job_id"],
@@ -1081,8 +2252,8 @@ def get_job_result(job_id: str):
         p = Path("./tmp/runs/jobs") / job_id / "result.wrapper.json"
         if not p.exists():
             return jsonify({"error": "job result not found"}), 404
-        with open(p, "r", encoding="utf-8") as f:
-            wrapper = json.load(f)
+        with open(p, "rb") as f:
+            wrapper = _json_loads(f.read())
         return jsonify(wrapper)
     except Exception as e:
         logger.exception(f"Error reading job result: {e}")
@@ -1091,13 +2262,18 @@ def get_job_result(job_id: str):
 @app.route('/api/jobs/<job_id>', methods=['DELETE'])
 def delete_job(job_id: str):
     try:
-        j = jobs_store.pop(job_id, None)
+        with _jobs_lock:
+            j = jobs_store.pop(job_id, None)
+            if j and _jobs_by_key.get(j.get('job_key')) == job_id:
+                del _jobs_by_key[j['job_key']]
+            future = _job_futures.get(job_id)
+        if future is not None:
+            future.cancel()  # Still-queued work is dropped; a running worker notices the job is gone
         # Remove artifacts directory if exists
         try:
             d = _jobs_dir() / job_id
             if d.exists():
-                import shutil
-                shutil.rmtree(d)
+                _remove_dir_in_background(str(d))
         except Exception as e:
             logger.warning(f"Could not remove artifacts for job {job_id}: {e}")
         if not j:
@@ -1110,18 +2286,23 @@ def delete_job(job_id: str):
 @app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
 def cancel_job(job_id: str):
     try:
-        j = jobs_store.get(job_id)
-        if not j:
-            return jsonify({"error": "job not found"}), 404
-        j['cancel'] = True
-        j.setdefault('events', []).append({'ts': _utcnow_iso(), 'message': 'cancel requested'})
-        if j.get('status') == 'queued':
-            j['status'] = 'canceled'
-            j['events'].append({'ts': _utcnow_iso(), 'message': 'job canceled'})
-        elif j.get('status') == 'running':
-            j['status'] = 'cancel_requested'
-        j['updated_at'] = _utcnow_iso()
-        return jsonify({"canceled": True, "status": j['status']})
+        with _jobs_lock:
+            j = jobs_store.get(job_id)
+            if not j:
+                return jsonify({"error": "job not found"}), 404
+            j['cancel'] = True
+            _job_events(j).append({'ts': _utcnow_iso(), 'message': 'cancel requested'})
+            if j.get('status') == 'queued':
+                j['status'] = 'canceled'
+                j['events'].append({'ts': _utcnow_iso(), 'message': 'job canceled'})
+            elif j.get('status') == 'running':
+                j['status'] = 'cancel_requested'
+            j['updated_at'] = _utcnow_iso()
+            status = j['status']
+            future = _job_futures.get(job_id) if status == 'canceled' else None
+        if future is not None:
+            future.cancel()  # Frees the queue slot if the worker has not started yet
+        return jsonify({"canceled": True, "status": status})
     except Exception as e:
         logger.exception(f"Error canceling job: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1176,78 +2357,51 @@ def create_job_async():
 
         job_key = f"{file_sha}:{max_pages}:{scale}:{model}:{agent_version}"
         # De-dup: if a job for this hash+options is queued or running, return it
-        for jid, j in jobs_store.items():
-            if j.get('job_key') == job_key and j.get('status') in ('queued','running'):
-                return jsonify({"job_id": jid, "status": j.get('status'), "dedup": True})
+        with _jobs_lock:
+            existing = _active_job_for_key(job_key)
+            if existing is not None:
+                return jsonify({"job_id": existing, "status": jobs_store[existing].get('status'), "dedup": True})
 
-        job_id = str(uuid.uuid4())
-        jobs_store[job_id] = {
-            "job_id": job_id,
-            "filename": base_fn,
-            "file_sha": file_sha,
-            "job_key": job_key,
-            "file_path": file_path,
-            "status": "queued",
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "params": {"max_pages": max_pages, "scale": scale, "model": model, "agent_version": agent_version}
-        }
-
-        def _evt(msg):
-            try:
-                jobs_store[job_id].setdefault('events', []).append({
-                    'ts': datetime.now(timezone.utc).isoformat(),
-                    'message': msg
-                })
-                jobs_store[job_id]['updated_at'] = datetime.now(timezone.utc).isoformat()
-            except Exception:
-                pass
+            job_id = str(uuid.uuid4())
+            _jobs_by_key[job_key] = job_id
+            jobs_store[job_id] = {
+                "job_id": job_id,
+                "filename": base_fn,
+                "file_sha": file_sha,
+                "job_key": job_key,
+                "file_path": file_path,
+                "status": "queued",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "params": {"max_pages": max_pages, "scale": scale, "model": model, "agent_version": agent_version}
+            }
 
         def _worker():
             try:
-                jobs_store[job_id]["status"] = "running"
-                _evt("job started")
-                # If canceled before heavy work, exit early
-                if jobs_store[job_id].get('cancel'):
-                    jobs_store[job_id]['status'] = 'canceled'
-                    _evt("job canceled before start")
+                # If canceled while queued or before heavy work, exit early
+                job = _job_snapshot(job_id)
+                if job is None:
+                    return  # Deleted while waiting in the queue
+                if job.get('cancel'):
+                    _update_job(job_id, "job canceled before start", status='canceled')
                     return
-                _evt("generating entry detail")
+                _update_job(job_id, "job started", status="running")
+                _update_job(job_id, "generating entry detail")
                 result = _run_entrydetail_job(file_path, max_pages=max_pages, scale=scale, model=model, agent_version=agent_version)
-                _evt("generation complete; saving artifacts")
-                out_dir = _jobs_dir() / job_id
-                out_dir.mkdir(parents=True, exist_ok=True)
-                with open(out_dir / "result.wrapper.json", "w", encoding="utf-8") as f:
-                    json.dump(result["wrapper"], f, indent=2)
-                with open(out_dir / "summary.json", "w", encoding="utf-8") as f:
-                    json.dump({k: v for k, v in result.items() if k != "wrapper"}, f, indent=2)
-                if jobs_store[job_id].get('cancel'):
-                    jobs_store[job_id].update({
-                        "status": "canceled",
-                        "elapsed_sec": result.get("elapsed_sec"),
-                        "model": result.get("model"),
-                        "updated_at": _utcnow_iso(),
-                    })
-                    _evt("job canceled (post-run)")
+                _update_job(job_id, "generation complete; saving artifacts")
+                _save_job_artifacts(job_id, result)
+                if (_job_snapshot(job_id) or {}).get('cancel'):
+                    _update_job(job_id, "job canceled (post-run)", status="canceled",
+                                elapsed_sec=result.get("elapsed_sec"), model=result.get("model"))
                 else:
-                    jobs_store[job_id].update({
-                        "status": "done",
-                        "elapsed_sec": result.get("elapsed_sec"),
-                        "model": result.get("model"),
-                        "updated_at": datetime.now(timezone.utc).isoformat(),
-                    })
-                    _evt("job done")
+                    _update_job(job_id, "job done", status="done",
+                                elapsed_sec=result.get("elapsed_sec"), model=result.get("model"),
+                                **_wrapper_quality(result.get("wrapper")))
             except Exception as e:
                 logger.exception(f"Job {job_id} failed: {e}")
-                jobs_store[job_id].update({
-                    "status": "failed",
-                    "error": str(e),
-                    "updated_at": datetime.now(timezone.utc).isoformat(),
-                })
-                _evt(f"job failed: {e}")
+                _update_job(job_id, f"job failed: {e}", status="failed", error=str(e))
 
-        t = threading.Thread(target=_worker, daemon=True)
-        t.start()
+        _submit_job(job_id, _worker)
 
         return jsonify({"job_id": job_id, "status": "queued"})
     except Exception as e:
@@ -1258,25 +2412,16 @@ def create_job_async():
 @app.route('/api/jobs', methods=['GET'])
 def list_jobs_api():
     try:
-        # Build list from in-memory store; augment done jobs with schema_ok/confidence if available
+        # Build list from in-memory store; done jobs already carry schema_ok/overall_confidence.
+        # Event logs are left to the per-job endpoint.
         jobs = []
-        for jid, j in jobs_store.items():
-            item = dict(j)
+        with _jobs_lock:
+            snapshot = [_copy_job(j, with_events=False) for j in jobs_store.values()]
+        for item in snapshot:
             try:
-                item['size_bytes'] = os.path.getsize(j.get('file_path',''))
+                item['size_bytes'] = os.path.getsize(item.get('file_path',''))
             except Exception:
                 pass
-            if j.get("status") == "done":
-                p = _jobs_dir() / jid / "result.wrapper.json"
-                if p.exists():
-                    try:
-                        with open(p, 'r', encoding='utf-8') as f:
-                            wrapper = json.load(f)
-                            val = wrapper.get('meta', {}).get('validation', {})
-                            item['schema_ok'] = val.get('schema_ok')
-                            item['overall_confidence'] = wrapper.get('meta', {}).get('overall_confidence')
-                    except Exception:
-                        pass
             jobs.append(item)
         # Sort newest first
         jobs.sort(key=lambda x: x.get('created_at', ''), reverse=True)
@@ -1289,18 +2434,9 @@ def list_jobs_api():
 @app.route('/api/jobs/<job_id>', methods=['GET'])
 def get_job(job_id: str):
     try:
-        j = jobs_store.get(job_id)
-        if not j:
+        item = _job_snapshot(job_id)
+        if not item:
             return jsonify({"error": "job not found"}), 404
-        item = dict(j)
-        if j.get("status") == "done":
-            p = _jobs_dir() / job_id / "result.wrapper.json"
-            if p.exists():
-                with open(p, 'r', encoding='utf-8') as f:
-                    wrapper = json.load(f)
-                    val = wrapper.get('meta', {}).get('validation', {})
-                    item['schema_ok'] = val.get('schema_ok')
-                    item['overall_confidence'] = wrapper.get('meta', {}).get('overall_confidence')
         return jsonify(item)
     except Exception as e:
         logger.exception(f"Error reading job: {e}")
@@ -1309,5 +2445,8 @@ def get_job(job_id: str):
 # Run the app
 if __name__ == '__main__':
     port = 5001  # Use port 5001 to avoid conflict with AirPlay on Mac
+    # Development server only; containers run gunicorn (see Dockerfile). The debugger and
+    # reloader stay opt-in via FLASK_DEBUG=1.
+    debug = os.getenv("FLASK_DEBUG", "").strip().lower() in ("1", "true", "yes")
     logger.info(f"Starting Flask server on port {port}")
-    app.run(debug=True, host='0.0.0.0', port=port)
+    app.run(debug=debug, host='0.0.0.0', port=port, threaded=True)
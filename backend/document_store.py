@@ -0,0 +1,190 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Optional zstd compression for offloaded documents; plain pickle when missing
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentStore(MutableMapping):
+    """LRU mapping of filename -> document data with a disk-backed second tier.
+
+    At most `max_resident` documents are kept in memory. Inserting beyond
+    that pickles the least recently used entry to disk and a later lookup
+    loads it back transparently. Keys in `transient_keys` (e.g.
+    device-resident tensors) are dropped on offload instead of pickled.
+
+    Each store writes to its own directory under `offload_root`, created on
+    the first offload and removed by clear() or at exit, so several processes
+    (or test runs) sharing a root never delete each other's files.
+
+    `on_offload(name)` and `on_reload(name, data)`, when set, are called (under
+    the store lock) as a document leaves or re-enters memory, so side indexes
+    can follow the resident set.
+    """
+
+    def __init__(self, max_resident: int = 64, offload_root: str = "./documents/offload",
+                 transient_keys: Tuple[str, ...] = (), preview_chars: int = 100) -> None:
+        self.max_resident = max(1, max_resident)
+        self.offload_root = offload_root
+        self.offload_dir: Optional[str] = None  # This store's directory under offload_root
+        self._cleanup: Optional[weakref.finalize] = None
+        self.transient_keys = transient_keys
+        self.preview_chars = preview_chars
+        self._resident: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._offloaded: Dict[str, str] = {}  # name -> file path
+        self._previews: Dict[str, str] = {}  # name -> text head, so listing never touches disk
+        self.version = 0  # Bumped on every insert/removal; lets listings be cached by clients
+        self._lock = threading.RLock()
+        self.on_offload: Optional[Callable[[str], None]] = None
+        self.on_reload: Optional[Callable[[str, Dict[str, Any]], None]] = None
+
+    # Mapping protocol
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return self._resident[name]
+            path = self._offloaded.pop(name, None)
+            if path is None:
+                raise KeyError(name)
+            try:
+                data = self._load(path)
+            except Exception:
+                self._offloaded[name] = path
+                raise
+            self._remove_file(path)
+            self._insert(name, data)
+            if self.on_reload is not None:
+                self.on_reload(name, data)
+            return data
+
+    def __setitem__(self, name: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            path = self._offloaded.pop(name, None)
+            if path is not None:
+                self._remove_file(path)
+            self._insert(name, data)
+            self.version += 1
+
+    def __delitem__(self, name: str) -> None:
+        with self._lock:
+            if name in self._resident:
+                del self._resident[name]
+            elif name in self._offloaded:
+                self._remove_file(self._offloaded.pop(name))
+            else:
+                raise KeyError(name)
+            self._previews.pop(name, None)
+            self.version += 1
+
+    def __contains__(self, name: object) -> bool:
+        with self._lock:
+            return name in self._resident or name in self._offloaded
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._resident) + list(self._offloaded))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._resident) + len(self._offloaded)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._resident.clear()
+            self._offloaded.clear()
+            self._previews.clear()
+            self.version += 1
+            if self._cleanup is not None:
+                self._cleanup()  # Removes this store's directory only
+                self._cleanup = None
+                self.offload_dir = None
+
+    def is_offloaded(self, name: str) -> bool:
+        with self._lock:
+            return name in self._offloaded
+
+    def peek(self, name: str) -> Dict[str, Any]:
+        """The document without touching the LRU: an offloaded one is read from disk but stays offloaded."""
+        with self._lock:
+            if name in self._resident:
+                return self._resident[name]
+            path = self._offloaded.get(name)
+            if path is None:
+                raise KeyError(name)
+            return self._load(path)
+
+    def previews(self) -> List[Tuple[str, str]]:
+        """(name, start of text) for every document in both tiers, in first-upload order.
+
+        The order does not change on lookups, so it is stable for a given `version`
+        and listings never load offloaded documents.
+        """
+        with self._lock:
+            return list(self._previews.items())
+
+    # Internals
+    def _insert(self, name: str, data: Dict[str, Any]) -> None:
+        self._resident[name] = data
+        self._resident.move_to_end(name)
+        self._previews[name] = (data.get("text") or "")[:self.preview_chars]
+        while len(self._resident) > self.max_resident:
+            oldest, oldest_data = self._resident.popitem(last=False)
+            try:
+                self._offloaded[oldest] = self._dump(oldest_data)
+                logger.info(f"Offloaded document {oldest} to disk")
+                if self.on_offload is not None:
+                    self.on_offload(oldest)
+            except Exception as e:
+                # Never lose a document to a failed write; keep it resident instead
+                logger.error(f"Could not offload document {oldest}: {e}")
+                self._resident[oldest] = oldest_data
+                self._resident.move_to_end(oldest, last=False)
+                break
+
+    def _dump(self, data: Dict[str, Any]) -> str:
+        if self.offload_dir is None:
+            os.makedirs(self.offload_root, exist_ok=True)
+            self.offload_dir = tempfile.mkdtemp(prefix=f"store-{os.getpid()}-", dir=self.offload_root)
+            # Offloaded files only make sense to the process that wrote them
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self.offload_dir, True)
+        payload = pickle.dumps(
+            {k: v for k, v in data.items() if k not in self.transient_keys},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+        suffix = ".pkl"
+        if zstandard is not None:
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+            suffix = ".pkl.zst"
+        path = os.path.join(self.offload_dir, f"{uuid.uuid4().hex}{suffix}")
+        with open(path, "wb") as f:
+            f.write(payload)
+        return path
+
+    def _load(self, path: str) -> Dict[str, Any]:
+        with open(path, "rb") as f:
+            payload = f.read()
+        if path.endswith(".zst"):
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return pickle.loads(payload)
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,21 +1,81 @@
 import os
 import json
+import hashlib
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
-from PyPDF2 import PdfReader  # pip install PyPDF2
+
+# PyMuPDF (the backend's PDF library) extracts text in C; PyPDF2 is the pure-Python fallback
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
 
 EMBEDDING_ENDPOINT = "http://127.0.0.1:11434/v1/embeddings"
 MODEL_NAME = "bge-m3"
+EMBEDDING_CACHE_FILE = "./.embedcache.sqlite"  # Content-addressed vectors reused across runs
+PARSE_WORKERS = min(os.cpu_count() or 1, 4)  # Parsers hold the GIL, so parse in processes
+EMBED_WORKERS = 8  # Embedding requests are network-bound and can overlap
+EMBED_BATCH_SIZE = 32  # Texts sent per /v1/embeddings request
+
+class EmbeddingCache:
+    """sqlite-backed map of sha256(model, text) -> float32 embedding."""
+
+    def __init__(self, path=EMBEDDING_CACHE_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    @staticmethod
+    def key(text, model=MODEL_NAME):
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        return None if row is None else array("f", row[0]).tolist()
+
+    def put(self, key, embedding):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", (key, array("f", embedding).tobytes()))
+
+    def get_or_compute_many(self, texts, compute_many=None, workers=EMBED_WORKERS):
+        """Embeddings for `texts`, calling `compute_many` (default get_embeddings_batch) only for cache misses.
+
+        Misses are sent in batches of EMBED_BATCH_SIZE, several batches at a time;
+        cache reads and writes stay on the calling thread because sqlite
+        connections are not shared across threads.
+        """
+        compute_many = compute_many or get_embeddings_batch
+        keys = [self.key(text) for text in texts]
+        results = [self.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        batches = [missing[i:i + EMBED_BATCH_SIZE] for i in range(0, len(missing), EMBED_BATCH_SIZE)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                computed = pool.map(compute_many, [[texts[i] for i in batch] for batch in batches])
+                for batch, embeddings in zip(batches, computed):
+                    for i, embedding in zip(batch, embeddings):
+                        results[i] = embedding
+                        if embedding:
+                            self.put(keys[i], embedding)
+        return results
 
 def read_text_file(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
         return f.read()
 
 def read_pdf_file(file_path):
+    if fitz is not None:
+        with fitz.open(file_path) as doc:
+            return "".join(page.get_text() + "\n" for page in doc)
+    from PyPDF2 import PdfReader  # pip install PyPDF2
     reader = PdfReader(file_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    return "".join((page.extract_text() or "") + "\n" for page in reader.pages)
+
+def read_document(file_path):
+    if file_path.endswith(".txt"):
+        return read_text_file(file_path)
+    return read_pdf_file(file_path)  # handle PDFs
 
 def get_embedding(text):
     payload = {
@@ -24,37 +84,53 @@ def get_embedding(text):
     }
     response = requests.post(EMBEDDING_ENDPOINT, json=payload, stream=True)
     embedding = []
-    print("Streaming response:")
-    for chunk in response.iter_lines(decode_unicode=True):
+    for chunk in response.iter_lines():
         if chunk:
             try:
                 data = json.loads(chunk)
-                print(data)  # Print the streamed JSON chunk
-                if "embedding_chunk" in data:
-                    embedding.extend(data["embedding_chunk"])
             except json.JSONDecodeError:
-                print("Non-json chunk:", chunk)
-    print("Final embedding:", embedding)
+                continue  # Skip non-JSON keep-alive/status lines
+            if "embedding_chunk" in data:
+                embedding.extend(data["embedding_chunk"])
     return embedding
 
-def process_documents(folder_path):
-    embeddings_data = {}
+def get_embeddings_batch(texts):
+    """Embed several texts with one OpenAI-style request; one call per text if the server rejects it.
+
+    Any error status (4xx: array input unsupported, 5xx: transient failure) falls back
+    to per-text calls, which return [] for texts that still fail, so one bad batch
+    never aborts a whole run.
+    """
+    response = requests.post(EMBEDDING_ENDPOINT, json={"model": MODEL_NAME, "input": texts})
+    if response.status_code >= 400:
+        return [get_embedding(text) for text in texts]
+    items = sorted(response.json().get("data", []), key=lambda item: item.get("index", 0))
+    if len(items) != len(texts):
+        return [get_embedding(text) for text in texts]
+    return [item.get("embedding", []) for item in items]
+
+def process_documents(folder_path, cache=None):
+    cache = cache or EmbeddingCache()
+    file_paths = []
     for root, dirs, files in os.walk(folder_path):
         for file in files:
             if file.endswith(".txt") or file.endswith(".pdf"):
                 file_path = os.path.join(root, file)
                 print(f"Processing {file_path}...")
-                if file.endswith(".txt"):
-                    text = read_text_file(file_path)
-                else:  # handle PDFs
-                    text = read_pdf_file(file_path)
-                # Optionally preprocess or split text here if needed
-                embedding = get_embedding(text)
-                if embedding:
-                    embeddings_data[file_path] = {
-                        "text": text,
-                        "embedding": embedding
-                    }
+                file_paths.append(file_path)
+    # Parse files in parallel; each worker opens its own PdfReader
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        texts = dict(zip(file_paths, pool.map(read_document, file_paths)))
+    # Optionally preprocess or split text here if needed
+    # Unchanged documents are served from the cache; only new content is embedded
+    embeddings = cache.get_or_compute_many(list(texts.values()))
+    embeddings_data = {}
+    for (file_path, text), embedding in zip(texts.items(), embeddings):
+        if embedding:
+            embeddings_data[file_path] = {
+                "text": text,
+                "embedding": embedding
+            }
     return embeddings_data
 
 def save_embeddings(embeddings_data, output_file):
@@ -0,0 +1,29 @@
+"""PDF work that runs on the backend's process pool.
+
+Pool workers are started by forkserver/spawn and import only this module, so it
+must stay free of import-time side effects: no app state, no threads, no I/O.
+"""
+from typing import List
+
+import fitz  # PyMuPDF
+
+
+def extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Extract text for pages [start, stop). Runs in a worker process, so it opens its own document."""
+    with fitz.open(file_path) as doc:
+        return [doc[i].get_text("text") for i in range(start, stop)]
+
+
+def render_pages(file_path: str, pages: List[int], scale: float, image_format: str = "png",
+                 jpeg_quality: int = 85) -> List[bytes]:
+    """Render the given pages to image bytes. Runs in a worker process, so it opens its own document."""
+    mat = fitz.Matrix(scale, scale)
+    images: List[bytes] = []
+    with fitz.open(file_path) as doc:
+        for i in pages:
+            pix = doc.load_page(i).get_pixmap(matrix=mat, alpha=False)
+            if image_format in ("jpeg", "jpg"):
+                images.append(pix.tobytes("jpeg", jpg_quality=jpeg_quality))
+            else:
+                images.append(pix.tobytes("png"))
+    return images
@@ -1,5 +1,8 @@
 import os
-from typing import Protocol, Iterator, List, Dict, Optional
+import threading
+from typing import Protocol, Iterator, List, Dict, Optional, Tuple
+
+from .ollama_provider import OllamaProvider
 
 
 class Provider(Protocol):
@@ -9,6 +12,10 @@ class Provider(Protocol):
     def embed(self, text: str, model: Optional[str] = None, timeout: Optional[float] = None) -> List[float]:
         ...
 
+    # Batched embeddings, one vector per input text in input order
+    def embed_many(self, texts: List[str], model: Optional[str] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        ...
+
     # Streaming chat completion; yields content deltas
     def chat_stream(
         self,
@@ -60,19 +67,32 @@ def select_provider_name(req=None) -> str:
     return "ollama"
 
 
-def get_provider(req=None) -> Provider:
-    """Return a provider instance based on selection for this request.
+# Environment read by provider constructors; a change yields a fresh instance
+_PROVIDER_ENV = ("LLM_API_URL", "OLLAMA_BASE_URL", "EMBEDDING_MODEL", "CHAT_MODEL")
+_providers: Dict[Tuple[Optional[str], ...], Provider] = {}
+_providers_lock = threading.Lock()
 
-    If `req` is None, uses environment defaults.
-    """
-    name = select_provider_name(req)
+
+def _construct(name: str) -> Provider:
     if name == "bedrock":
         # Lazy import to avoid optional deps for other providers
         from .bedrock_provider import BedrockProvider
 
         return BedrockProvider()
     # Default to ollama
-    from .ollama_provider import OllamaProvider
-
     return OllamaProvider()
 
+
+def get_provider(req=None) -> Provider:
+    """Return a provider instance based on selection for this request.
+
+    If `req` is None, uses environment defaults. Instances are cached per
+    provider name and configuration, so requests share one provider.
+    """
+    name = select_provider_name(req)
+    key = (name,) + tuple(os.getenv(var) for var in _PROVIDER_ENV)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = _construct(name)
+        return provider
@@ -10,6 +10,9 @@ class BedrockProvider:
     def embed(self, text: str, model: Optional[str] = None, timeout: Optional[float] = None) -> List[float]:
         raise NotImplementedError("Bedrock embeddings not implemented yet")
 
+    def embed_many(self, texts: List[str], model: Optional[str] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        raise NotImplementedError("Bedrock embeddings not implemented yet")
+
     def chat_stream(
         self,
         messages: List[Dict[str, str]],
@@ -3,6 +3,35 @@ import json
 from typing import Iterator, List, Dict, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson parses each streamed chunk and embedding response much faster; stdlib fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# The connection pool lives at module level, so every instance (one per configuration,
+# see get_provider) reuses its keep-alive connections to the LLM server. Retries cover only
+# connect errors and 429/502/503/504; a read timeout is not replayed, as that would rerun generation
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        read=0,
+        backoff_factor=0.2,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    ),
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
 
 
 class OllamaProvider:
@@ -18,6 +47,7 @@ class OllamaProvider:
         self.base_url = self._resolve_base_url()
         self.embedding_model = os.getenv("EMBEDDING_MODEL", "bge-m3")
         self.chat_model = os.getenv("CHAT_MODEL", "gemma2:27b")
+        self._session = _SESSION
 
     def _resolve_base_url(self) -> str:
         # Highest precedence: explicit API URL
@@ -36,9 +66,9 @@ class OllamaProvider:
             "model": model or self.embedding_model,
             "input": text,
         }
-        r = requests.post(url, json=payload, timeout=timeout)
+        r = self._session.post(url, json=payload, timeout=timeout)
         r.raise_for_status()
-        data = r.json()
+        data = _json_loads(r.content)
         if isinstance(data, dict):
             # OpenAI-compatible response: {"data":[{"embedding":[...] }]} or {"embedding": [...]}
             if "data" in data and data["data"]:
@@ -49,6 +79,31 @@ class OllamaProvider:
                 return data["embedding"]  # Non-standard direct embedding
         return []
 
+    def embed_many(self, texts: List[str], model: Optional[str] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        """Embed several texts in one request, falling back to one call per text.
+
+        Servers that reject array inputs (4xx) are retried text by text, so the
+        result is always one vector per input, in input order.
+        """
+        if not texts:
+            return []
+        url = f"{self.base_url}/embeddings"
+        payload = {
+            "model": model or self.embedding_model,
+            "input": texts,
+        }
+        r = self._session.post(url, json=payload, timeout=timeout)
+        if 400 <= r.status_code < 500:
+            return [self.embed(text, model=model, timeout=timeout) for text in texts]
+        r.raise_for_status()
+        data = _json_loads(r.content)
+        items = data.get("data") if isinstance(data, dict) else None
+        if not isinstance(items, list) or len(items) != len(texts):
+            return [self.embed(text, model=model, timeout=timeout) for text in texts]
+        # OpenAI-compatible servers may reorder; "index" says where each vector belongs
+        items = sorted(items, key=lambda item: item.get("index", 0))
+        return [item.get("embedding", []) for item in items]
+
     # Streaming chat completion; yields content deltas (strings)
     def chat_stream(
         self,
@@ -69,41 +124,31 @@ class OllamaProvider:
         if max_tokens is not None and max_tokens >= 0:
             payload["max_tokens"] = max_tokens
 
-        with requests.post(url, json=payload, stream=True, timeout=timeout) as resp:
+        with self._session.post(url, json=payload, stream=True, timeout=timeout) as resp:
             resp.raise_for_status()
+            # Lines stay bytes: the JSON parser takes them directly, so no per-line decode
             for raw in resp.iter_lines():
                 if not raw:
                     continue
-                try:
-                    line = raw.decode("utf-8")
-                except Exception:
-                    continue
-                if line.startswith("data: "):
-                    line = line[6:]
-                if line.strip() == "[DONE]" or line.strip() == "data: [DONE]":
+                line = raw[6:] if raw[:6] == b"data: " else raw
+                if line[:6] == b"[DONE]":
                     # End of stream marker
                     break
                 try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                # Standard OpenAI streaming shape
-                try:
-                    choices = obj.get("choices") or []
-                    if choices:
-                        delta = choices[0].get("delta") or {}
-                        content = delta.get("content")
-                        if content:
-                            yield content
-                except Exception:
+                    # Standard OpenAI streaming shape; one lookup chain per token
+                    content = _json_loads(line)["choices"][0]["delta"]["content"]
+                except (ValueError, LookupError, TypeError):
+                    # Malformed JSON, role-only/usage chunks, or unexpected shapes
                     continue
+                if content:
+                    yield content
 
     # List available models in {"data": [{"id": "..."}, ...]} shape
     def list_models(self, timeout: Optional[float] = None) -> List[Dict[str, str]]:
         url = f"{self.base_url}/models"
-        r = requests.get(url, timeout=timeout)
+        r = self._session.get(url, timeout=timeout)
         r.raise_for_status()
-        payload = r.json()
+        payload = _json_loads(r.content)
         if isinstance(payload, dict) and isinstance(payload.get("data"), list):
             out: List[Dict[str, str]] = []
             for item in payload["data"]:
@@ -0,0 +1,133 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app as backend_app  # noqa: E402
+
+
+def _fake_stream(lines):
+    response = mock.MagicMock()
+    response.__enter__.return_value = response
+    response.iter_lines.return_value = lines
+    return response
+
+
+class TestChatStream(unittest.TestCase):
+    def setUp(self):
+        self.client = backend_app.app.test_client()
+
+    def _events(self, lines):
+        with mock.patch.object(backend_app.SESSION, "post", return_value=_fake_stream(lines)):
+            resp = self.client.post("/api/chat", json={"message": "hi"})
+            body = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        return [json.loads(block[len("data: "):]) for block in body.split("\n\n") if block]
+
+    def test_deltas_are_forwarded_and_stream_is_terminated(self):
+        lines = [
+            b'data: {"choices":[{"delta":{"role":"assistant"}}]}',
+            b"",
+            b'data: {"choices":[{"delta":{"content":"Hel"}}]}',
+            b'data: {"choices":[{"delta":{"content":"lo \\u00e9"}}]}',
+            b"data: [DONE]",
+        ]
+        self.assertEqual(self._events(lines), [{"delta": "Hel"}, {"delta": "lo é"}, {"end": True}])
+
+    def test_stream_disables_proxy_buffering(self):
+        with mock.patch.object(backend_app.SESSION, "post", return_value=_fake_stream([])):
+            resp = self.client.post("/api/chat", json={"message": "hi"})
+            resp.get_data()
+        self.assertEqual(resp.headers["X-Accel-Buffering"], "no")
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+
+    def test_raw_mode_forwards_upstream_bytes(self):
+        upstream = [b'data: {"choices":[{"delta":{"content":"Hi"}}]}\n\n', b"", b"data: [DONE]\n\n"]
+        response = _fake_stream([])
+        response.iter_content.return_value = upstream
+        with mock.patch.object(backend_app.SESSION, "post", return_value=response):
+            resp = self.client.post("/api/chat?raw=true", json={"message": "hi"})
+            body = resp.get_data()
+        self.assertEqual(body, b"".join(upstream))
+        response.iter_lines.assert_not_called()
+
+    def test_malformed_request_body_is_rejected(self):
+        resp = self.client.post("/api/chat", data=b"{not json", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post("/api/chat", json=["message"])
+        self.assertEqual(resp.status_code, 400)
+
+    def test_malformed_chunks_are_skipped(self):
+        lines = [b"data: {not json", b'data: ["unexpected"]', b'data: {"choices":[{"delta":{"content":"ok"}}]}']
+        self.assertEqual(self._events(lines), [{"delta": "ok"}, {"end": True}])
+
+    def test_document_context_is_retrieved_before_calling_llm(self):
+        backend_app.document_store["doc.txt"] = {"text": "full text", "texts": ["chunk"]}
+        self.addCleanup(backend_app.document_store.pop, "doc.txt", None)
+        with mock.patch.object(backend_app, "find_relevant_chunks", return_value=["first", "second"]), \
+                mock.patch.object(backend_app.SESSION, "post", return_value=_fake_stream([])) as post:
+            resp = self.client.post("/api/chat", json={"message": "hi", "use_documents": True, "documents": ["doc.txt"]})
+            resp.get_data()
+        system_prompt = json.loads(post.call_args.kwargs["data"])["messages"][0]["content"]
+        self.assertIn("Document: doc.txt", system_prompt)
+        self.assertIn("first\n\n---\n\nsecond", system_prompt)
+
+    def test_multiple_documents_are_searched_together(self):
+        for name in ("a.txt", "b.txt"):
+            backend_app.document_store[name] = {"text": f"{name} text", "texts": ["chunk"]}
+            self.addCleanup(backend_app.document_store.pop, name, None)
+        hits = [("b.txt", "from b"), ("a.txt", "from a")]
+        with mock.patch.object(backend_app, "search_corpus", return_value=hits) as search, \
+                mock.patch.object(backend_app.SESSION, "post", return_value=_fake_stream([])) as post:
+            resp = self.client.post("/api/chat", json={"message": "hi", "use_documents": True, "documents": ["a.txt", "b.txt"]})
+            resp.get_data()
+        self.assertEqual(search.call_args.args[1], ["a.txt", "b.txt"])
+        system_prompt = json.loads(post.call_args.kwargs["data"])["messages"][0]["content"]
+        self.assertIn("Documents: a.txt, b.txt", system_prompt)
+        self.assertIn("[b.txt]\nfrom b\n\n---\n\n[a.txt]\nfrom a", system_prompt)
+
+    def test_falls_back_to_document_start_without_hits(self):
+        backend_app.document_store["doc.txt"] = {"text": "x" * 3000, "texts": []}
+        self.addCleanup(backend_app.document_store.pop, "doc.txt", None)
+        with mock.patch.object(backend_app.SESSION, "post", return_value=_fake_stream([])) as post:
+            resp = self.client.post("/api/chat", json={"message": "hi", "use_documents": True, "documents": ["doc.txt"]})
+            resp.get_data()
+        system_prompt = json.loads(post.call_args.kwargs["data"])["messages"][0]["content"]
+        self.assertTrue(system_prompt.endswith("\n\n" + "x" * 2000))
+
+    def test_document_start_prompt_follows_store_changes(self):
+        backend_app.document_store["doc.txt"] = {"text": "old", "texts": []}
+        self.addCleanup(backend_app.document_store.pop, "doc.txt", None)
+        self.assertTrue(backend_app._build_system_message("hi", True, ["doc.txt"]).endswith("old"))
+        backend_app.document_store["doc.txt"] = {"text": "new", "texts": []}
+        self.assertTrue(backend_app._build_system_message("hi", True, ["doc.txt"]).endswith("new"))
+
+
+class TestListModels(unittest.TestCase):
+    def setUp(self):
+        backend_app._models_cache.update(data=None, fetched_at=None)
+        self.addCleanup(backend_app._models_cache.update, data=None, fetched_at=None)
+        self.client = backend_app.app.test_client()
+
+    def test_model_list_is_cached_and_served_stale_on_errors(self):
+        ok = mock.Mock(status_code=200, content=json.dumps({"data": [{"id": "m1"}]}).encode())
+        with mock.patch.object(backend_app.SESSION, "get", return_value=ok) as get:
+            self.assertEqual(self.client.get("/api/models").get_json(), {"data": [{"id": "m1"}]})
+            self.client.get("/api/models")
+        get.assert_called_once()
+        with mock.patch.object(backend_app, "MODELS_CACHE_TTL", 0.0), \
+                mock.patch.object(backend_app.SESSION, "get", side_effect=backend_app.requests.ConnectionError("down")):
+            resp = self.client.get("/api/models")
+        self.assertEqual((resp.status_code, resp.get_json()), (200, {"data": [{"id": "m1"}]}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app import chunk_text  # noqa: E402
+
+
+class TestChunkText(unittest.TestCase):
+    def test_short_text_is_single_chunk(self):
+        self.assertEqual(chunk_text("hello", chunk_size=10, chunk_overlap=2), ["hello"])
+
+    def test_prefers_sentence_end(self):
+        text = "a" * 60 + ". " + "b" * 60
+        chunks = chunk_text(text, chunk_size=100, chunk_overlap=10)
+        self.assertTrue(chunks[0].endswith("."))
+        self.assertEqual(len(chunks[0]), 61)
+
+    def test_falls_back_to_paragraph_then_line_breaks(self):
+        para = "x" * 40 + "\n\n" + "y" * 80
+        self.assertTrue(chunk_text(para, chunk_size=100, chunk_overlap=10)[0].endswith("\n\n"))
+        line = "x" * 40 + "\n" + "y" * 80
+        self.assertTrue(chunk_text(line, chunk_size=100, chunk_overlap=10)[0].endswith("\n"))
+
+    def test_chunks_overlap_and_cover_text(self):
+        text = " ".join(f"word{i}" for i in range(500))
+        chunks = chunk_text(text, chunk_size=200, chunk_overlap=50)
+        self.assertTrue(all(len(c) <= 200 for c in chunks))
+        for prev, nxt in zip(chunks, chunks[1:]):
+            self.assertEqual(prev[-50:], nxt[:50])
+        self.assertTrue(text.endswith(chunks[-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+
+# Ensure we can import backend modules from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from document_store import DocumentStore  # noqa: E402
+
+
+class TestDocumentStore(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.offload_root = os.path.join(tmpdir.name, "offload")
+        self.store = DocumentStore(max_resident=2, offload_root=self.offload_root, transient_keys=("gpu_matrix",))
+
+    def _doc(self, name):
+        return {"text": f"text of {name}", "embedding_matrix": np.eye(2, dtype=np.float32), "gpu_matrix": object()}
+
+    def test_least_recently_used_document_is_offloaded_and_reloaded(self):
+        for name in ("a", "b"):
+            self.store[name] = self._doc(name)
+        self.store["a"]  # touch: "b" becomes the eviction candidate
+        self.store["c"] = self._doc("c")
+        self.assertEqual(len(os.listdir(self.store.offload_dir)), 1)
+        self.assertEqual(len(self.store), 3)
+        self.assertIn("b", self.store)
+
+        reloaded = self.store["b"]
+        self.assertEqual(reloaded["text"], "text of b")
+        np.testing.assert_array_equal(reloaded["embedding_matrix"], np.eye(2))
+        self.assertNotIn("gpu_matrix", reloaded)
+
+    def test_previews_cover_both_tiers_and_clear_removes_files(self):
+        for name in ("a", "b", "c"):
+            self.store[name] = self._doc(name)
+        self.assertEqual(sorted(self.store.previews()), [(n, f"text of {n}") for n in ("a", "b", "c")])
+        offload_dir = self.store.offload_dir
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertFalse(os.path.exists(offload_dir))
+
+    def test_stores_sharing_a_root_keep_their_own_files(self):
+        for name in ("a", "b", "c"):
+            self.store[name] = self._doc(name)
+        other = DocumentStore(max_resident=1, offload_root=self.offload_root)
+        other["x"], other["y"] = self._doc("x"), self._doc("y")
+        self.assertNotEqual(other.offload_dir, self.store.offload_dir)
+        other.clear()
+        self.assertEqual(self.store["a"]["text"], "text of a")
+
+    def test_previews_keep_upload_order_and_version_tracks_changes(self):
+        for name in ("a", "b", "c"):
+            self.store[name] = self._doc(name)
+        version = self.store.version
+        self.store["a"]  # lookups and reloads from disk reorder the LRU, not the listing
+        self.store["b"]
+        self.assertEqual([n for n, _ in self.store.previews()], ["a", "b", "c"])
+        self.assertEqual(self.store.version, version)
+        del self.store["b"]
+        self.assertGreater(self.store.version, version)
+
+    def test_missing_document_raises_key_error(self):
+        self.assertIsNone(self.store.get("missing"))
+        with self.assertRaises(KeyError):
+            del self.store["missing"]
+
+
+if __name__ == "__main__":
+    unittest.main()
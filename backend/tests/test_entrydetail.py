@@ -0,0 +1,247 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app as backend_app  # noqa: E402
+
+
+DATA = {
+    "entryAddress": [{"name": "ACME", "zipCode": None}, {"name": "Globex", "cityName": "Springfield"}],
+    "lines": [{"totalQty": 2.0, "quantity": [[1, None], [3]]}],
+    "pstlTrckngNum": None,
+}
+
+
+class TestPaths(unittest.TestCase):
+    def test_collects_non_null_leaves_in_document_order(self):
+        self.assertEqual(backend_app._collect_non_null_leaf_paths(DATA), [
+            "entryAddress[0].name",
+            "entryAddress[1].name",
+            "entryAddress[1].cityName",
+            "lines[0].totalQty",
+            "lines[0].quantity[0][0]",
+            "lines[0].quantity[1][0]",
+        ])
+
+    def test_get_by_path(self):
+        self.assertEqual(backend_app._get_by_path(DATA, "entryAddress[1].cityName"), "Springfield")
+        self.assertEqual(backend_app._get_by_path(DATA, "lines[0].quantity[1][0]"), 3)
+        self.assertIsNone(backend_app._get_by_path(DATA, "entryAddress[2].name"))
+        self.assertIsNone(backend_app._get_by_path(DATA, "entryAddress[x].name"))
+        self.assertIsNone(backend_app._get_by_path(DATA, "entryAddress[0"))
+        self.assertIsNone(backend_app._get_by_path(DATA, "lines.totalQty"))
+
+    def test_validate_evidence_reports_paths_without_evidence(self):
+        wrapper = {"data": DATA, "meta": {"field_evidence": [
+            {"path": "entryAddress[0].name", "evidence": ["ACME on label"]},
+            {"path": "lines[0].totalQty", "evidence": []},
+        ]}}
+        expected = sorted(set(backend_app._collect_non_null_leaf_paths(DATA)) - {"entryAddress[0].name"})
+        self.assertEqual(backend_app._validate_evidence(wrapper), expected)
+        paths = backend_app._collect_non_null_leaf_paths(DATA)
+        self.assertEqual(backend_app._validate_evidence(wrapper, paths), expected)
+
+
+class TestLocalValidation(unittest.TestCase):
+    def test_malformed_lines_are_reported_not_raised(self):
+        report = backend_app._local_validate_entrydetail({"lines": ["oops", {"quantity": [1, 2], "totalQty": 0.5}]})
+        self.assertEqual([w for w in report["warnings"] if w.startswith("line[")], [
+            "line[0].quantity should contain exactly 2 records",
+            "line[1].totalQty < 1.0 (min)",
+        ])
+        report = backend_app._local_validate_entrydetail({"lines": "oops"})
+        self.assertIn("lines[1]", report["missing_required"])
+        self.assertFalse([w for w in report["warnings"] if w.startswith("line[")])
+
+
+class TestPostprocessMeta(unittest.TestCase):
+    def test_unsupported_confidences_are_capped_before_averaging(self):
+        wrapper = {"meta": {
+            "field_confidence": [{"path": "a", "confidence": 0.9}, {"path": "b", "confidence": "0.9"}],
+            "field_evidence": [{"path": "a", "evidence": ["seen"]}, {"path": "b", "evidence": []}],
+        }}
+        backend_app._postprocess_meta(wrapper)
+        self.assertEqual([c["confidence"] for c in wrapper["meta"]["field_confidence"]], [0.9, 0.5])
+        self.assertAlmostEqual(wrapper["meta"]["overall_confidence"], 0.7)
+
+    def test_malformed_or_missing_confidences_fall_back(self):
+        for fc in ([], [{"path": "a", "confidence": "high"}], ["not a dict"]):
+            wrapper = {"meta": {"field_confidence": fc}}
+            backend_app._postprocess_meta(wrapper)
+            self.assertEqual(wrapper["meta"]["overall_confidence"], 0.5)
+        wrapper = {"meta": {"overall_confidence": 0.9, "field_confidence": [{"path": "a", "confidence": 0.2}]}}
+        backend_app._postprocess_meta(wrapper)
+        self.assertEqual(wrapper["meta"]["overall_confidence"], 0.9)
+
+
+class TestRunEntryDetailJob(unittest.TestCase):
+    def test_streamed_wrapper_is_reassembled_and_validated(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "label.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4 test")
+        wrapper = json.dumps({"schema_id": "EntryDetailExtraction", "data": {"operType": "A"}, "meta": {}})
+        lines = [json.dumps({"response": wrapper[i:i + 7], "done": False}).encode() for i in range(0, len(wrapper), 7)]
+        lines += [b"", json.dumps({"response": "", "done": True}).encode()]
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = lines
+        with mock.patch.object(backend_app, "render_pdf_to_images_b64", return_value=["aW1n"]), \
+                mock.patch.object(backend_app.SESSION, "post", return_value=response) as post:
+            result = backend_app._run_entrydetail_job(path, model="vlm")
+        self.assertTrue(post.call_args.kwargs["stream"])
+        self.assertTrue(json.loads(post.call_args.kwargs["data"])["stream"])
+        self.assertEqual(result["wrapper"]["data"], {"operType": "A"})
+        self.assertIn("entryTypeCode", result["local_validation"]["missing_required"])
+
+
+class TestJobArtifacts(unittest.TestCase):
+    def test_wrapper_is_indented_and_summary_is_compact(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        result = {"job_id": "j1", "elapsed_sec": 1.5, "wrapper": {"data": {"name": "Ä"}, "meta": {}}}
+        with mock.patch.object(backend_app, "_jobs_dir", return_value=backend_app.Path(tmpdir.name)):
+            backend_app._save_job_artifacts("j1", result)
+        out_dir = os.path.join(tmpdir.name, "j1")
+        with open(os.path.join(out_dir, "result.wrapper.json"), encoding="utf-8") as f:
+            wrapper_text = f.read()
+        with open(os.path.join(out_dir, "summary.json"), encoding="utf-8") as f:
+            summary_text = f.read()
+        self.assertEqual(json.loads(wrapper_text), result["wrapper"])
+        self.assertIn("\n  ", wrapper_text)
+        self.assertEqual(json.loads(summary_text), {"job_id": "j1", "elapsed_sec": 1.5})
+        self.assertNotIn("\n", summary_text)
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        with open(os.path.join(tmpdir.name, "label.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 test")
+        patcher = mock.patch.dict(backend_app.app.config, {"UPLOAD_FOLDER": tmpdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = mock.Mock()
+        patcher = mock.patch.object(backend_app, "_job_executor", self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = backend_app.app.test_client()
+
+    def _create(self):
+        resp = self.client.post("/api/jobs/create", json={"filename": "label.pdf"})
+        self.assertEqual(resp.status_code, 200)
+        job_id = resp.get_json()["job_id"]
+        self.addCleanup(backend_app.jobs_store.pop, job_id, None)
+        return resp.get_json()
+
+    def test_jobs_are_queued_on_the_pool_and_deduplicated(self):
+        first = self._create()
+        second = self._create()
+        self.assertEqual(second, {"job_id": first["job_id"], "status": "queued", "dedup": True})
+        self.executor.submit.assert_called_once()
+
+    def test_finished_job_does_not_block_a_new_one(self):
+        first = self._create()
+        backend_app.jobs_store[first["job_id"]]["status"] = "done"
+        second = self._create()
+        self.assertNotEqual(second["job_id"], first["job_id"])
+        self.assertNotIn("dedup", second)
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+    def test_job_canceled_while_queued_never_runs(self):
+        job_id = self._create()["job_id"]
+        self.client.post(f"/api/jobs/{job_id}/cancel")
+        with mock.patch.object(backend_app, "_run_entrydetail_job") as run:
+            self.executor.submit.call_args.args[0]()
+        run.assert_not_called()
+        self.assertEqual(backend_app.jobs_store[job_id]["status"], "canceled")
+
+    def test_cancel_drops_queued_future(self):
+        busy = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        self.addCleanup(busy.set)
+        executor.submit(busy.wait)
+        with mock.patch.object(backend_app, "_job_executor", executor):
+            job_id = self._create()["job_id"]
+        future = backend_app._job_futures[job_id]
+        self.client.post(f"/api/jobs/{job_id}/cancel")
+        self.assertTrue(future.cancelled())
+        self.assertNotIn(job_id, backend_app._job_futures)
+
+    def test_job_deleted_while_running_is_not_recreated(self):
+        job_id = self._create()["job_id"]
+
+        def run_and_delete(*args, **kwargs):
+            self.client.delete(f"/api/jobs/{job_id}")
+            return {"wrapper": {}, "summary": {}, "elapsed_sec": 1.0, "model": "m"}
+
+        with mock.patch.object(backend_app, "_run_entrydetail_job", side_effect=run_and_delete), \
+                mock.patch.object(backend_app, "_save_job_artifacts"):
+            self.executor.submit.call_args.args[0]()
+        self.assertNotIn(job_id, backend_app.jobs_store)
+
+    def test_delete_moves_artifacts_aside_and_removes_them_in_background(self):
+        job_id = self._create()["job_id"]
+        jobs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(jobs_dir.cleanup)
+        os.makedirs(os.path.join(jobs_dir.name, job_id))
+        with mock.patch.object(backend_app, "_jobs_dir", return_value=backend_app.Path(jobs_dir.name)), \
+                mock.patch.object(backend_app.threading, "Thread") as thread_cls:
+            resp = self.client.delete(f"/api/jobs/{job_id}")
+        self.assertEqual(resp.get_json(), {"deleted": True})
+        self.assertFalse(os.path.exists(os.path.join(jobs_dir.name, job_id)))
+        trash = thread_cls.call_args.kwargs["args"][0]
+        self.assertTrue(os.path.isdir(trash))
+        thread_cls.return_value.start.assert_called_once()
+
+    def test_finished_job_quality_is_served_from_memory(self):
+        job_id = self._create()["job_id"]
+        wrapper = {"meta": {"overall_confidence": 0.8, "validation": {"schema_ok": True}}}
+        with mock.patch.object(backend_app, "_run_entrydetail_job", return_value={"wrapper": wrapper, "elapsed_sec": 1.0}), \
+                mock.patch.object(backend_app, "_save_job_artifacts"):
+            self.executor.submit.call_args.args[0]()
+        with mock.patch("builtins.open", side_effect=AssertionError("disk read")):
+            job = self.client.get(f"/api/jobs/{job_id}").get_json()
+            listed = self.client.get("/api/jobs").get_json()["jobs"]
+        self.assertEqual((job["status"], job["schema_ok"], job["overall_confidence"]), ("done", True, 0.8))
+        listed_job = next(j for j in listed if j["job_id"] == job_id)
+        self.assertEqual((listed_job["schema_ok"], listed_job["overall_confidence"]), (True, 0.8))
+
+    def test_event_log_is_bounded_and_only_served_per_job(self):
+        job_id = self._create()["job_id"]
+        with mock.patch.object(backend_app, "JOB_MAX_EVENTS", 3):
+            backend_app.jobs_store[job_id].pop("events", None)
+            for i in range(5):
+                backend_app._update_job(job_id, f"step {i}")
+        job = self.client.get(f"/api/jobs/{job_id}").get_json()
+        self.assertEqual([e["message"] for e in job["events"]], ["step 2", "step 3", "step 4"])
+        listed = next(j for j in self.client.get("/api/jobs").get_json()["jobs"] if j["job_id"] == job_id)
+        self.assertNotIn("events", listed)
+
+    def test_job_snapshot_is_detached_from_worker_updates(self):
+        job_id = self._create()["job_id"]
+        snapshot = backend_app._job_snapshot(job_id)
+        backend_app._update_job(job_id, "job started", status="running", model="m")
+        self.assertEqual(snapshot["status"], "queued")
+        self.assertNotIn("model", snapshot)
+        self.assertEqual(snapshot["events"], [])
+        self.assertEqual(backend_app.jobs_store[job_id]["events"][-1]["message"], "job started")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import base64
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import fitz  # PyMuPDF
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app as backend_app  # noqa: E402
+
+
+def _make_pdf(path: str, pages: int) -> None:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {i} text")
+    doc.save(path)
+    doc.close()
+
+
+class TestReadPdfFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "doc.pdf")
+        # Keep every on-disk cache the render/OCR paths touch out of the source tree
+        for attr in ("RENDER_CACHE_DIR", "TEXT_CACHE_DIR", "OCR_CACHE_DIR"):
+            patcher = mock.patch.object(backend_app, attr, os.path.join(self.tmpdir.name, attr.lower()))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_small_pdf_is_read_serially(self):
+        _make_pdf(self.path, 3)
+        with mock.patch.object(backend_app, "_get_pdf_pool") as get_pool:
+            text = backend_app.read_pdf_file(self.path)
+        get_pool.assert_not_called()
+        self.assertEqual([line for line in text.splitlines() if line], ["Page 0 text", "Page 1 text", "Page 2 text"])
+
+    def test_parallel_extraction_preserves_page_order(self):
+        pages = backend_app.PDF_PARALLEL_MIN_PAGES + 2
+        _make_pdf(self.path, pages)
+        with mock.patch.object(backend_app, "PDF_EXTRACT_WORKERS", 3):
+            text = backend_app.read_pdf_file(self.path)
+        self.assertEqual(
+            [line for line in text.splitlines() if line],
+            [f"Page {i} text" for i in range(pages)],
+        )
+
+    def test_pool_workers_do_not_import_the_app(self):
+        # Importing app in a worker would rebuild the document store and start probes
+        _make_pdf(self.path, 2)
+        pool = backend_app._get_pdf_pool()
+        self.assertEqual(pool.submit(backend_app._extract_page_range, self.path, 0, 2).result(), ["Page 0 text\n", "Page 1 text\n"])
+        self.assertFalse(pool.submit(eval, "'app' in __import__('sys').modules").result())
+
+    def test_unreadable_pdf_returns_empty_text(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a pdf")
+        self.assertEqual(backend_app.read_pdf_file(self.path), "")
+
+    def test_extracted_text_is_cached_by_file_hash(self):
+        _make_pdf(self.path, 2)
+        cache_dir = os.path.join(self.tmpdir.name, "text_cache")
+        with mock.patch.object(backend_app, "TEXT_CACHE_DIR", cache_dir):
+            first = backend_app.read_pdf_file_cached(self.path, "abc123")
+            with mock.patch.object(backend_app, "read_pdf_file") as read:
+                second = backend_app.read_pdf_file_cached(self.path, "abc123")
+        read.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(os.listdir(cache_dir), ["abc123.txt"])
+
+    def test_parallel_render_matches_serial_render(self):
+        _make_pdf(self.path, backend_app.RENDER_PARALLEL_MIN_PAGES + 1)
+        with mock.patch.object(backend_app, "PDF_EXTRACT_WORKERS", 1), \
+                mock.patch.object(backend_app, "RENDER_CACHE_DIR", os.path.join(self.tmpdir.name, "serial")):
+            serial = backend_app.render_pdf_to_images_b64(self.path, scale=0.5)
+        with mock.patch.object(backend_app, "PDF_EXTRACT_WORKERS", 3):
+            parallel = backend_app.render_pdf_to_images_b64(self.path, scale=0.5)
+            limited = backend_app.render_pdf_to_images_b64(self.path, scale=0.5, max_pages=2)
+        self.assertEqual(len(serial), backend_app.RENDER_PARALLEL_MIN_PAGES + 1)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(limited, serial[:2])
+
+    def test_rendered_pages_are_cached_by_file_page_and_scale(self):
+        _make_pdf(self.path, 2)
+        first = backend_app.render_pdf_to_images_b64(self.path, scale=0.5)
+        with mock.patch.object(backend_app, "_render_pages", wraps=backend_app._render_pages) as render:
+            second = backend_app.render_pdf_to_images_b64(self.path, scale=0.5)
+            render.assert_not_called()
+            backend_app.render_pdf_to_images_b64(self.path, scale=0.75)
+            self.assertEqual(render.call_args.args[1], [0, 1])
+        self.assertEqual(second, first)
+
+    def test_render_image_format(self):
+        _make_pdf(self.path, 1)
+        jpeg = backend_app.render_pdf_to_images_b64(self.path, scale=0.5, image_format="jpeg")
+        png = backend_app.render_pdf_to_images_b64(self.path, scale=0.5, image_format="png")
+        self.assertTrue(base64.b64decode(jpeg[0]).startswith(b"\xff\xd8"))
+        self.assertTrue(base64.b64decode(png[0]).startswith(b"\x89PNG"))
+
+    def test_ocr_pages_are_cached_by_image_and_model(self):
+        cache_dir = os.path.join(self.tmpdir.name, "ocr_cache")
+        resp = mock.Mock()
+        resp.json.return_value = {"response": " page text \n"}
+        with mock.patch.object(backend_app, "OCR_CACHE_DIR", cache_dir), \
+                mock.patch.object(backend_app, "render_pdf_to_images_b64", return_value=["aW1n", "cGFnZQ=="]), \
+                mock.patch.object(backend_app.SESSION, "post", return_value=resp) as post:
+            first = backend_app.ocr_pdf_with_vlm(self.path, vision_model="vlm")
+            second = backend_app.ocr_pdf_with_vlm(self.path, vision_model="vlm")
+            backend_app.ocr_pdf_with_vlm(self.path, vision_model="other-vlm")
+        self.assertEqual(first, "page text\n\npage text")
+        self.assertEqual(second, first)
+        # The repeat run hits the cache; a new model does not
+        self.assertEqual(post.call_count, 4)
+
+    def test_concurrent_ocr_keeps_page_order(self):
+        import time
+
+        def fake_post(url, json, timeout):
+            img = json["images"][0]
+            if img == "p0":
+                time.sleep(0.05)
+            resp = mock.Mock()
+            resp.json.return_value = {"response": "" if img == "p2" else f"text {img}"}
+            return resp
+
+        pages = [f"p{i}" for i in range(5)]
+        with mock.patch.object(backend_app, "OCR_CACHE_DIR", os.path.join(self.tmpdir.name, "ocr_cache")), \
+                mock.patch.object(backend_app, "render_pdf_to_images_b64", return_value=pages), \
+                mock.patch.object(backend_app.SESSION, "post", side_effect=fake_post):
+            text = backend_app.ocr_pdf_with_vlm(self.path, vision_model="vlm")
+        self.assertEqual(text, "text p0\n\ntext p1\n\ntext p3\n\ntext p4")
+
+    def test_batched_ocr_splits_on_page_markers(self):
+        responses = [
+            {"response": "<<PAGE 1>>\nfirst\n<</PAGE>>\n<<PAGE 2>> second <</PAGE>>"},
+            {"response": "no markers here"},
+            {"response": "third"},
+            {"response": "fourth"},
+        ]
+
+        def fake_post(url, json, timeout):
+            resp = mock.Mock()
+            resp.json.return_value = responses.pop(0)
+            return resp
+
+        pages = ["p0", "p1", "p2", "p3"]
+        with mock.patch.object(backend_app, "OCR_CACHE_DIR", os.path.join(self.tmpdir.name, "ocr_cache")), \
+                mock.patch.object(backend_app, "OCR_PAGES_PER_REQUEST", 2), \
+                mock.patch.object(backend_app, "OCR_WORKERS", 1), \
+                mock.patch.object(backend_app, "render_pdf_to_images_b64", return_value=pages), \
+                mock.patch.object(backend_app.SESSION, "post", side_effect=fake_post) as post:
+            text = backend_app.ocr_pdf_with_vlm(self.path, vision_model="vlm")
+        # The second group's reply has no markers, so its pages are retried one at a time
+        self.assertEqual(text, "first\n\nsecond\n\nthird\n\nfourth")
+        self.assertEqual([c.kwargs["json"]["images"] for c in post.call_args_list], [["p0", "p1"], ["p2", "p3"], ["p2"], ["p3"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import sys
 import unittest
+from unittest import mock
 
 from flask import Flask, request
 
@@ -59,6 +60,57 @@ class TestProviderSelection(unittest.TestCase):
             provider = get_provider(request)
             self.assertEqual(provider.base_url, "http://localhost:11434/v1")
 
+    def test_providers_are_cached_per_configuration(self):
+        with self.app.test_request_context("/api/test"):
+            first = get_provider(request)
+            second = get_provider(request)
+            self.addCleanup(os.environ.pop, "OLLAMA_BASE_URL", None)
+            os.environ["OLLAMA_BASE_URL"] = "http://otherhost:1234"
+            third = get_provider(request)
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertEqual(third.base_url, "http://otherhost:1234/v1")
+        self.assertIs(first._session, third._session)
+
+
+class TestOllamaEmbedMany(unittest.TestCase):
+    def setUp(self):
+        from providers.ollama_provider import OllamaProvider
+        self.provider = OllamaProvider()
+
+    def test_single_request_ordered_by_index(self):
+        resp = mock.Mock(status_code=200, content=b'{"data": [{"index": 1, "embedding": [2.0]}, {"index": 0, "embedding": [1.0]}]}')
+        with mock.patch.object(self.provider._session, "post", return_value=resp) as post:
+            self.assertEqual(self.provider.embed_many(["a", "b"]), [[1.0], [2.0]])
+        post.assert_called_once()
+        self.assertEqual(post.call_args.kwargs["json"]["input"], ["a", "b"])
+
+    def test_falls_back_to_single_calls_on_client_error(self):
+        with mock.patch.object(self.provider._session, "post", return_value=mock.Mock(status_code=400)), \
+                mock.patch.object(self.provider, "embed", side_effect=lambda text, **kw: [float(len(text))]):
+            self.assertEqual(self.provider.embed_many(["a", "bb"]), [[1.0], [2.0]])
+
+
+class TestOllamaChatStream(unittest.TestCase):
+    def test_yields_content_deltas_until_done(self):
+        from providers.ollama_provider import OllamaProvider
+        provider = OllamaProvider()
+        resp = mock.MagicMock()
+        resp.__enter__.return_value = resp
+        resp.iter_lines.return_value = [
+            'data: {"choices":[{"delta":{"content":"Hé"}}]}'.encode("utf-8"),
+            b"",
+            b'data: {"choices":[{"delta":{}}]}',
+            b"not json",
+            b'data: {"choices":[]}',
+            b'data: ["unexpected"]',
+            b'{"choices":[{"delta":{"content":"!"}}]}',
+            b"data: [DONE]",
+            b'data: {"choices":[{"delta":{"content":"late"}}]}',
+        ]
+        with mock.patch.object(provider._session, "post", return_value=resp):
+            self.assertEqual(list(provider.chat_stream([{"role": "user", "content": "hi"}])), ["Hé", "!"])
+
 
 if __name__ == "__main__":
     unittest.main()
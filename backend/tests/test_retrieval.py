@@ -0,0 +1,331 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app as backend_app  # noqa: E402
+
+
+def _use_temp_cache_dirs(test):
+    """Point the on-disk embedding caches at a per-test temporary directory."""
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+    for attr, sub in (("EMBEDDING_CACHE_DIR", "documents"), ("EMBEDDING_TEXT_CACHE_DIR", "texts")):
+        path = os.path.join(tmpdir.name, sub)
+        os.makedirs(path)
+        patcher = mock.patch.object(backend_app, attr, path)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return tmpdir.name
+
+
+class TestFindRelevantChunks(unittest.TestCase):
+    def setUp(self):
+        _use_temp_cache_dirs(self)
+        self.vectors = {
+            "alpha": [1.0, 0.0, 0.0],
+            "beta": [0.0, 2.0, 0.0],
+            "gamma": [0.0, 0.0, 3.0],
+            "alpha-ish": [0.9, 0.1, 0.0],
+        }
+        with mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [self.vectors[t] for t in ts]), \
+                mock.patch.object(backend_app, "chunk_text", return_value=list(self.vectors)):
+            processed = backend_app.process_document_chunks("ignored")
+        backend_app.document_store["doc.txt"] = {
+            "text": "ignored",
+            "texts": processed["texts"],
+            "embedding_matrix": processed["embedding_matrix"],
+        }
+        backend_app._query_embedding_cache.clear()
+
+    def tearDown(self):
+        backend_app.document_store.pop("doc.txt", None)
+        backend_app._query_embedding_cache.clear()
+
+    def test_embedding_matrix_rows_are_unit_norm(self):
+        matrix = backend_app.document_store["doc.txt"]["embedding_matrix"]
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, rtol=1e-6)
+        self.assertFalse(matrix.flags.writeable)
+
+    def test_texts_parallel_to_matrix_rows(self):
+        doc = backend_app.document_store["doc.txt"]
+        self.assertEqual(doc["texts"], list(self.vectors))
+        self.assertEqual(doc["embedding_matrix"].shape, (4, 3))
+
+    def test_top_k_ordered_by_cosine_similarity(self):
+        with mock.patch.object(backend_app, "get_embedding", return_value=[5.0, 0.0, 0.0]):
+            chunks = backend_app.find_relevant_chunks("q", "doc.txt", top_k=2)
+        self.assertEqual(chunks, ["alpha", "alpha-ish"])
+
+    def test_top_k_not_smaller_than_chunk_count_skips_query_embedding(self):
+        with mock.patch.object(backend_app, "get_embedding") as embed:
+            chunks = backend_app.find_relevant_chunks("q", "doc.txt", top_k=10)
+            self.assertEqual(backend_app.find_relevant_chunks("q", "doc.txt", top_k=4), chunks)
+        embed.assert_not_called()
+        self.assertEqual(chunks, list(self.vectors))
+
+    def test_repeated_query_embedding_is_cached(self):
+        with mock.patch.object(backend_app, "get_embedding", return_value=[0.0, 0.0, 1.0]) as embed:
+            first = backend_app.find_relevant_chunks("same question", "doc.txt", top_k=1)
+            second = backend_app.find_relevant_chunks("same question", "doc.txt", top_k=1)
+        self.assertEqual(first, ["gamma"])
+        self.assertEqual(second, first)
+        embed.assert_called_once_with("same question")
+
+    def test_ann_index_is_used_when_present(self):
+        index = mock.Mock()
+        index.knn_query.return_value = (np.array([[2, 0]]), np.array([[0.0, 0.5]]))
+        backend_app.document_store["doc.txt"]["ann_index"] = index
+        with mock.patch.object(backend_app, "get_embedding", return_value=[0.0, 0.0, 1.0]):
+            result = backend_app.find_relevant_chunks("q", "doc.txt", top_k=2)
+        self.assertEqual(result, ["gamma", "alpha"])
+        index.knn_query.assert_called_once()
+
+    def test_int8_quantized_store_keeps_ranking(self):
+        entry = backend_app.document_store["doc.txt"]
+        with mock.patch.object(backend_app, "EMBEDDING_QUANTIZATION", "int8"):
+            matrix, scales = backend_app._quantize_embeddings(entry["embedding_matrix"])
+        self.assertEqual(matrix.dtype, np.int8)
+        entry["embedding_matrix"], entry["embedding_scales"] = matrix, scales
+        with mock.patch.object(backend_app, "get_embedding", return_value=[1.0, 0.05, 0.0]):
+            result = backend_app.find_relevant_chunks("q", "doc.txt", top_k=2)
+        self.assertEqual(result, ["alpha", "alpha-ish"])
+
+    def test_float16_store_keeps_ranking(self):
+        entry = backend_app.document_store["doc.txt"]
+        with mock.patch.object(backend_app, "EMBEDDING_QUANTIZATION", "float16"):
+            entry["embedding_matrix"], entry["embedding_scales"] = backend_app._quantize_embeddings(entry["embedding_matrix"])
+        self.assertEqual(entry["embedding_matrix"].dtype, np.float16)
+        self.assertIsNone(entry["embedding_scales"])
+        with mock.patch.object(backend_app, "get_embedding", return_value=[0.0, 1.0, 0.3]):
+            result = backend_app.find_relevant_chunks("q", "doc.txt", top_k=2)
+        self.assertEqual(result, ["beta", "gamma"])
+
+    def test_small_documents_skip_ann_index(self):
+        self.assertIsNone(backend_app._build_ann_index(np.eye(3, dtype=np.float32)))
+
+    def test_device_copy_is_rebuilt_after_reload(self):
+        # A reloaded document has no gpu_matrix key: the copy is rebuilt once from the stored rows
+        with mock.patch.object(backend_app, "torch", mock.Mock()), \
+                mock.patch.object(backend_app, "GPU_MIN_CHUNKS", 1), \
+                mock.patch.object(backend_app, "_to_retrieval_device", return_value=None) as to_device, \
+                mock.patch.object(backend_app, "get_embedding", return_value=self.vectors["alpha"]):
+            first = backend_app.find_relevant_chunks("alpha", "doc.txt", top_k=2)
+            second = backend_app.find_relevant_chunks("alpha", "doc.txt", top_k=2)
+        to_device.assert_called_once()
+        np.testing.assert_allclose(to_device.call_args.args[0], backend_app.document_store["doc.txt"]["embedding_matrix"])
+        self.assertEqual(first, ["alpha", "alpha-ish"])
+        self.assertEqual(second, first)
+
+    def test_unknown_document_returns_empty(self):
+        self.assertEqual(backend_app.find_relevant_chunks("q", "missing.txt"), [])
+
+
+class TestCorpusIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = backend_app.CorpusIndex(block_rows=2)
+        self.index.add("a.txt", np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+        self.index.add("b.txt", np.array([[0.8, 0.6], [0.6, 0.8], [-1.0, 0.0]], dtype=np.float32))
+
+    def test_search_ranks_across_documents(self):
+        hits = self.index.search(np.array([1.0, 0.0], dtype=np.float32), 3)
+        self.assertEqual([(name, idx) for name, idx, _ in hits], [("a.txt", 0), ("b.txt", 0), ("b.txt", 1)])
+
+    def test_search_can_be_restricted_to_documents(self):
+        hits = self.index.search(np.array([1.0, 0.0], dtype=np.float32), 5, ["b.txt", "missing.txt"])
+        self.assertEqual([(name, idx) for name, idx, _ in hits], [("b.txt", 0), ("b.txt", 1), ("b.txt", 2)])
+
+    def test_reindexing_and_removal_compact_rows(self):
+        self.index.add("a.txt", np.array([[0.0, -1.0]], dtype=np.float32))
+        self.index.remove("b.txt")
+        self.assertEqual(len(self.index), 1)
+        hits = self.index.search(np.array([0.0, -1.0], dtype=np.float32), 5)
+        self.assertEqual([(name, idx) for name, idx, _ in hits], [("a.txt", 0)])
+
+    def test_int8_rows_are_rescaled(self):
+        index = backend_app.CorpusIndex()
+        with mock.patch.object(backend_app, "EMBEDDING_QUANTIZATION", "int8"):
+            matrix, scales = backend_app._quantize_embeddings(np.array([[0.6, 0.8], [1.0, 0.0]], dtype=np.float32))
+        index.add("q.txt", matrix, scales)
+        hits = index.search(np.array([0.6, 0.8], dtype=np.float32), 1)
+        self.assertEqual(hits[0][:2], ("q.txt", 0))
+        self.assertAlmostEqual(hits[0][2], 1.0, places=2)
+
+
+class TestBoundedCorpus(unittest.TestCase):
+    def setUp(self):
+        tmpdir = _use_temp_cache_dirs(self)
+        store = backend_app.document_store
+        for attr, value in (("max_resident", 2), ("offload_root", os.path.join(tmpdir, "offload"))):
+            patcher = mock.patch.object(store, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.names = ["a.txt", "b.txt", "c.txt"]
+        for name in self.names:
+            self.addCleanup(backend_app.corpus_index.remove, name)
+            self.addCleanup(store.pop, name, None)
+        patcher = mock.patch.object(backend_app, "get_query_embedding", return_value=np.array([1.0, 0.0], dtype=np.float32))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _upload(self, name, rows):
+        chunk_data = {"texts": [f"{name} chunk {i}" for i in range(len(rows))],
+                      "embedding_matrix": np.array(rows, dtype=np.float32), "ann_index": None,
+                      "chunk_count": len(rows), "successful_embeddings": len(rows)}
+        backend_app._store_document(name, "text", "/tmp/" + name, chunk_data, "u", "ready")
+
+    def test_offloaded_documents_leave_the_corpus_index_but_stay_searchable(self):
+        self._upload("a.txt", [[1.0, 0.0], [0.0, 1.0]])
+        self._upload("b.txt", [[0.0, 1.0]])
+        self._upload("c.txt", [[0.0, 1.0]])
+        self.assertTrue(backend_app.document_store.is_offloaded("a.txt"))
+        self.assertEqual(len(backend_app.corpus_index), 2)  # only b.txt and c.txt rows
+        self.assertEqual(backend_app.search_corpus("q", self.names, top_k=1), [("a.txt", "a.txt chunk 0")])
+        self.assertTrue(backend_app.document_store.is_offloaded("a.txt"))  # searching does not reload
+        backend_app.document_store["a.txt"]  # reload evicts b.txt and re-indexes a.txt
+        self.assertEqual(len(backend_app.corpus_index), 3)
+        self.assertEqual(backend_app.search_corpus("q", None, top_k=1), [("a.txt", "a.txt chunk 0")])
+
+
+class TestEmbeddingsBatch(unittest.TestCase):
+    def _response(self, payload):
+        resp = mock.Mock()
+        resp.content = json.dumps(payload).encode("utf-8")
+        resp.raise_for_status.return_value = None
+        return resp
+
+    def test_splits_inputs_into_batches(self):
+        calls = []
+
+        def fake_post(url, json, timeout):
+            calls.append(list(json["input"]))
+            return self._response({"embeddings": [[float(len(t))] for t in json["input"]]})
+
+        with mock.patch.object(backend_app.SESSION, "post", side_effect=fake_post):
+            out = backend_app.get_embeddings_batch(["a", "bb", "ccc"], batch_size=2)
+        # Batches may be in flight concurrently, so only the set of requests is fixed
+        self.assertCountEqual(calls, [["a", "bb"], ["ccc"]])
+        self.assertEqual(out, [[1.0], [2.0], [3.0]])
+
+    def test_concurrent_batches_keep_input_order(self):
+        import time
+
+        def slow_first(url, json, timeout):
+            if json["input"][0] == "t0":
+                time.sleep(0.05)
+            return self._response({"embeddings": [[float(t[1:])] for t in json["input"]]})
+
+        texts = [f"t{i}" for i in range(7)]
+        with mock.patch.object(backend_app.SESSION, "post", side_effect=slow_first), \
+                mock.patch.object(backend_app, "EMBEDDING_CONCURRENCY", 4):
+            out = backend_app.get_embeddings_batch(texts, batch_size=2)
+        self.assertEqual(out, [[float(i)] for i in range(7)])
+
+    def test_posts_to_native_embed_endpoint(self):
+        payload = {"model": "bge-m3", "embeddings": [[1.0], [2.0]]}
+        with mock.patch.object(backend_app.SESSION, "post", return_value=self._response(payload)) as post:
+            out = backend_app.get_embeddings_batch(["a", "bb"])
+        self.assertEqual(out, [[1.0], [2.0]])
+        self.assertTrue(post.call_args.args[0].endswith("/api/embed"))
+        self.assertEqual(post.call_args.kwargs["json"]["input"], ["a", "bb"])
+
+    def test_orders_results_by_index_field(self):
+        payload = {"data": [{"index": 1, "embedding": [2.0]}, {"index": 0, "embedding": [1.0]}]}
+        with mock.patch.object(backend_app.SESSION, "post", return_value=self._response(payload)):
+            out = backend_app.get_embeddings_batch(["a", "bb"])
+        self.assertEqual(out, [[1.0], [2.0]])
+
+    def test_falls_back_to_single_requests(self):
+        with mock.patch.object(backend_app.SESSION, "post", return_value=self._response({"embedding": [0.0]})), \
+                mock.patch.object(backend_app, "get_embedding", side_effect=lambda t: [float(len(t))]):
+            out = backend_app.get_embeddings_batch(["a", "bb"])
+        self.assertEqual(out, [[1.0], [2.0]])
+
+
+class TestEmbeddingPersistence(unittest.TestCase):
+    def setUp(self):
+        self.cache_root = _use_temp_cache_dirs(self)
+
+    def test_reupload_loads_persisted_embeddings(self):
+        vectors = {"one": [1.0, 0.0], "two": [0.0, 1.0]}
+        with mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [vectors[t] for t in ts]) as embed, \
+                mock.patch.object(backend_app, "chunk_text", return_value=list(vectors)):
+            first = backend_app.load_or_process_document_chunks("doc body")
+            second = backend_app.load_or_process_document_chunks("doc body")
+        embed.assert_called_once()
+        self.assertEqual(second["texts"], first["texts"])
+        self.assertEqual(second["chunk_count"], 2)
+        np.testing.assert_array_equal(second["embedding_matrix"], first["embedding_matrix"])
+
+    def test_quantized_embeddings_are_persisted_compressed(self):
+        vectors = {"one": [0.6, 0.8], "two": [1.0, 0.0]}
+        for mode, dtype in (("float16", np.float16), ("int8", np.int8)):
+            with mock.patch.object(backend_app, "EMBEDDING_QUANTIZATION", mode), \
+                    mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [vectors[t] for t in ts]), \
+                    mock.patch.object(backend_app, "chunk_text", return_value=list(vectors)):
+                first = backend_app.load_or_process_document_chunks("doc body")
+                cache_path = backend_app._embedding_cache_path("doc body")
+                second = backend_app.load_or_process_document_chunks("doc body")
+            with np.load(cache_path) as cached:
+                self.assertEqual(cached["embeddings"].dtype, dtype)
+            self.assertEqual(second["embedding_matrix"].dtype, np.float32)
+            np.testing.assert_allclose(second["embedding_matrix"], first["embedding_matrix"], atol=1e-2)
+
+    @unittest.skipIf(backend_app.hnswlib is None, "hnswlib not installed")
+    def test_ann_index_is_persisted_and_reloaded(self):
+        vectors = {f"chunk {i}": [np.cos(i), np.sin(i), 1.0] for i in range(8)}
+        with mock.patch.object(backend_app, "HNSW_MIN_CHUNKS", 4), \
+                mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [vectors[t] for t in ts]), \
+                mock.patch.object(backend_app, "chunk_text", return_value=list(vectors)):
+            backend_app.load_or_process_document_chunks("doc body")
+            ann_path = backend_app._ann_index_path(backend_app._embedding_cache_path("doc body"))
+            self.assertTrue(os.path.exists(ann_path))
+            with mock.patch.object(backend_app, "_build_ann_index") as build:
+                second = backend_app.load_or_process_document_chunks("doc body")
+        build.assert_not_called()
+        self.assertEqual(second["ann_index"].get_current_count(), len(vectors))
+
+    def test_partial_results_are_not_persisted(self):
+        vectors = {"one": [1.0, 0.0], "two": None}
+        with mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [vectors[t] for t in ts]) as embed, \
+                mock.patch.object(backend_app, "chunk_text", return_value=["one", "two"]):
+            backend_app.load_or_process_document_chunks("doc body")
+            backend_app.load_or_process_document_chunks("doc body")
+        self.assertEqual(embed.call_count, 2)
+        self.assertEqual(os.listdir(os.path.join(self.cache_root, "documents")), [])
+
+
+class TestTextEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        _use_temp_cache_dirs(self)
+
+    def test_only_uncached_texts_are_embedded(self):
+        fake = lambda ts: [[float(len(t)), 1.0] for t in ts]
+        with mock.patch.object(backend_app, "get_embeddings_batch", side_effect=fake) as embed:
+            first = backend_app.get_embeddings_cached(["a", "bb"])
+            second = backend_app.get_embeddings_cached(["bb", "ccc", "a"])
+        self.assertEqual(embed.call_args_list[1].args[0], ["ccc"])
+        self.assertEqual([list(e) for e in first], [[1.0, 1.0], [2.0, 1.0]])
+        self.assertEqual([list(e) for e in second], [[2.0, 1.0], [3.0, 1.0], [1.0, 1.0]])
+
+    def test_failed_embeddings_are_not_cached(self):
+        with mock.patch.object(backend_app, "get_embeddings_batch", return_value=[[]]) as embed:
+            backend_app.get_embeddings_cached(["a"])
+            backend_app.get_embeddings_cached(["a"])
+        self.assertEqual(embed.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from werkzeug.datastructures import FileStorage
+
+
+# Ensure we can import the Flask app module from the backend directory
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import app as backend_app  # noqa: E402
+
+
+class TestSaveUpload(unittest.TestCase):
+    def test_streams_file_to_disk_and_returns_sha256(self):
+        payload = os.urandom(3 * backend_app.FILE_COPY_CHUNK + 17)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "doc.pdf")
+            sha = backend_app._save_upload(FileStorage(stream=io.BytesIO(payload), filename="doc.pdf"), path)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), payload)
+            self.assertEqual(sha, hashlib.sha256(payload).hexdigest())
+            self.assertEqual(sha, backend_app._sha256_file(path))
+
+    def test_sha256_file_without_file_digest(self):
+        payload = os.urandom(backend_app.HASH_BLOCK_SIZE + 17)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "doc.pdf")
+            with open(path, "wb") as f:
+                f.write(payload)
+            with mock.patch.object(backend_app, "hashlib", mock.Mock(wraps=hashlib, spec=["sha256"])):
+                self.assertEqual(backend_app._sha256_file(path), hashlib.sha256(payload).hexdigest())
+
+    def test_sha256_file_is_reused_until_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "doc.pdf")
+            with open(path, "wb") as f:
+                f.write(b"first")
+            first = backend_app._sha256_file(path)
+            with mock.patch("builtins.open", side_effect=AssertionError("rehashed")):
+                self.assertEqual(backend_app._sha256_file(path), first)
+            with open(path, "wb") as f:
+                f.write(b"second version")
+            self.assertEqual(backend_app._sha256_file(path), hashlib.sha256(b"second version").hexdigest())
+
+    def test_disk_backed_upload_uses_sendfile(self):
+        payload = os.urandom(2 * 1024 * 1024 + 5)
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryFile("w+b") as stream:
+            stream.write(payload)
+            stream.seek(0)
+            path = os.path.join(tmpdir, "big.pdf")
+            with mock.patch.object(backend_app.os, "sendfile", wraps=os.sendfile) as sendfile:
+                sha = backend_app._save_upload(FileStorage(stream=stream, filename="big.pdf"), path)
+            self.assertTrue(sendfile.called)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), payload)
+            self.assertEqual(sha, hashlib.sha256(payload).hexdigest())
+
+    def test_in_memory_spooled_upload_is_not_rolled_to_disk(self):
+        stream = tempfile.SpooledTemporaryFile(max_size=1024 * 500, mode="w+b")
+        stream.write(b"small file")
+        stream.seek(0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "small.txt")
+            backend_app._save_upload(FileStorage(stream=stream, filename="small.txt"), path)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"small file")
+        self.assertFalse(stream._rolled)
+
+
+class TestReadTextFile(unittest.TestCase):
+    def test_mapped_read_matches_text_mode(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "notes.txt")
+            for payload in (b"", "caf\u00e9\r\nline two\rthree\n".encode("utf-8"), b"\xff invalid"):
+                with open(path, "wb") as f:
+                    f.write(payload)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        expected = f.read()
+                except UnicodeDecodeError:
+                    expected = ""
+                self.assertEqual(backend_app.read_text_file(path), expected)
+
+
+class TestUploadEndpoint(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        for attr, value in (("EMBEDDING_CACHE_DIR", tmpdir.name), ("EMBEDDING_TEXT_CACHE_DIR", tmpdir.name)):
+            patcher = mock.patch.object(backend_app, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(backend_app.app.config, {"UPLOAD_FOLDER": tmpdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Keep the auto-queued extraction job from calling the model
+        patcher = mock.patch.object(backend_app, "_run_entrydetail_job", side_effect=RuntimeError("disabled in tests"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Background embedding is queued here and run explicitly by the tests
+        self.embed_executor = mock.Mock()
+        patcher = mock.patch.object(backend_app, "_upload_embed_executor", self.embed_executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(backend_app.document_store.pop, "notes.txt", None)
+        self.addCleanup(backend_app.corpus_index.remove, "notes.txt")
+
+    def _upload(self, body):
+        return backend_app.app.test_client().post(
+            "/api/upload", data={"file": (io.BytesIO(body.encode("utf-8")), "notes.txt")},
+            content_type="multipart/form-data",
+        )
+
+    def test_text_upload_is_chunked_embedded_and_stored(self):
+        body = "First sentence here. " * 120
+        client = backend_app.app.test_client()
+        with mock.patch.object(backend_app, "embedding_available", return_value=True), \
+                mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [[1.0, float(i)] for i, _ in enumerate(ts)]):
+            resp = self._upload(body)
+            self.assertEqual(resp.status_code, 202, resp.get_data(as_text=True))
+            self.assertEqual(resp.get_json()["embedding_status"], "embedding")
+            self.assertEqual(backend_app.document_store["notes.txt"]["text"], body[:backend_app.DOCUMENT_CONTEXT_CHARS])
+            self.assertEqual(client.get("/api/documents/notes.txt/status").get_json()["embedding_status"], "embedding")
+            fn, *args = self.embed_executor.submit.call_args.args
+            fn(*args)
+            # Text embedded once is served from the cache inline on the next upload
+            resp = self._upload(body)
+        self.assertEqual(resp.status_code, 200, resp.get_data(as_text=True))
+        payload = resp.get_json()
+        self.assertGreater(payload["chunk_count"], 1)
+        self.assertEqual(payload["successful_embeddings"], payload["chunk_count"])
+        self.assertEqual(payload["embedding_status"], "ready")
+        self.assertNotIn("warning", payload)
+        self.embed_executor.submit.assert_called_once()
+        stored = backend_app.document_store["notes.txt"]
+        self.assertEqual(stored["embedding_matrix"].shape, (payload["chunk_count"], 2))
+        hits = backend_app.corpus_index.search(np.array([1.0, 0.0], dtype=np.float32), 1, ["notes.txt"])
+        self.assertEqual([name for name, _, _ in hits], ["notes.txt"])
+        self.assertEqual(client.get("/api/documents/notes.txt/status").get_json(),
+                         {"filename": "notes.txt", "embedding_status": "ready", "chunk_count": payload["chunk_count"]})
+
+    def test_background_embeddings_of_a_replaced_upload_are_dropped(self):
+        with mock.patch.object(backend_app, "embedding_available", return_value=True), \
+                mock.patch.object(backend_app, "get_embeddings_batch", side_effect=lambda ts: [[1.0, 0.0] for _ in ts]):
+            self._upload("Old version of the notes. " * 50)
+            stale = self.embed_executor.submit.call_args.args
+            self._upload("New version of the notes. " * 50)
+            stale[0](*stale[1:])
+        stored = backend_app.document_store["notes.txt"]
+        self.assertTrue(stored["text"].startswith("New version"))
+        self.assertEqual(stored["embedding_status"], "embedding")
+        self.assertIsNone(stored["embedding_matrix"])
+
+    def test_document_listing_revalidates_with_etag(self):
+        client = backend_app.app.test_client()
+        first = client.get("/api/documents")
+        etag = first.headers["ETag"]
+        self.assertEqual(client.get("/api/documents", headers={"If-None-Match": etag}).status_code, 304)
+        backend_app.document_store["notes.txt"] = {"text": "Hello there"}
+        changed = client.get("/api/documents", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn({"name": "notes.txt", "excerpt": "Hello there"}, changed.get_json())
+
+
+class TestEmbeddingAvailability(unittest.TestCase):
+    def setUp(self):
+        backend_app._embedding_status.update(available=False, checked_at=None)
+        self.addCleanup(backend_app._embedding_status.update, available=False, checked_at=None)
+
+    def test_probe_result_is_cached_until_ttl_expires(self):
+        with mock.patch.object(backend_app, "is_embedding_available", side_effect=[False, True]) as probe:
+            self.assertFalse(backend_app.embedding_available())
+            self.assertFalse(backend_app.embedding_available())
+            self.assertEqual(probe.call_count, 1)
+            with mock.patch.object(backend_app, "EMBEDDING_CHECK_TTL", 0.0):
+                self.assertTrue(backend_app.embedding_available())
+        self.assertEqual(probe.call_count, 2)
+
+
+class TestClearUploadFolder(unittest.TestCase):
+    def test_old_files_are_removed_and_folder_is_recreated(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        folder = os.path.join(tmpdir.name, "uploads")
+        os.makedirs(os.path.join(folder, "nested"))
+        for name in ("a.pdf", "b.txt", os.path.join("nested", "c.txt")):
+            with open(os.path.join(folder, name), "w") as f:
+                f.write("x")
+
+        started = []
+        with mock.patch.object(backend_app.threading, "Thread") as thread_cls:
+            thread_cls.return_value.start.side_effect = lambda: started.append(True)
+            backend_app._clear_upload_folder(folder)
+            # Folder is already empty before the background delete runs
+            self.assertEqual(os.listdir(folder), [])
+            self.assertEqual(started, [True])
+            kwargs = thread_cls.call_args.kwargs
+            kwargs["target"](*kwargs["args"])
+
+        self.assertEqual(os.listdir(tmpdir.name), ["uploads"])
+
+
+class TestRequestLogging(unittest.TestCase):
+    def test_request_details_are_not_formatted_above_debug(self):
+        client = backend_app.app.test_client()
+        with mock.patch.object(backend_app.logger, "isEnabledFor", return_value=False), \
+                mock.patch.object(backend_app.logger, "debug") as debug:
+            client.get("/api/documents")
+        debug.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -93,7 +93,9 @@ function App() {
       }]);
 
       // Add detailed success message
-      const processingInfo = response.data.chunk_count > 0 
+      const processingInfo = response.data.embedding_status === 'embedding'
+        ? 'Embeddings are being generated in the background.'
+        : response.data.chunk_count > 0 
         ? `Document processed into ${response.data.chunk_count} chunks with ${response.data.successful_embeddings} embeddings in ${response.data.processing_time.toFixed(2)} seconds.` 
         : '';
         
@@ -1,38 +1,41 @@
 import json
-import math
+import numpy as np
 import requests
 
 EMBEDDING_FILE = "embeddings.json"
 LLM_ENDPOINT = "http://localhost:1234/v1/chat/completions"
 LLM_MODEL = "deepseek-r1-distill-qwen-32b-mlx"
 
+def normalize(vec):
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
 def load_embeddings(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        embeddings_data = json.load(f)
+    # float32 arrays take ~4 bytes per dimension instead of a boxed Python float each;
+    # unit length up front makes cosine similarity a plain dot product
+    for data in embeddings_data.values():
+        if data.get("embedding"):
+            data["embedding"] = normalize(np.asarray(data["embedding"], dtype=np.float32))
+    return embeddings_data
 
 def get_embedding(text):
     # Dummy embedding for testing; in production, replace with an API call if needed.
-    embedding = [0.123, 0.456, 0.789, 0.012, 0.345]
-    return embedding
-
-def cosine_similarity(vec_a, vec_b):
-    dot = sum(a * b for a, b in zip(vec_a, vec_b))
-    norm_a = math.sqrt(sum(a * a for a in vec_a))
-    norm_b = math.sqrt(sum(b * b for b in vec_b))
-    if norm_a == 0 or norm_b == 0:
-        return 0
-    return dot / (norm_a * norm_b)
+    embedding = np.array([0.123, 0.456, 0.789, 0.012, 0.345], dtype=np.float32)
+    return normalize(embedding)
 
 def search_documents(query_embedding, embeddings_data, top_k=3):
-    similarities = []
-    for doc_path, data in embeddings_data.items():
-        doc_embedding = data.get("embedding")
-        if doc_embedding:
-            sim = cosine_similarity(query_embedding, doc_embedding)
-            similarities.append((doc_path, sim, data["text"]))
-    # sort by similarity in descending order
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
+    docs = [(doc_path, data) for doc_path, data in embeddings_data.items()
+            if data.get("embedding") is not None and len(data["embedding"])]
+    if not docs or top_k <= 0:
+        return []
+    # One matrix-vector product scores every document (rows and query are unit length)
+    matrix = np.stack([data["embedding"] for _, data in docs])
+    sims = matrix @ normalize(np.asarray(query_embedding, dtype=np.float32))
+    top = np.argpartition(-sims, top_k - 1)[:top_k] if top_k < len(docs) else np.arange(len(docs))
+    top = top[np.argsort(-sims[top])]
+    return [(docs[i][0], float(sims[i]), docs[i][1]["text"]) for i in top]
 
 def call_llm(query, context, stream=True):
     # Format a prompt that combines the context and query
@@ -51,27 +54,28 @@ def call_llm(query, context, stream=True):
     response = requests.post(LLM_ENDPOINT, headers=headers, json=payload, stream=stream)
     
     if stream:
-        final_answer = ""
+        parts = []
         try:
-            for line in response.iter_lines(decode_unicode=True):
+            # Lines stay bytes; json.loads accepts them, so there is no per-line decode
+            for line in response.iter_lines():
                 if line:
                     # Remove any prefix if needed (e.g., "data:")
-                    if line.startswith("data:"):
+                    if line[:5] == b"data:":
                         line = line[5:].strip()
                     # End of stream marker (could be "[DONE]" or similar depending on your API)
-                    if line == "[DONE]":
+                    if line == b"[DONE]":
                         break
                     data = json.loads(line)
                     # Access delta content if available
                     delta = data.get("choices", [{}])[0].get("delta", {})
-                    chunk = delta.get("content", "")
+                    chunk = delta.get("content") or ""
                     print(chunk, end="", flush=True)
-                    final_answer += chunk
+                    parts.append(chunk)
         except Exception as e:
             print("\nError reading stream:", e)
         print()  # Ensure newline after streaming
         # Return a dummy structure that mimics non-streamed response for further processing.
-        return {"choices": [{"message": {"content": final_answer}}]}
+        return {"choices": [{"message": {"content": "".join(parts)}}]}
     else:
         if response.status_code == 200:
             return response.json()
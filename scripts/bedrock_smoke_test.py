@@ -2,11 +2,27 @@ import json
 import os
 import sys
 from datetime import datetime
+from functools import lru_cache
 
 import boto3
 from botocore.config import Config
 
 
+# Fail fast on a wrong region or endpoint instead of waiting out boto's 60s defaults
+CFG = Config(
+    retries={'max_attempts': 2, 'mode': 'standard'},
+    connect_timeout=3,
+    read_timeout=30,
+    max_pool_connections=20,
+)
+
+
+@lru_cache(maxsize=None)
+def client(service, region):
+    # One client (and connection pool) per service/region for the whole run
+    return boto3.client(service, region_name=region, config=CFG)
+
+
 def pick_chat_model(models, preferred=None):
     # Prefer an override if available and in the list
     if preferred:
@@ -33,30 +49,16 @@ def pick_chat_model(models, preferred=None):
 
 
 def list_foundation_models(region):
-    bedrock = boto3.client('bedrock', region_name=region)
+    bedrock = client('bedrock', region)
     resp = bedrock.list_foundation_models()
     return resp.get('modelSummaries', [])
 
 
-def test_converse(region, model_id):
-    rt = boto3.client('bedrock-runtime', region_name=region, config=Config(retries={'max_attempts': 3}))
-    messages = [
-        {"role": "user", "content": [{"text": "In one sentence, say hello from Bedrock."}]}
-    ]
-    out = rt.converse(
-        modelId=model_id,
-        messages=messages,
-        inferenceConfig={"maxTokens": 128, "temperature": 0.2},
-    )
-    parts = out.get('output', {}).get('message', {}).get('content', [])
-    text = ''.join(p.get('text', '') for p in parts)
-    return text.strip()
-
-
 def test_converse_stream(region, model_id):
-    rt = boto3.client('bedrock-runtime', region_name=region, config=Config(retries={'max_attempts': 3}))
+    rt = client('bedrock-runtime', region)
     messages = [{"role": "user", "content": [{"text": "Stream three short words: one two three."}]}]
     acc = []
+    stop_reason = None
     resp = rt.converse_stream(
         modelId=model_id,
         messages=messages,
@@ -70,6 +72,7 @@ def test_converse_stream(region, model_id):
             if t:
                 acc.append(t)
         elif 'messageStop' in event:
+            stop_reason = event['messageStop'].get('stopReason')
             break
     try:
         close = getattr(stream, 'close', None)
@@ -77,11 +80,11 @@ def test_converse_stream(region, model_id):
             close()
     except Exception:
         pass
-    return ''.join(acc).strip()
+    return ''.join(acc).strip(), stop_reason
 
 
 def test_embedding(region, embedding_model_id, text="Bedrock embeddings quick check"):
-    rt = boto3.client('bedrock-runtime', region_name=region)
+    rt = client('bedrock-runtime', region)
     body = json.dumps({"inputText": text, "dimensions": 1024})
     resp = rt.invoke_model(modelId=embedding_model_id, body=body)
     payload = json.loads(resp['body'].read())
@@ -117,19 +120,14 @@ def main():
         print(json.dumps(result, indent=2))
         raise
 
-    # Converse (non-stream)
-    try:
-        text = test_converse(region, chat_model)
-        result['chat']['converse_text'] = text
-        result['chat']['ok'] = bool(text)
-    except Exception as e:
-        result['chat']['error_converse'] = str(e)
-
-    # Converse stream
+    # Converse stream: one inference checks both chat and streaming; a messageStop
+    # event means the full response was assembled
     try:
-        text_s = test_converse_stream(region, chat_model)
+        text_s, stop_reason = test_converse_stream(region, chat_model)
         result['chat']['converse_stream_text'] = text_s
+        result['chat']['stop_reason'] = stop_reason
         result['chat']['stream_ok'] = bool(text_s)
+        result['chat']['ok'] = bool(text_s) and stop_reason is not None
     except Exception as e:
         result['chat']['error_stream'] = str(e)
 
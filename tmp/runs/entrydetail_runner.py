@@ -3,16 +3,73 @@ import json
 import time
 import base64
 import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
 import uuid
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import fitz  # PyMuPDF
-from PyPDF2 import PdfReader
+
+# orjson writes the multi-megabyte base64 image payload and the run artifacts straight to
+# bytes and parses model output faster; stdlib fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dumpb(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def write_json(path, obj):
+    """Write `obj` to `path` as indented JSON."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
 
 
 OLLAMA_NATIVE_API = os.environ.get("OLLAMA_NATIVE_API", "http://localhost:11434/api")
 MODEL = os.environ.get("VISION_MODEL_NAME", "gemma3:12b")
+# Pages go to the model as JPEG: much faster to encode and smaller to send than PNG
+JPEG_QUALITY = int(os.environ.get("RENDER_JPEG_QUALITY", "85"))
+# Pixel budget per rendered page; the vision model downsamples anything larger anyway
+MAX_PAGE_PIXELS = int(os.environ.get("RENDER_MAX_PIXELS", str(1600 * 1200)))
+# Bound generation: past runs used <900 output tokens and <2500 prompt tokens
+NUM_PREDICT = int(os.environ.get("NUM_PREDICT", "1536"))
+NUM_CTX = int(os.environ.get("NUM_CTX", "4096"))
+# request.json (payload with images stubbed out) is a debugging artifact; SAVE_REQUEST=0 skips it
+SAVE_REQUEST = os.environ.get("SAVE_REQUEST", "1") != "0"
+# Documents in flight at once; keep it at or below the server's OLLAMA_NUM_PARALLEL
+RUN_CONCURRENCY = max(1, int(os.environ.get("RUN_CONCURRENCY", "2")))
+# One keep-alive pool shared by every job (documents run concurrently, see main);
+# gateway errors from a warming model are retried, as in the backend
+SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        read=0,  # a read timeout means the model was generating; replaying would rerun it
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+)
+SESSION.mount("http://", _http_adapter)
+SESSION.mount("https://", _http_adapter)
 AGENT_VERSION = os.environ.get("AGENT_VERSION", "v1")
 
 
@@ -20,26 +77,57 @@ def utcnow_iso():
     return datetime.now(timezone.utc).isoformat()
 
 
-def sha256_file(path):
-    h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            h.update(chunk)
-    return h.hexdigest()
+_render_pool = None
+_render_pool_lock = threading.Lock()
 
 
-def render_pdf_to_images_b64(file_path: str, scale: float = 1.6, max_pages: int = 2):
-    images_b64 = []
-    doc = fitz.open(file_path)
-    pages = range(min(max_pages, len(doc)))
-    mat = fitz.Matrix(scale, scale)
-    for i in pages:
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        png_bytes = pix.tobytes("png")
-        images_b64.append(base64.b64encode(png_bytes).decode("utf-8"))
-    doc.close()
-    return images_b64
+def _encode_page(doc, page_index: int, scale: float) -> bytes:
+    page = doc.load_page(page_index)
+    # Large-format pages get a smaller scale so the raster stays within MAX_PAGE_PIXELS
+    area = page.rect.width * page.rect.height
+    if area > 0:
+        scale = min(scale, (MAX_PAGE_PIXELS / area) ** 0.5)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+
+
+def _render_page(pdf_bytes: bytes, page_index: int, scale: float) -> bytes:
+    # Runs in a worker process; MuPDF holds the GIL, so threads would not overlap pages.
+    # The worker gets the bytes the parent already read rather than rereading the file.
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return _encode_page(doc, page_index, scale)
+
+
+def open_pdf(path: str):
+    """Read the PDF once: (sha256 of its bytes, the bytes, parsed fitz document)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), data, fitz.open(stream=data, filetype="pdf")
+
+
+def render_pdf_to_images_b64(file_path: str, scale: float = 1.6, max_pages: int = 2, doc=None, data: bytes = None):
+    """Base64 page images; pass the `data` and `doc` from open_pdf to skip rereading and reparsing the file."""
+    global _render_pool
+    if data is None:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    if doc is None:
+        with fitz.open(stream=data, filetype="pdf") as opened:
+            return render_pdf_to_images_b64(file_path, scale, max_pages, doc=opened, data=data)
+    num_pages = min(max_pages, doc.page_count)
+    pages = range(num_pages)
+    if num_pages > 1:
+        # One page per task on a pool reused across documents; the parent base64-encodes
+        with _render_pool_lock:
+            if _render_pool is None:
+                # Jobs run on threads, so don't fork workers from this process (see main)
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _render_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                   mp_context=multiprocessing.get_context(method))
+        images = _render_pool.map(_render_page, [data] * num_pages, pages, [scale] * num_pages)
+    else:
+        images = (_encode_page(doc, i, scale) for i in pages)
+    return [base64.b64encode(img_bytes).decode("utf-8") for img_bytes in images]
 
 
 def ensure_dir(path):
@@ -134,6 +222,21 @@ def format_schema_wrapper(inner_schema: dict = None):
     }
 
 
+# Built once per process; every job sends the same wrapper grammar
+_WRAPPER_SCHEMA = format_schema_wrapper()
+
+SYS_PROMPT_PATH = 'data/derived/entrydetail.system.txt'
+USER_GUIDE_PATH = 'data/derived/entrydetail.user-guidance.txt'
+
+# Prompts are read once per process; if they are missing at import, run_job retries the
+# read so the error surfaces per document as before
+try:
+    SYS_PROMPT = load_text(SYS_PROMPT_PATH)
+    USER_GUIDE = load_text(USER_GUIDE_PATH)
+except OSError:
+    SYS_PROMPT = USER_GUIDE = None
+
+
 def local_validate_entrydetail(data_obj):
     report = {"schema_ok": True, "missing_required": [], "warnings": []}
 
@@ -157,16 +260,18 @@ def local_validate_entrydetail(data_obj):
     lines = data_obj.get("lines", []) or []
     if not isinstance(lines, list) or len(lines) < 1:
         report["missing_required"].append("lines[1]")
-    for i, line in enumerate(lines):
-        qty = (line or {}).get("quantity", []) or []
-        if len(qty) != 2:
+    # Non-list values were already reported above; non-dict lines are checked as empty
+    for i, line in enumerate(lines if isinstance(lines, list) else ()):
+        ld = line if isinstance(line, dict) else {}
+        qty = ld.get("quantity")
+        if not isinstance(qty, list) or len(qty) != 2:
             report["warnings"].append(f"line[{i}].quantity should contain exactly 2 records")
 
         # minima checks
-        total_qty = (line or {}).get("totalQty")
+        total_qty = ld.get("totalQty")
         if isinstance(total_qty, (int, float)) and total_qty < 1.0:
             report["warnings"].append(f"line[{i}].totalQty < 1.0 (min)")
-        value_amt = (line or {}).get("valueGoodsAmt")
+        value_amt = ld.get("valueGoodsAmt")
         if isinstance(value_amt, (int, float)) and value_amt < 0.01:
             report["warnings"].append(f"line[{i}].valueGoodsAmt < 0.01 (min)")
 
@@ -174,23 +279,88 @@ def local_validate_entrydetail(data_obj):
     return report
 
 
+def generate_streamed(payload: dict, timeout: float, response_path: str):
+    """POST a streaming /api/generate request, appending tokens to `response_path` as they arrive.
+
+    Returns (status_code, raw): `raw` is the JSON of the final event with the full text
+    under "response", i.e. what a non-streamed call would have returned.
+    """
+    payload = dict(payload, stream=True)
+    parts = []
+    with SESSION.post(
+        f"{OLLAMA_NATIVE_API}/generate",
+        data=_json_dumpb(payload),
+        headers={"Content-Type": "application/json"},
+        stream=True,
+        timeout=timeout,
+    ) as r:
+        if r.status_code != 200:
+            return r.status_code, r.text
+        final = {}
+        with open(response_path, 'w', encoding='utf-8') as out:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                event = _json_loads(line)
+                if event.get('error'):
+                    return r.status_code, line.decode('utf-8')
+                fragment = event.get('response', '')
+                parts.append(fragment)
+                out.write(fragment)
+                if event.get('done'):
+                    final = event
+                    break
+    final['response'] = ''.join(parts)
+    return r.status_code, _json_dumpb(final).decode('utf-8')
+
+
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+def _warm_model():
+    try:
+        # An empty prompt only loads the weights; keep_alive holds them for the whole run
+        SESSION.post(
+            f"{OLLAMA_NATIVE_API}/generate",
+            data=_json_dumpb({"model": MODEL, "prompt": "", "keep_alive": "30m"}),
+            headers={"Content-Type": "application/json"},
+            timeout=120,
+        ).close()
+    except requests.RequestException:
+        pass
+
+
+def start_model_warmup():
+    """Load the model in the background (once per process) so it overlaps page rendering."""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_warm_model, name="model-warmup", daemon=True).start()
+
+
 def run_job(pdf_path: str, out_dir: str, max_pages: int = 2):
     ensure_dir(out_dir)
+    # One read and one parse serve the hash, the page count and the rendering
+    file_sha, data, doc = open_pdf(pdf_path)
     meta_doc = {
         "filename": os.path.basename(pdf_path),
-        "sha256": sha256_file(pdf_path),
-        "page_count": len(PdfReader(pdf_path).pages)
+        "sha256": file_sha,
+        "page_count": doc.page_count
     }
-    with open(os.path.join(out_dir, 'doc_meta.json'), 'w', encoding='utf-8') as f:
-        json.dump(meta_doc, f, indent=2)
+    write_json(os.path.join(out_dir, 'doc_meta.json'), meta_doc)
 
     # images
     t0 = time.time()
-    images = render_pdf_to_images_b64(pdf_path, scale=1.6, max_pages=max_pages)
+    start_model_warmup()
+    with doc:
+        images = render_pdf_to_images_b64(pdf_path, scale=1.6, max_pages=max_pages, doc=doc, data=data)
 
     # prompts
-    sys_prompt = load_text('data/derived/entrydetail.system.txt')
-    user_guidance = load_text('data/derived/entrydetail.user-guidance.txt')
+    sys_prompt = SYS_PROMPT if SYS_PROMPT is not None else load_text(SYS_PROMPT_PATH)
+    user_guidance = USER_GUIDE if USER_GUIDE is not None else load_text(USER_GUIDE_PATH)
     today = datetime.utcnow().date().isoformat()
     job_id = str(uuid.uuid4())
 
@@ -207,63 +377,57 @@ def run_job(pdf_path: str, out_dir: str, max_pages: int = 2):
 
     # structured output (wrapper only)
     # Use wrapper-only grammar enforcement; inner data will be steered by prompt skeleton
-    fmt = format_schema_wrapper()
-
     payload = {
         "model": MODEL,
         "prompt": prompt,
         "images": images,
-        "format": fmt,
-        "stream": False,
-        "options": {"temperature": 0.2}
+        "format": _WRAPPER_SCHEMA,
+        "stream": True,
+        "options": {"temperature": 0.2, "num_predict": NUM_PREDICT, "num_ctx": NUM_CTX}
     }
 
     # store request without raw images
-    redacted = dict(payload)
-    redacted['images'] = [f"<base64 {len(img)} chars>" for img in images]
-    with open(os.path.join(out_dir, 'request.json'), 'w', encoding='utf-8') as f:
-        json.dump(redacted, f, indent=2)
+    if SAVE_REQUEST:
+        redacted = {**payload, 'images': [f"<base64 {len(img)} chars>" for img in images]}
+        write_json(os.path.join(out_dir, 'request.json'), redacted)
 
     # call model (allow long warmup)
-    r = requests.post(f"{OLLAMA_NATIVE_API}/generate", json=payload, timeout=900)
+    status_code, raw = generate_streamed(payload, 900, os.path.join(out_dir, 'response.txt'))
     elapsed = time.time() - t0
     with open(os.path.join(out_dir, 'raw_response.json'), 'w', encoding='utf-8') as f:
-        f.write(r.text)
+        f.write(raw)
 
     result = {
-        'status_code': r.status_code,
+        'status_code': status_code,
         'elapsed_sec': elapsed,
         'ok': False,
         'error': None,
         'job_id': job_id
     }
 
+    obj = None
     try:
-        j = r.json()
+        j = _json_loads(raw)
         resp_text = j.get('response', '')
-        with open(os.path.join(out_dir, 'response.txt'), 'w', encoding='utf-8') as f:
-            f.write(resp_text)
-        obj = json.loads(resp_text)
+        obj = _json_loads(resp_text)
         result['ok'] = True
         result['model'] = j.get('model')
         result['done'] = j.get('done')
         result['done_reason'] = j.get('done_reason')
 
-        # write result pieces
-        with open(os.path.join(out_dir, 'result.wrapper.json'), 'w', encoding='utf-8') as f:
-            json.dump(obj, f, indent=2)
+        # write result pieces (the wrapper is written once, after meta post-processing)
         data_obj = obj.get('data', {})
-        with open(os.path.join(out_dir, 'result.data.json'), 'w', encoding='utf-8') as f:
-            json.dump(data_obj, f, indent=2)
+        write_json(os.path.join(out_dir, 'result.data.json'), data_obj)
 
-        # local validation
-        local_val = local_validate_entrydetail(data_obj)
-        with open(os.path.join(out_dir, 'local_validation.json'), 'w', encoding='utf-8') as f:
-            json.dump(local_val, f, indent=2)
+        # local validation; a non-object `data` is validated as empty
+        local_val = local_validate_entrydetail(data_obj if isinstance(data_obj, dict) else {})
+        write_json(os.path.join(out_dir, 'local_validation.json'), local_val)
         result['local_validation'] = local_val
 
         # meta post-processing: cap confidence when evidence missing; compute overall_confidence if absent
         meta = obj.setdefault('meta', {})
+        if not isinstance(meta, dict):
+            raise ValueError(f"meta is {type(meta).__name__}, not an object")
         fc = meta.get('field_confidence', []) or []
         fe = meta.get('field_evidence', []) or []
         # Build set of paths with evidence
@@ -276,34 +440,30 @@ def run_job(pdf_path: str, out_dir: str, max_pages: int = 2):
                     paths_with_evidence.add(p)
             except Exception:
                 pass
-        # Cap confidences for items without evidence
+        # Cap confidences for items without evidence and sum them in the same pass;
+        # a malformed entry makes the average unreliable, so it falls back to 0.5
+        total = 0.0
+        averagable = bool(fc)
         for item in fc:
             try:
-                p = item.get('path')
                 c = float(item.get('confidence', 0))
-                if p not in paths_with_evidence and c > 0.5:
-                    item['confidence'] = 0.5
-            except Exception:
+            except (AttributeError, TypeError, ValueError):
+                averagable = False
                 continue
+            if item.get('path') not in paths_with_evidence and c > 0.5:
+                item['confidence'] = c = 0.5
+            total += c
         # Compute overall confidence if missing
-        if fc:
-            try:
-                vals = [float(x.get('confidence', 0)) for x in fc]
-                overall = sum(vals) / max(len(vals), 1)
-                meta.setdefault('overall_confidence', overall)
-            except Exception:
-                meta.setdefault('overall_confidence', 0.5)
-        else:
-            meta.setdefault('overall_confidence', 0.5)
-
-        # persist updated wrapper
-        with open(os.path.join(out_dir, 'result.wrapper.json'), 'w', encoding='utf-8') as f:
-            json.dump(obj, f, indent=2)
+        meta.setdefault('overall_confidence', total / len(fc) if averagable else 0.5)
     except Exception as e:
         result['error'] = f'parse error: {e}'
+    finally:
+        # Persist the wrapper once: post-processed when that succeeded, as the model sent it
+        # otherwise, so it is there to debug whichever step failed
+        if obj is not None:
+            write_json(os.path.join(out_dir, 'result.wrapper.json'), obj)
 
-    with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2)
+    write_json(os.path.join(out_dir, 'summary.json'), result)
 
     return result
 
@@ -319,20 +479,25 @@ def main():
         '/app/uploads/AMJ64528UPS-4 cont..pdf'
     ]
 
+    # Jobs are independent and mostly wait on the model, so run them side by side, up to
+    # RUN_CONCURRENCY at a time so one Ollama instance is not flooded
     results = {}
-    for pdf in docs:
-        name = os.path.basename(pdf)
-        out_dir = os.path.join(base_run_dir, name.replace(' ', '_'))
-        print(f"Running: {name}")
-        try:
-            res = run_job(pdf, out_dir, max_pages=2)
-        except Exception as e:
-            res = {'status_code': -1, 'ok': False, 'error': str(e)}
-        results[name] = res
-        print(f" -> {res.get('status_code')} ok={res.get('ok')} elapsed={res.get('elapsed_sec')} error={res.get('error')}")
-
-    with open(os.path.join(base_run_dir, 'run_summary.json'), 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    with ThreadPoolExecutor(max_workers=min(len(docs), RUN_CONCURRENCY)) as pool:
+        futures = {}
+        for pdf in docs:
+            name = os.path.basename(pdf)
+            out_dir = os.path.join(base_run_dir, name.replace(' ', '_'))
+            print(f"Running: {name}")
+            futures[name] = pool.submit(run_job, pdf, out_dir, max_pages=2)
+        for name, future in futures.items():
+            try:
+                res = future.result()
+            except Exception as e:
+                res = {'status_code': -1, 'ok': False, 'error': str(e)}
+            results[name] = res
+            print(f"{name} -> {res.get('status_code')} ok={res.get('ok')} elapsed={res.get('elapsed_sec')} error={res.get('error')}")
+
+    write_json(os.path.join(base_run_dir, 'run_summary.json'), results)
     print("Run dir:", base_run_dir)
 
 
@@ -3,37 +3,128 @@ import json
 import time
 import base64
 import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import fitz  # PyMuPDF
-from PyPDF2 import PdfReader
 
+# orjson writes the multi-megabyte base64 image payload and the run artifacts straight to
+# bytes and parses model output faster; stdlib fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-OLLAMA_NATIVE_API = os.environ.get("OLLAMA_NATIVE_API", "http://localhost:11434/api")
-MODEL = os.environ.get("VISION_MODEL_NAME", "gemma3:12b")
+_json_loads = orjson.loads if orjson is not None else json.loads
 
 
-def sha256_file(path):
-    h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            h.update(chunk)
-    return h.hexdigest()
+def _json_dumpb(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def write_json(path, obj):
+    """Write `obj` to `path` as indented JSON."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
 
 
-def render_pdf_to_images_b64(file_path: str, scale: float = 1.75, max_pages: int = 1):
-    images_b64 = []
-    doc = fitz.open(file_path)
-    pages = range(min(max_pages, len(doc)))
-    mat = fitz.Matrix(scale, scale)
-    for i in pages:
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        png_bytes = pix.tobytes("png")
-        images_b64.append(base64.b64encode(png_bytes).decode("utf-8"))
-    doc.close()
-    return images_b64
+OLLAMA_NATIVE_API = os.environ.get("OLLAMA_NATIVE_API", "http://localhost:11434/api")
+MODEL = os.environ.get("VISION_MODEL_NAME", "gemma3:12b")
+# Pages go to the model as JPEG: much faster to encode and smaller to send than PNG
+JPEG_QUALITY = int(os.environ.get("RENDER_JPEG_QUALITY", "85"))
+# Pixel budget per rendered page; the vision model downsamples anything larger anyway
+MAX_PAGE_PIXELS = int(os.environ.get("RENDER_MAX_PIXELS", str(1600 * 1200)))
+# Bound generation: past runs used <900 output tokens and <2500 prompt tokens
+NUM_PREDICT = int(os.environ.get("NUM_PREDICT", "1536"))
+NUM_CTX = int(os.environ.get("NUM_CTX", "4096"))
+# request.json (payload with images stubbed out) is a debugging artifact; SAVE_REQUEST=0 skips it
+SAVE_REQUEST = os.environ.get("SAVE_REQUEST", "1") != "0"
+# Documents in flight at once; keep it at or below the server's OLLAMA_NUM_PARALLEL
+RUN_CONCURRENCY = max(1, int(os.environ.get("RUN_CONCURRENCY", "2")))
+# BATCH_DOCS=1 sends all documents in one multi-image request (one model warmup and TTFB)
+# instead of one request per document
+BATCH_DOCS = os.environ.get("BATCH_DOCS", "0") == "1"
+# One keep-alive pool shared by every job (documents run concurrently, see main);
+# gateway errors from a warming model are retried, as in the backend
+SESSION = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        read=0,  # a read timeout means the model was generating; replaying would rerun it
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+)
+SESSION.mount("http://", _http_adapter)
+SESSION.mount("https://", _http_adapter)
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _encode_page(doc, page_index: int, scale: float) -> bytes:
+    page = doc.load_page(page_index)
+    # Large-format pages get a smaller scale so the raster stays within MAX_PAGE_PIXELS
+    area = page.rect.width * page.rect.height
+    if area > 0:
+        scale = min(scale, (MAX_PAGE_PIXELS / area) ** 0.5)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+
+
+def _render_page(pdf_bytes: bytes, page_index: int, scale: float) -> bytes:
+    # Runs in a worker process; MuPDF holds the GIL, so threads would not overlap pages.
+    # The worker gets the bytes the parent already read rather than rereading the file.
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return _encode_page(doc, page_index, scale)
+
+
+def open_pdf(path: str):
+    """Read the PDF once: (sha256 of its bytes, the bytes, parsed fitz document)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), data, fitz.open(stream=data, filetype="pdf")
+
+
+def render_pdf_to_images_b64(file_path: str, scale: float = 1.75, max_pages: int = 1, doc=None, data: bytes = None):
+    """Base64 page images; pass the `data` and `doc` from open_pdf to skip rereading and reparsing the file."""
+    global _render_pool
+    if data is None:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    if doc is None:
+        with fitz.open(stream=data, filetype="pdf") as opened:
+            return render_pdf_to_images_b64(file_path, scale, max_pages, doc=opened, data=data)
+    num_pages = min(max_pages, doc.page_count)
+    pages = range(num_pages)
+    if num_pages > 1:
+        # One page per task on a pool reused across documents; the parent base64-encodes
+        with _render_pool_lock:
+            if _render_pool is None:
+                # Jobs run on threads, so don't fork workers from this process (see main)
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _render_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                   mp_context=multiprocessing.get_context(method))
+        images = _render_pool.map(_render_page, [data] * num_pages, pages, [scale] * num_pages)
+    else:
+        images = (_encode_page(doc, i, scale) for i in pages)
+    return [base64.b64encode(img_bytes).decode("utf-8") for img_bytes in images]
 
 
 def load(path):
@@ -50,25 +141,108 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
-def run_job(pdf_path: str, out_dir: str, max_pages: int = 1):
+SYSTEM_PROMPT_PATH = '/app/tmp/prompts/shipping_label.system.txt'
+SHIP_SCHEMA_PATH = '/app/tmp/contracts/shipping_label.v1.schema.json'
+
+# Prompt and schema are read once per process; if they are missing at import, run_job
+# retries the read so the error surfaces per document as before
+try:
+    SYSTEM_PROMPT = load(SYSTEM_PROMPT_PATH)
+    SHIP_SCHEMA = load_json(SHIP_SCHEMA_PATH)
+except (OSError, ValueError):
+    SYSTEM_PROMPT = SHIP_SCHEMA = None
+
+
+def generate_streamed(payload: dict, timeout: float, response_path: str):
+    """POST a streaming /api/generate request, appending tokens to `response_path` as they arrive.
+
+    Returns (status_code, raw): `raw` is the JSON of the final event with the full text
+    under "response", i.e. what a non-streamed call would have returned.
+    """
+    payload = dict(payload, stream=True)
+    parts = []
+    with SESSION.post(
+        f"{OLLAMA_NATIVE_API}/generate",
+        data=_json_dumpb(payload),
+        headers={"Content-Type": "application/json"},
+        stream=True,
+        timeout=timeout,
+    ) as r:
+        if r.status_code != 200:
+            return r.status_code, r.text
+        final = {}
+        with open(response_path, 'w', encoding='utf-8') as out:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                event = _json_loads(line)
+                if event.get('error'):
+                    return r.status_code, line.decode('utf-8')
+                fragment = event.get('response', '')
+                parts.append(fragment)
+                out.write(fragment)
+                if event.get('done'):
+                    final = event
+                    break
+    final['response'] = ''.join(parts)
+    return r.status_code, _json_dumpb(final).decode('utf-8')
+
+
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+def _warm_model():
+    try:
+        # An empty prompt only loads the weights; keep_alive holds them for the whole run
+        SESSION.post(
+            f"{OLLAMA_NATIVE_API}/generate",
+            data=_json_dumpb({"model": MODEL, "prompt": "", "keep_alive": "30m"}),
+            headers={"Content-Type": "application/json"},
+            timeout=120,
+        ).close()
+    except requests.RequestException:
+        pass
+
+
+def start_model_warmup():
+    """Load the model in the background (once per process) so it overlaps page rendering."""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_warm_model, name="model-warmup", daemon=True).start()
+
+
+def prepare_doc(pdf_path: str, out_dir: str, max_pages: int = 1):
+    """Write meta.json and images.count for one document; returns (meta, base64 page images, render start time)."""
     ensure_dir(out_dir)
     meta = {}
     meta['filename'] = os.path.basename(pdf_path)
-    meta['sha256'] = sha256_file(pdf_path)
-    meta['page_count'] = len(PdfReader(pdf_path).pages)
+    # One read and one parse serve the hash, the page count and the rendering
+    file_sha, data, doc = open_pdf(pdf_path)
+    meta['sha256'] = file_sha
+    meta['page_count'] = doc.page_count
 
     # Save meta
-    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
-        json.dump(meta, f, indent=2)
+    write_json(os.path.join(out_dir, 'meta.json'), meta)
 
-    # Render images
+    # Render images; elapsed_sec is measured from here
     t0 = time.time()
-    images = render_pdf_to_images_b64(pdf_path, scale=1.75, max_pages=max_pages)
+    start_model_warmup()
+    with doc:
+        images = render_pdf_to_images_b64(pdf_path, scale=1.75, max_pages=max_pages, doc=doc, data=data)
     with open(os.path.join(out_dir, 'images.count'), 'w') as f:
         f.write(str(len(images)))
+    return meta, images, t0
 
-    system_prompt = load('/app/tmp/prompts/shipping_label.system.txt')
-    schema = load_json('/app/tmp/contracts/shipping_label.v1.schema.json')
+
+def run_job(pdf_path: str, out_dir: str, max_pages: int = 1):
+    meta, images, t0 = prepare_doc(pdf_path, out_dir, max_pages)
+
+    system_prompt = SYSTEM_PROMPT if SYSTEM_PROMPT is not None else load(SYSTEM_PROMPT_PATH)
+    schema = SHIP_SCHEMA if SHIP_SCHEMA is not None else load_json(SHIP_SCHEMA_PATH)
 
     user_instructions = (
         "Fill the contract for this document. Set doc.filename and doc.page_count exactly as provided. "
@@ -84,45 +258,43 @@ def run_job(pdf_path: str, out_dir: str, max_pages: int = 1):
         "prompt": prompt,
         "images": images,
         "format": schema,
-        "stream": False,
+        "stream": True,
         "options": {
-            "temperature": 0.2
+            "temperature": 0.2,
+            "num_predict": NUM_PREDICT,
+            "num_ctx": NUM_CTX
         }
     }
 
     # Save prompt/payload skeleton
-    with open(os.path.join(out_dir, 'request.json'), 'w', encoding='utf-8') as f:
-        req_copy = dict(payload)
-        req_copy['images'] = [f"<base64 {len(img)} chars>" for img in images]
-        f.write(json.dumps(req_copy, indent=2))
+    if SAVE_REQUEST:
+        req_copy = {**payload, 'images': [f"<base64 {len(img)} chars>" for img in images]}
+        write_json(os.path.join(out_dir, 'request.json'), req_copy)
 
     # Call model
-    r = requests.post(f"{OLLAMA_NATIVE_API}/generate", json=payload, timeout=600)
+    status_code, raw = generate_streamed(payload, 600, os.path.join(out_dir, 'response.txt'))
     elapsed = time.time() - t0
 
     with open(os.path.join(out_dir, 'raw_response.json'), 'w', encoding='utf-8') as f:
-        f.write(r.text)
+        f.write(raw)
 
     result = {
-        'status_code': r.status_code,
+        'status_code': status_code,
         'elapsed_sec': elapsed,
         'ok': False,
         'error': None
     }
 
     try:
-        j = r.json()
+        j = _json_loads(raw)
         result['ok'] = True
         result['model'] = j.get('model')
         result['done'] = j.get('done')
         result['done_reason'] = j.get('done_reason')
         resp_text = j.get('response', '')
-        with open(os.path.join(out_dir, 'response.txt'), 'w', encoding='utf-8') as f:
-            f.write(resp_text)
         try:
-            parsed = json.loads(resp_text)
-            with open(os.path.join(out_dir, 'result.json'), 'w', encoding='utf-8') as f:
-                json.dump(parsed, f, indent=2)
+            parsed = _json_loads(resp_text)
+            write_json(os.path.join(out_dir, 'result.json'), parsed)
             result['parsed'] = True
         except Exception as e:
             result['parsed'] = False
@@ -130,12 +302,99 @@ def run_job(pdf_path: str, out_dir: str, max_pages: int = 1):
     except Exception as e:
         result['error'] = f'bad json from service: {e}'
 
-    with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2)
+    write_json(os.path.join(out_dir, 'summary.json'), result)
 
     return result
 
 
+def run_batch(pdf_paths, out_dirs, max_pages: int = 1):
+    """Extract every document with one multi-image request; the model returns one contract per document.
+
+    Artifacts of the shared call go to the parent of the first out_dir under batch/;
+    result.json and summary.json are still written per document.
+    """
+    prepared = [prepare_doc(pdf, out_dir, max_pages) for pdf, out_dir in zip(pdf_paths, out_dirs)]
+    t0 = prepared[0][2]
+    batch_dir = os.path.join(os.path.dirname(out_dirs[0]), 'batch')
+    ensure_dir(batch_dir)
+
+    system_prompt = SYSTEM_PROMPT if SYSTEM_PROMPT is not None else load(SYSTEM_PROMPT_PATH)
+    schema = SHIP_SCHEMA if SHIP_SCHEMA is not None else load_json(SHIP_SCHEMA_PATH)
+
+    images = []
+    doc_lines = []
+    for n, (meta, doc_images, _) in enumerate(prepared, 1):
+        first = len(images) + 1
+        images.extend(doc_images)
+        doc_lines.append(
+            f"Document {n}: images {first}-{len(images)}; filename={meta['filename']}; page_count={meta['page_count']}."
+        )
+    user_instructions = (
+        f"The images belong to {len(prepared)} separate documents, listed below in order. "
+        "Return a JSON array with one contract per document, in the same order. "
+        "For each, set doc.filename and doc.page_count exactly as provided. "
+        "Use schema_id='shipping_label' and schema_version='1.0'. "
+        "Use null when a field is absent. Provide bbox and page (within that document) for each non-null field.\n"
+        + "\n".join(doc_lines) + "\n"
+    )
+
+    payload = {
+        "model": MODEL,
+        "prompt": system_prompt + "\n\n" + user_instructions,
+        "images": images,
+        "format": {"type": "array", "items": schema, "minItems": len(prepared), "maxItems": len(prepared)},
+        "stream": True,
+        "options": {
+            "temperature": 0.2,
+            "num_predict": NUM_PREDICT * len(prepared),
+            "num_ctx": NUM_CTX * len(prepared)
+        }
+    }
+
+    if SAVE_REQUEST:
+        req_copy = {**payload, 'images': [f"<base64 {len(img)} chars>" for img in images]}
+        write_json(os.path.join(batch_dir, 'request.json'), req_copy)
+
+    status_code, raw = generate_streamed(payload, 600 * len(prepared), os.path.join(batch_dir, 'response.txt'))
+    elapsed = time.time() - t0
+
+    with open(os.path.join(batch_dir, 'raw_response.json'), 'w', encoding='utf-8') as f:
+        f.write(raw)
+
+    base = {
+        'status_code': status_code,
+        'elapsed_sec': elapsed,
+        'ok': False,
+        'error': None,
+        'batched': len(prepared)
+    }
+    contracts = None
+    try:
+        j = _json_loads(raw)
+        base['ok'] = True
+        base['model'] = j.get('model')
+        base['done'] = j.get('done')
+        base['done_reason'] = j.get('done_reason')
+        try:
+            contracts = _json_loads(j.get('response', ''))
+            if not isinstance(contracts, list) or len(contracts) != len(prepared):
+                raise ValueError(f"expected an array of {len(prepared)} contracts")
+        except Exception as e:
+            contracts = None
+            base['error'] = f'parse error: {e}'
+    except Exception as e:
+        base['error'] = f'bad json from service: {e}'
+
+    results = []
+    for i, out_dir in enumerate(out_dirs):
+        result = dict(base, parsed=contracts is not None)
+        if contracts is not None:
+            write_json(os.path.join(out_dir, 'result.json'), contracts[i])
+        write_json(os.path.join(out_dir, 'summary.json'), result)
+        results.append(result)
+    return results
+
+
 def main():
     ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
     base_run_dir = f"/app/tmp/runs/{ts}"
@@ -148,16 +407,32 @@ def main():
     ]
 
     results = {}
-    for pdf in docs:
-        name = os.path.basename(pdf)
-        out_dir = os.path.join(base_run_dir, name.replace(' ', '_'))
-        print(f"Running: {name}")
-        res = run_job(pdf, out_dir, max_pages=1)
-        results[name] = res
-        print(f" -> {res['status_code']} parsed={res.get('parsed')} elapsed={res['elapsed_sec']:.1f}s error={res.get('error')}")
-
-    with open(os.path.join(base_run_dir, 'run_summary.json'), 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    if BATCH_DOCS:
+        names = [os.path.basename(pdf) for pdf in docs]
+        out_dirs = [os.path.join(base_run_dir, name.replace(' ', '_')) for name in names]
+        print(f"Running batch: {', '.join(names)}")
+        for name, res in zip(names, run_batch(docs, out_dirs, max_pages=1)):
+            results[name] = res
+            print(f"{name} -> {res['status_code']} parsed={res.get('parsed')} elapsed={res['elapsed_sec']:.1f}s error={res.get('error')}")
+        write_json(os.path.join(base_run_dir, 'run_summary.json'), results)
+        print("Run dir:", base_run_dir)
+        return
+
+    # Jobs are independent and mostly wait on the model, so run them side by side, up to
+    # RUN_CONCURRENCY at a time so one Ollama instance is not flooded
+    with ThreadPoolExecutor(max_workers=min(len(docs), RUN_CONCURRENCY)) as pool:
+        futures = {}
+        for pdf in docs:
+            name = os.path.basename(pdf)
+            out_dir = os.path.join(base_run_dir, name.replace(' ', '_'))
+            print(f"Running: {name}")
+            futures[name] = pool.submit(run_job, pdf, out_dir, max_pages=1)
+        for name, future in futures.items():
+            res = future.result()
+            results[name] = res
+            print(f"{name} -> {res['status_code']} parsed={res.get('parsed')} elapsed={res['elapsed_sec']:.1f}s error={res.get('error')}")
+
+    write_json(os.path.join(base_run_dir, 'run_summary.json'), results)
 
     print("Run dir:", base_run_dir)
 